@@ -1,15 +1,15 @@
+import logging
 import os
 import smtplib
-import time
 from dataclasses import dataclass
+from typing import TYPE_CHECKING, Optional, Tuple
 
-from agents import AgentOutputSchema
-from agents.models.openai_responses import Converter
 from iwf.command_request import CommandRequest, TimerCommand, InternalChannelCommand
 from iwf.command_results import CommandResults
 from iwf.communication import Communication
 from iwf.communication_schema import CommunicationSchema, CommunicationMethod
-from iwf.iwf_api.models import RetryPolicy, ChannelRequestStatus
+from iwf.errors import WorkflowAlreadyStartedError, WorkflowNotExistsError
+from iwf.iwf_api.models import ChannelRequestStatus, PersistenceLoadingPolicy, PersistenceLoadingType, RetryPolicy
 from iwf.persistence import Persistence
 from iwf.persistence_schema import PersistenceSchema, PersistenceField
 from iwf.rpc import rpc
@@ -19,8 +19,73 @@ from iwf.workflow import ObjectWorkflow
 from iwf.workflow_context import WorkflowContext
 from iwf.workflow_state import WorkflowState
 from iwf.workflow_state_options import WorkflowStateOptions
-from openai import OpenAI
-from pydantic import BaseModel
+
+from common.execute_cache import cache_execute_result
+from common.rate_limiter import DOWNSTREAM_OPENAI, DOWNSTREAM_SMTP, is_throttled, throttle, try_acquire
+from common.structured_logging import log_context
+from common.ttl_cache import TTLCache
+
+if TYPE_CHECKING:
+    # llm_backend imports pydantic, and the LLM SDKs when calling them. Only load it when an agent state runs
+    from llm_backend import AgentResponse, LLMResult
+
+logger = logging.getLogger(__name__)
+
+
+# represents the status of the current workflow execution, is one of below:
+# initialized, waiting, scheduled, sent, failed
+DA_STATUS = "Status"
+STATUS_INITIALIZED = "initialized"
+STATUS_WAITING = "waiting"
+STATUS_PROCESSING = "processing"
+STATUS_SENT = "sent"
+STATUS_FAILED = "failed"
+STATUS_CANCELED = "canceled"
+
+# store the request from user
+DA_CURRENT_REQUEST = "CurrentRequest"
+# store the request draft from user(automatically store/restore for user)
+DA_CURRENT_REQUEST_DRAFT = "RequestDraft"
+# store the last response id fom openai response API call
+DA_PREVIOUS_RESPONSE_ID = "PreviousResponseId"
+# store the generated email recipient
+DA_EMAIL_RECIPIENT = "EmailRecipient"
+# store the generated email subject
+DA_EMAIL_SUBJECT = "EmailSubject"
+# store the generated email body
+DA_EMAIL_BODY = "EmailBody"
+# store the generated scheduled time to send the email
+DA_SCHEDULED_TIME_SECONDS = "ScheduledTime"
+# the tenant of the workflow, to limit the concurrent LLM calls per tenant
+DA_TENANT = "Tenant"
+DEFAULT_TENANT = "default"
+# the id of the latest background LLM task
+DA_LLM_TASK_ID = "LlmTaskId"
+# the EmailSlotWorkflow that is going to send the email, if any
+DA_SEND_SLOT_WORKFLOW_ID = "SendSlotWorkflowId"
+
+# the RPCs only load the data attributes they read, instead of all of them(including the email body and draft)
+SEND_REQUEST_LOADING_POLICY = PersistenceLoadingPolicy(
+    persistence_loading_type=PersistenceLoadingType.LOAD_PARTIAL_WITHOUT_LOCKING,
+    partial_loading_keys=[DA_STATUS],
+)
+# the large values are blob references, so describe loads them as such, without the task and slot bookkeeping
+DESCRIBE_LOADING_POLICY = PersistenceLoadingPolicy(
+    persistence_loading_type=PersistenceLoadingType.LOAD_PARTIAL_WITHOUT_LOCKING,
+    partial_loading_keys=[
+        DA_STATUS, DA_CURRENT_REQUEST, DA_CURRENT_REQUEST_DRAFT, DA_PREVIOUS_RESPONSE_ID, DA_EMAIL_RECIPIENT,
+        DA_EMAIL_SUBJECT, DA_EMAIL_BODY, DA_SCHEDULED_TIME_SECONDS,
+    ],
+)
+LOAD_NONE_POLICY = PersistenceLoadingPolicy(persistence_loading_type=PersistenceLoadingType.LOAD_NONE)
+
+
+@dataclass
+class LLMTaskResult:
+    # to tell the result of the latest task from a late one that was already given up
+    task_id: str
+    response_id: Optional[str]
+    text: str
 
 
 @dataclass
@@ -36,6 +101,10 @@ class WorkflowDetails:
 
 
 class EmailAgentWorkflow(ObjectWorkflow):
+    # NOTE: the values of DA_CURRENT_REQUEST, DA_CURRENT_REQUEST_DRAFT and DA_EMAIL_BODY may be references to
+    # the blob store instead of the text itself, to keep them out of the workflow history and the callback payloads.
+    # Use blob_store.resolve to read the text only where it's needed.
+
     def get_persistence_schema(self) -> PersistenceSchema:
         return PersistenceSchema.create(
             PersistenceField.data_attribute_def(DA_STATUS, str),
@@ -45,23 +114,31 @@ class EmailAgentWorkflow(ObjectWorkflow):
             PersistenceField.data_attribute_def(DA_EMAIL_RECIPIENT, str),
             PersistenceField.data_attribute_def(DA_EMAIL_SUBJECT, str),
             PersistenceField.data_attribute_def(DA_EMAIL_BODY, str),
-            PersistenceField.data_attribute_def(DA_SCHEDULED_TIME_SECONDS, int)
+            PersistenceField.data_attribute_def(DA_SCHEDULED_TIME_SECONDS, int),
+            PersistenceField.data_attribute_def(DA_TENANT, str),
+            PersistenceField.data_attribute_def(DA_LLM_TASK_ID, str),
+            PersistenceField.data_attribute_def(DA_SEND_SLOT_WORKFLOW_ID, str),
         )
 
     def get_communication_schema(self) -> CommunicationSchema:
         return CommunicationSchema.create(
             CommunicationMethod.internal_channel_def(CH_USER_INPUT, str),
+            CommunicationMethod.internal_channel_def(CH_LLM_RESULT, LLMTaskResult),
+            CommunicationMethod.internal_channel_def(CH_EMAIL_SENT, bool),
         )
 
     def get_workflow_states(self) -> StateSchema:
         return StateSchema.with_starting_state(
             InitState(),
             AgentState(),
+            AgentThrottledState(),
+            AgentResultState(),
             ScheduleState(),
-            SendingState()
+            SendingState(),
+            SendingThrottledState()
         )
 
-    @rpc()
+    @rpc(data_attribute_loading_policy=SEND_REQUEST_LOADING_POLICY)
     def send_request(self, input: str, persistence: Persistence, communication: Communication) -> bool:
         status = persistence.get_data_attribute(DA_STATUS)
         if status == STATUS_WAITING:
@@ -72,7 +149,7 @@ class EmailAgentWorkflow(ObjectWorkflow):
         else:
             return False
 
-    @rpc()
+    @rpc(data_attribute_loading_policy=DESCRIBE_LOADING_POLICY)
     def describe(self, persistence: Persistence) -> WorkflowDetails:
         status = persistence.get_data_attribute(DA_STATUS)
         current_request = persistence.get_data_attribute(DA_CURRENT_REQUEST)
@@ -94,38 +171,42 @@ class EmailAgentWorkflow(ObjectWorkflow):
             send_time_seconds=send_time_seconds
         )
 
-    @rpc()
+    @rpc(data_attribute_loading_policy=LOAD_NONE_POLICY)
     def save_draft(self, draft: str, persistence: Persistence):
-        persistence.set_data_attribute(DA_CURRENT_REQUEST_DRAFT, draft)
+        from iwf_config import blob_store
+        persistence.set_data_attribute(DA_CURRENT_REQUEST_DRAFT, blob_store.offload(draft))
 
+    @rpc(data_attribute_loading_policy=LOAD_NONE_POLICY)
+    def receive_llm_result(self, result: LLMTaskResult, communication: Communication):
+        # called by the background LLM task when it's done
+        communication.publish_to_internal_channel(CH_LLM_RESULT, result)
 
-# represents the status of the current workflow execution, is one of below:
-# initialized, waiting, scheduled, sent, failed
-DA_STATUS = "Status"
-STATUS_INITIALIZED = "initialized"
-STATUS_WAITING = "waiting"
-STATUS_PROCESSING = "processing"
-STATUS_SENT = "sent"
-STATUS_FAILED = "failed"
-STATUS_CANCELED = "canceled"
+    @rpc(data_attribute_loading_policy=LOAD_NONE_POLICY)
+    def email_sent(self, sent: bool, communication: Communication):
+        # called by the EmailSlotWorkflow after trying to send the email
+        communication.publish_to_internal_channel(CH_EMAIL_SENT, sent)
 
-# store the request from user
-DA_CURRENT_REQUEST = "CurrentRequest"
-# store the request draft from user(automatically store/restore for user)
-DA_CURRENT_REQUEST_DRAFT = "RequestDraft"
-# store the last response id fom openai response API call
-DA_PREVIOUS_RESPONSE_ID = "PreviousResponseId"
-# store the generated email recipient
-DA_EMAIL_RECIPIENT = "EmailRecipient"
-# store the generated email subject
-DA_EMAIL_SUBJECT = "EmailSubject"
-# store the generated email body
-DA_EMAIL_BODY = "EmailBody"
-# store the generated scheduled time to send the email
-DA_SCHEDULED_TIME_SECONDS = "ScheduledTime"
 
 # a channel to send text request from user(to approve/revise/cancel the email)
 CH_USER_INPUT = "UserInput"
+# a channel to receive the result of the background LLM task
+CH_LLM_RESULT = "LlmResult"
+# a channel to receive whether the EmailSlotWorkflow has sent the email
+CH_EMAIL_SENT = "EmailSent"
+
+# if the background LLM task doesn't report back in time(e.g. the worker restarted), it's submitted again
+LLM_TASK_TIMEOUT_SECONDS = 120
+# if the EmailSlotWorkflow doesn't report back in time after the slot, the email is sent by the workflow itself
+SLOT_DISPATCH_GRACE_SECONDS = 600
+
+# the command requests that don't change are built once, instead of on every wait_until
+WAIT_FOR_USER_INPUT = CommandRequest.for_any_command_completed(
+    InternalChannelCommand.by_name(CH_USER_INPUT)
+)
+WAIT_FOR_LLM_RESULT = CommandRequest.for_any_command_completed(
+    InternalChannelCommand.by_name(CH_LLM_RESULT),
+    TimerCommand.by_seconds(LLM_TASK_TIMEOUT_SECONDS),
+)
 
 
 class InitState(WorkflowState[None]):
@@ -138,7 +219,7 @@ class InitState(WorkflowState[None]):
             communication: Communication,
     ) -> StateDecision:
         persistence.set_data_attribute(DA_STATUS, STATUS_INITIALIZED)
-        print(f"workflow started, id: {ctx.workflow_id}")
+        logger.info("workflow started, id: %s", ctx.workflow_id)
 
         google_email = os.environ.get('GOOGLE_EMAIL_ADDRESS')
         google_email_app_password = os.environ.get('GOOGLE_EMAIL_APP_PASSWORD')
@@ -149,48 +230,149 @@ class InitState(WorkflowState[None]):
         return StateDecision.single_next_state(AgentState)
 
 
+# a retried execute returns the decision of the attempt that timed out instead of calling the LLM again
+@cache_execute_result
 class AgentState(WorkflowState[None]):
     def wait_until(self, ctx: WorkflowContext, ignored: None, persistence: Persistence,
                    communication: Communication) -> CommandRequest:
         persistence.set_data_attribute(DA_STATUS, STATUS_WAITING)
-        return CommandRequest.for_any_command_completed(
-            InternalChannelCommand.by_name(CH_USER_INPUT)
-        )
+        return WAIT_FOR_USER_INPUT
 
     def execute(self, ctx: WorkflowContext, ignored: None, command_results: CommandResults, persistence: Persistence,
                 communication: Communication) -> StateDecision:
-        user_req = command_results.internal_channel_commands[0].value
-        agent_response = process_user_request(user_req, persistence)
-        if agent_response.cancel_operation:
-            persistence.set_data_attribute(DA_STATUS, STATUS_CANCELED)
-            return StateDecision.graceful_complete_workflow("cancel emailing")
-
-        if agent_response.email_send_time_unix_seconds > 0:
-            persistence.set_data_attribute(DA_SCHEDULED_TIME_SECONDS, agent_response.email_send_time_unix_seconds)
-        if agent_response.email_body:
-            persistence.set_data_attribute(DA_EMAIL_BODY, agent_response.email_body)
-        if agent_response.email_subject:
-            persistence.set_data_attribute(DA_EMAIL_SUBJECT, agent_response.email_subject)
-        if agent_response.email_recipient:
-            persistence.set_data_attribute(DA_EMAIL_RECIPIENT, agent_response.email_recipient)
+        from iwf_config import blob_store
 
-        send_time = persistence.get_data_attribute(DA_SCHEDULED_TIME_SECONDS)
-        recipient = persistence.get_data_attribute(DA_EMAIL_RECIPIENT)
-        body = persistence.get_data_attribute(DA_EMAIL_BODY)
-        if send_time and send_time > 0 and recipient and body:
-            # now we can schedule to send email
-            return StateDecision.single_next_state(ScheduleState)
-        else:
-            # otherwise get another request from user
-            return StateDecision.single_next_state(AgentState)
+        user_req = command_results.internal_channel_commands[0].value
+        persistence.set_data_attribute(DA_CURRENT_REQUEST, blob_store.offload(user_req))
+        if not try_acquire(DOWNSTREAM_OPENAI):
+            # rate limited, call the LLM after a timer
+            return StateDecision.single_next_state(AgentThrottledState)
+        return run_agent(ctx, user_req, persistence)
 
     def get_state_options(self) -> WorkflowStateOptions:
         return WorkflowStateOptions(
+            # wait_until doesn't read any data attribute
+            wait_until_api_data_attributes_loading_policy=LOAD_NONE_POLICY,
             # customize the timeout to let OpenAI run longer
             execute_api_timeout_seconds=90
         )
 
 
+@cache_execute_result
+class AgentThrottledState(WorkflowState[None]):
+    def wait_until(self, ctx: WorkflowContext, ignored: None, persistence: Persistence,
+                   communication: Communication) -> CommandRequest:
+        return throttle(DOWNSTREAM_OPENAI)
+
+    def execute(self, ctx: WorkflowContext, ignored: None, command_results: CommandResults, persistence: Persistence,
+                communication: Communication) -> StateDecision:
+        if is_throttled(command_results):
+            return StateDecision.single_next_state(AgentThrottledState)
+        from iwf_config import blob_store
+        user_req = blob_store.resolve(persistence.get_data_attribute(DA_CURRENT_REQUEST))
+        return run_agent(ctx, user_req, persistence)
+
+    def get_state_options(self) -> WorkflowStateOptions:
+        return WorkflowStateOptions(
+            wait_until_api_data_attributes_loading_policy=LOAD_NONE_POLICY,
+            execute_api_timeout_seconds=90
+        )
+
+
+class AgentResultState(WorkflowState[None]):
+    def wait_until(self, ctx: WorkflowContext, ignored: None, persistence: Persistence,
+                   communication: Communication) -> CommandRequest:
+        return WAIT_FOR_LLM_RESULT
+
+    def execute(self, ctx: WorkflowContext, ignored: None, command_results: CommandResults, persistence: Persistence,
+                communication: Communication) -> StateDecision:
+        channel_result = command_results.internal_channel_commands[0]
+        if channel_result.status == ChannelRequestStatus.RECEIVED:
+            result = channel_result.value
+            if result.task_id != persistence.get_data_attribute(DA_LLM_TASK_ID):
+                # a late result of a task that was already submitted again, keep waiting for the latest one
+                return StateDecision.single_next_state(AgentResultState)
+            if isinstance(result.response_id, str):
+                persistence.set_data_attribute(DA_PREVIOUS_RESPONSE_ID, result.response_id)
+            from llm_backend import AgentResponse
+            return apply_agent_response(AgentResponse.model_validate_json(result.text), persistence)
+
+        # timer fired, the task may be lost
+        from iwf_config import blob_store
+        user_req = blob_store.resolve(persistence.get_data_attribute(DA_CURRENT_REQUEST))
+        submit_llm_task(ctx, user_req, persistence)
+        return StateDecision.single_next_state(AgentResultState)
+
+
+def run_agent(ctx: WorkflowContext, user_req: str, persistence: Persistence) -> StateDecision:
+    from iwf_config import llm_task_pool
+
+    if llm_task_pool is not None:
+        # don't hold the worker thread during the LLM call, the result will come back from the channel
+        submit_llm_task(ctx, user_req, persistence)
+        return StateDecision.single_next_state(AgentResultState)
+
+    agent_response = process_user_request(ctx.workflow_id, user_req, persistence)
+    return apply_agent_response(agent_response, persistence)
+
+
+def apply_agent_response(agent_response: "AgentResponse", persistence: Persistence) -> StateDecision:
+    from iwf_config import blob_store
+
+    if agent_response.cancel_operation:
+        persistence.set_data_attribute(DA_STATUS, STATUS_CANCELED)
+        return StateDecision.graceful_complete_workflow("cancel emailing")
+
+    if agent_response.email_send_time_unix_seconds > 0:
+        persistence.set_data_attribute(DA_SCHEDULED_TIME_SECONDS, agent_response.email_send_time_unix_seconds)
+    if agent_response.email_body:
+        persistence.set_data_attribute(DA_EMAIL_BODY, blob_store.offload(agent_response.email_body))
+    if agent_response.email_subject:
+        persistence.set_data_attribute(DA_EMAIL_SUBJECT, agent_response.email_subject)
+    if agent_response.email_recipient:
+        persistence.set_data_attribute(DA_EMAIL_RECIPIENT, agent_response.email_recipient)
+
+    send_time = persistence.get_data_attribute(DA_SCHEDULED_TIME_SECONDS)
+    recipient = persistence.get_data_attribute(DA_EMAIL_RECIPIENT)
+    body = persistence.get_data_attribute(DA_EMAIL_BODY)
+    if send_time and send_time > 0 and recipient and body:
+        # now we can schedule to send email
+        return StateDecision.single_next_state(ScheduleState)
+    else:
+        # otherwise get another request from user
+        return StateDecision.single_next_state(AgentState)
+
+
+def submit_llm_task(ctx: WorkflowContext, req: str, persistence: Persistence):
+    from iwf_config import llm_task_pool
+
+    # every state execution has a unique id
+    task_id = ctx.state_execution_id
+    persistence.set_data_attribute(DA_LLM_TASK_ID, task_id)
+    tenant = persistence.get_data_attribute(DA_TENANT) or DEFAULT_TENANT
+    # raises TaskRejectedError if the tenant or the pool is at capacity, so that the server retries it with backoff
+    llm_task_pool.submit(
+        tenant, run_llm_task, ctx.workflow_id, task_id, req, persistence.get_data_attribute(DA_PREVIOUS_RESPONSE_ID)
+    )
+
+
+def run_llm_task(workflow_id: str, task_id: str, req: str, previous_response_id: Optional[str]):
+    from iwf_config import client
+
+    # the pool threads don't inherit the log context of the callback that submitted the task
+    with log_context(workflow_id=workflow_id, llm_task_id=task_id):
+        try:
+            response_id, text = generate_with_cache(workflow_id, req, previous_response_id)
+            client.invoke_rpc(
+                workflow_id, EmailAgentWorkflow.receive_llm_result, LLMTaskResult(task_id, response_id, text)
+            )
+        except Exception:
+            # AgentResultState will submit it again after the timeout
+            logger.exception("background LLM task %s of %s failed", task_id, workflow_id)
+
+
+# a retried execute doesn't send the email again
+@cache_execute_result
 class SendingState(WorkflowState[None]):
     def execute(
             self,
@@ -200,41 +382,82 @@ class SendingState(WorkflowState[None]):
             persistence: Persistence,
             communication: Communication,
     ) -> StateDecision:
-        google_email = os.environ.get('GOOGLE_EMAIL_ADDRESS')
-        google_email_app_password = os.environ.get('GOOGLE_EMAIL_APP_PASSWORD')
+        if not try_acquire(DOWNSTREAM_SMTP):
+            # rate limited, send it after a timer
+            return StateDecision.single_next_state(SendingThrottledState)
+        return send(persistence)
 
-        smtp_server = smtplib.SMTP_SSL('smtp.gmail.com', 465)
-        smtp_server.ehlo()
-        smtp_server.login(google_email, google_email_app_password)
-
-        sent_to = persistence.get_data_attribute(DA_EMAIL_RECIPIENT)
-        subject = persistence.get_data_attribute(DA_EMAIL_SUBJECT)
-        body = persistence.get_data_attribute(DA_EMAIL_BODY)
+    def get_state_options(self) -> WorkflowStateOptions:
+        return WorkflowStateOptions(
+            # customize the backoff retry policy for sending email API
+            # by default it will retry forever
+            # in case of wrong API key, we want to stop it after a minute
+            execute_api_retry_policy=RetryPolicy(
+                maximum_attempts_duration_seconds=60,
+            )
+        )
 
-        message = 'Subject: {}\n\n{}'.format(subject, body)
 
-        smtp_server.sendmail(google_email, sent_to, message)
-        smtp_server.quit()
+@cache_execute_result
+class SendingThrottledState(WorkflowState[None]):
+    def wait_until(self, ctx: WorkflowContext, ignored: None, persistence: Persistence,
+                   communication: Communication) -> CommandRequest:
+        return throttle(DOWNSTREAM_SMTP)
 
-        persistence.set_data_attribute(DA_STATUS, STATUS_SENT)
-        return StateDecision.graceful_complete_workflow()
+    def execute(
+            self,
+            ctx: WorkflowContext,
+            ignored: None,
+            command_results: CommandResults,
+            persistence: Persistence,
+            communication: Communication,
+    ) -> StateDecision:
+        if is_throttled(command_results):
+            return StateDecision.single_next_state(SendingThrottledState)
+        return send(persistence)
 
     def get_state_options(self) -> WorkflowStateOptions:
         return WorkflowStateOptions(
-            # customize the backoff retry policy for sending email API
-            # by default it will retry forever
-            # in case of wrong API key, we want to stop it after a minute
+            wait_until_api_data_attributes_loading_policy=LOAD_NONE_POLICY,
             execute_api_retry_policy=RetryPolicy(
                 maximum_attempts_duration_seconds=60,
             )
         )
 
 
+def send(persistence: Persistence) -> StateDecision:
+    from iwf_config import blob_store
+
+    smtp_server, sender = open_smtp_session()
+
+    sent_to = persistence.get_data_attribute(DA_EMAIL_RECIPIENT)
+    subject = persistence.get_data_attribute(DA_EMAIL_SUBJECT)
+    body = blob_store.resolve(persistence.get_data_attribute(DA_EMAIL_BODY))
+
+    send_email(smtp_server, sender, sent_to, subject, body)
+    smtp_server.quit()
+
+    persistence.set_data_attribute(DA_STATUS, STATUS_SENT)
+    return StateDecision.graceful_complete_workflow()
+
+
 class ScheduleState(WorkflowState[None]):
     def wait_until(self, ctx: WorkflowContext, ignored: None, persistence: Persistence,
                    communication: Communication) -> CommandRequest:
+        from iwf_config import send_slot_seconds
+
         persistence.set_data_attribute(DA_STATUS, STATUS_WAITING)
         send_time = persistence.get_data_attribute(DA_SCHEDULED_TIME_SECONDS)
+        if send_slot_seconds > 0 and add_to_send_slot(ctx, persistence, send_time, send_slot_seconds):
+            return CommandRequest.for_any_command_completed(
+                # the EmailSlotWorkflow sends it together with the other emails of the same slot
+                InternalChannelCommand.by_name(CH_EMAIL_SENT),
+                InternalChannelCommand.by_name(CH_USER_INPUT),
+                # in case the slot never reports back
+                TimerCommand.by_seconds(
+                    get_timer_duration(send_time) + send_slot_seconds + SLOT_DISPATCH_GRACE_SECONDS
+                ),
+            )
         return CommandRequest.for_any_command_completed(
             # timer in iWF is durable, meaning that it will not be lost for any instance restarts
             TimerCommand.by_seconds(get_timer_duration(send_time)),
@@ -244,71 +467,153 @@ class ScheduleState(WorkflowState[None]):
 
     def execute(self, ctx: WorkflowContext, ignored: None, command_results: CommandResults, persistence: Persistence,
                 communication: Communication) -> StateDecision:
-        if command_results.internal_channel_commands[0].status == ChannelRequestStatus.RECEIVED:
+        for result in command_results.internal_channel_commands:
+            if result.status != ChannelRequestStatus.RECEIVED:
+                continue
+            if result.channel_name == CH_EMAIL_SENT:
+                if result.value:
+                    persistence.set_data_attribute(DA_STATUS, STATUS_SENT)
+                    return StateDecision.graceful_complete_workflow()
+                # the slot failed to send it, retry by itself
+                return StateDecision.single_next_state(SendingState)
+
+            if not remove_from_send_slot(ctx, persistence):
+                # the slot is already sending it, too late to change
+                logger.info("ignored the user input, the email is being sent")
+                return StateDecision.single_next_state(ScheduleState)
             # Go to agent state to process user input again
             # put the message back to the channel so that we can reuse the AgentState to process it.
             # Alternatively, we can process it in this state, but the code will be a little more complex.
-            communication.publish_to_internal_channel(CH_USER_INPUT, command_results.internal_channel_commands[0].value)
+            communication.publish_to_internal_channel(CH_USER_INPUT, result.value)
             return StateDecision.single_next_state(AgentState)
-        else:
-            # timer fired
-            return StateDecision.single_next_state(SendingState)
 
+        # timer fired. If the email was added to a slot, take it out first, so that the slot doesn't send it too
+        if take_from_send_slot(ctx, persistence):
+            persistence.set_data_attribute(DA_STATUS, STATUS_SENT)
+            return StateDecision.graceful_complete_workflow()
+        return StateDecision.single_next_state(SendingState)
+
+
+def add_to_send_slot(ctx: WorkflowContext, persistence: Persistence, send_time: int, slot_seconds: int) -> bool:
+    """Returns False if the slot of send_time is already closed"""
+    if persistence.get_data_attribute(DA_SEND_SLOT_WORKFLOW_ID):
+        # already added, e.g. ScheduleState is waiting again after ignoring a user input
+        return True
+
+    from email_slot_workflow import EmailSlotWorkflow, ScheduledEmail, get_dispatch_time, slot_workflow_id
+    from iwf_config import client
+
+    dispatch_time = get_dispatch_time(send_time, slot_seconds)
+    slot_wf_id = slot_workflow_id(dispatch_time)
+    email = ScheduledEmail(
+        workflow_id=ctx.workflow_id,
+        recipient=persistence.get_data_attribute(DA_EMAIL_RECIPIENT),
+        subject=persistence.get_data_attribute(DA_EMAIL_SUBJECT),
+        body=persistence.get_data_attribute(DA_EMAIL_BODY),
+    )
+    try:
+        added = client.invoke_rpc(slot_wf_id, EmailSlotWorkflow.add_email, email)
+    except WorkflowNotExistsError:
+        try:
+            client.start_workflow(EmailSlotWorkflow, slot_wf_id,
+                                  get_timer_duration(dispatch_time) + SLOT_DISPATCH_GRACE_SECONDS, dispatch_time)
+        except WorkflowAlreadyStartedError:
+            # started by another agent workflow of the same slot
+            pass
+        added = client.invoke_rpc(slot_wf_id, EmailSlotWorkflow.add_email, email)
+    if added:
+        persistence.set_data_attribute(DA_SEND_SLOT_WORKFLOW_ID, slot_wf_id)
+    return added
+
+
+def remove_from_send_slot(ctx: WorkflowContext, persistence: Persistence) -> bool:
+    """Returns False if the slot is already sending the email"""
+    slot_wf_id = persistence.get_data_attribute(DA_SEND_SLOT_WORKFLOW_ID)
+    if not slot_wf_id:
+        return True
+
+    from email_slot_workflow import EmailSlotWorkflow
+    from iwf_config import client
+
+    if not client.invoke_rpc(slot_wf_id, EmailSlotWorkflow.remove_email, ctx.workflow_id):
+        return False
+    persistence.set_data_attribute(DA_SEND_SLOT_WORKFLOW_ID, "")
+    return True
+
+
+def take_from_send_slot(ctx: WorkflowContext, persistence: Persistence) -> bool:
+    """Takes the email out of its slot, if any, to send it by itself. Returns True if the slot has already sent it"""
+    slot_wf_id = persistence.get_data_attribute(DA_SEND_SLOT_WORKFLOW_ID)
+    if not slot_wf_id:
+        return False
+
+    from email_slot_workflow import DA_RESULTS, EmailSlotWorkflow
+    from iwf_config import client
+
+    try:
+        sent = client.invoke_rpc(slot_wf_id, EmailSlotWorkflow.take_email, ctx.workflow_id)
+    except WorkflowNotExistsError:
+        # the slot has closed without notifying this workflow, read what it did with the email
+        try:
+            results = client.get_workflow_data_attributes(EmailSlotWorkflow, slot_wf_id, keys=[DA_RESULTS])
+        except RuntimeError:
+            # no results, the slot timed out before dispatching anything
+            results = {}
+        sent = DA_RESULTS in results and results[DA_RESULTS].sent.get(ctx.workflow_id, False)
+    persistence.set_data_attribute(DA_SEND_SLOT_WORKFLOW_ID, "")
+    return sent
+
+
+def open_smtp_session() -> Tuple[smtplib.SMTP_SSL, str]:
+    """Returns a logged-in SMTP session and the sender address"""
+    google_email = os.environ.get('GOOGLE_EMAIL_ADDRESS')
+    google_email_app_password = os.environ.get('GOOGLE_EMAIL_APP_PASSWORD')
+
+    smtp_server = smtplib.SMTP_SSL('smtp.gmail.com', 465)
+    smtp_server.ehlo()
+    smtp_server.login(google_email, google_email_app_password)
+    return smtp_server, google_email
+
+
+def send_email(smtp_server: smtplib.SMTP_SSL, sender: str, sent_to: str, subject: str, body: str):
+    message = 'Subject: {}\n\n{}'.format(subject, body)
+    smtp_server.sendmail(sender, sent_to, message)
+
+
+# the same request of a workflow on top of the same previous response gets the same answer, e.g. when the user resends
+# it or the state execution is retried. It's keyed by workflow id too: the first request of every workflow has no
+# previous response, and must not get the answer of another user's conversation. The TTL is short because relative
+# times like "in 2 hours" depend on when the request is made.
+AGENT_RESPONSE_CACHE_TTL_SECONDS = 60
+agent_response_cache = TTLCache(max_size=10000, ttl_seconds=AGENT_RESPONSE_CACHE_TTL_SECONDS)
+
+
+def process_user_request(workflow_id: str, req: str, persistence: Persistence) -> "AgentResponse":
+    from llm_backend import AgentResponse
+
+    response_id, resp = generate_with_cache(workflow_id, req, persistence.get_data_attribute(DA_PREVIOUS_RESPONSE_ID))
+    if isinstance(response_id, str):
+        persistence.set_data_attribute(DA_PREVIOUS_RESPONSE_ID, response_id)
+    return AgentResponse.model_validate_json(resp)
 
-class AgentResponse(BaseModel):
-    email_recipient: str | None
-    email_subject: str | None
-    email_body: str | None
-    email_send_time_unix_seconds: int | None
-    cancel_operation: bool | None
 
+def generate_with_cache(workflow_id: str, req: str, previous_response_id: Optional[str]) -> Tuple[Optional[str], str]:
+    cache_key = (workflow_id, previous_response_id, normalize_request(req))
+    cached = agent_response_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    result = do_process_user_request(req, previous_response_id)
+    agent_response_cache.put(cache_key, (result.response_id, result.text))
+    return result.response_id, result.text
 
-def process_user_request(req: str, persistence: Persistence) -> AgentResponse:
-    response = do_process_user_request(req, persistence.get_data_attribute(DA_PREVIOUS_RESPONSE_ID))
-    if isinstance(response.id, str):
-        persistence.set_data_attribute(DA_PREVIOUS_RESPONSE_ID, response.id)
 
-    resp = response.output[0].content[0].text
-    return AgentResponse.model_validate_json(resp)
+def normalize_request(req: str) -> str:
+    return " ".join(req.split())
 
 
-def do_process_user_request(req: str, previous_response_id: str | None):
-    client = OpenAI()
-
-    current_timestamp = int(time.time())
-    response = client.responses.create(
-        model="gpt-4o",
-        instructions=f"""
-        Help prepare an email to be sent. Based on user requests, return email's subject, body, recipient 
-        , sending time and/or cancel_operation, if any of them available. 
-        The email subject or body may need to be translated if user requests to.
-        The email subject and body must be complete, do not leave any place holders like [Your Name]. 
-        The email's recipient should be in a valid email format, other wise, return empty string for that field.
-        The sending time must be in unix timestamp in seconds. 
-        The current timestamp is {current_timestamp}.
-        User may use relative time description based on today/now, you should calculate the timestamp based on the current timestamp {current_timestamp}. 
-        For example, tomorrow means current timestamp plus 86400, 
-        X seconds later means {current_timestamp} + X, 
-        X minutes later means {current_timestamp} + X*60, 
-        X hours later means {current_timestamp} + X * 3600.
-        MAKE SURE the sending time is ALWAYS greater than the above provided current timestamp, if NOT, then it's wrong, you should always use current timestamp as the base. 
-        User may also ask to cancel the emailing operation, then return true for cancel_operation field.
-        All the fields are optional.
-        If there is no recipient, return empty string for the field.
-        If there is no body, return empty string for the field.
-        If there is no subject, return empty string for the field.
-        If there is no sending time, return 0 for the field.
-        If not asking to cancel emailing, return false for the field.
-        """,
-        input=req,
-        text=Converter.get_response_format(
-            AgentOutputSchema(AgentResponse)
-        ),
-        previous_response_id=previous_response_id
-    )
-    from pprint import pprint
-    pprint(response)
-    return response
+def do_process_user_request(req: str, previous_response_id: str | None) -> "LLMResult":
+    from iwf_config import get_llm_backend
+    return get_llm_backend().generate(req, previous_response_id)
 
 
 def get_timer_duration(send_time: int) -> int:
@@ -0,0 +1,262 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+
+from iwf.command_request import CommandRequest, TimerCommand
+from iwf.command_results import CommandResults
+from iwf.communication import Communication
+from iwf.iwf_api.models import PersistenceLoadingPolicy, PersistenceLoadingType
+from iwf.persistence import Persistence
+from iwf.persistence_schema import PersistenceField, PersistenceSchema
+from iwf.rpc import rpc
+from iwf.state_decision import StateDecision
+from iwf.state_schema import StateSchema
+from iwf.workflow import ObjectWorkflow
+from iwf.workflow_context import WorkflowContext
+from iwf.workflow_state import WorkflowState
+from iwf.workflow_state_options import WorkflowStateOptions
+
+from common.execute_cache import cache_execute_result
+from common.rate_limiter import DOWNSTREAM_SMTP, acquire_or_wait
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ScheduledEmail:
+    workflow_id: str
+    recipient: str
+    subject: str
+    # may be a reference to the blob store
+    body: str
+
+
+@dataclass
+class SlotEmails:
+    # by the id of the EmailAgentWorkflow
+    emails: Dict[str, ScheduledEmail]
+
+
+@dataclass
+class SlotResults:
+    # whether the email of each EmailAgentWorkflow is sent, for the emails the slot has dispatched
+    sent: Dict[str, bool]
+
+
+# the emails to send in this slot
+DA_EMAILS = "Emails"
+# set when the slot timer fired, no more emails can be added or removed
+DA_CLOSED = "Closed"
+# the emails already dispatched, so that a retried DispatchState doesn't send them again
+DA_RESULTS = "Results"
+
+# how many EmailAgentWorkflows to notify concurrently after sending
+NOTIFY_CONCURRENCY = 16
+# the emails sent by one DispatchState execution, a retried execution sends at most these again
+DISPATCH_BATCH_SIZE = 50
+
+# all the updates of the slot are serialized with the lock, so that they don't lose each other's updates,
+# and an email can't be taken out of the slot while its batch is being sent
+SLOT_LOCKING_POLICY = PersistenceLoadingPolicy(
+    persistence_loading_type=PersistenceLoadingType.LOAD_PARTIAL_WITH_EXCLUSIVE_LOCK,
+    partial_loading_keys=[DA_EMAILS, DA_CLOSED, DA_RESULTS],
+    locking_keys=[DA_EMAILS, DA_CLOSED, DA_RESULTS],
+)
+LOAD_NONE_POLICY = PersistenceLoadingPolicy(persistence_loading_type=PersistenceLoadingType.LOAD_NONE)
+
+
+class EmailSlotWorkflow(ObjectWorkflow):
+    """
+    Sends all the emails scheduled in the same time slot, with one durable timer and a few SMTP sessions
+    for the whole slot, instead of a timer and a SMTP session for every email.
+    The workflow id is "email-slot-<dispatch time>", see slot_workflow_id.
+    """
+
+    def get_workflow_states(self) -> StateSchema:
+        return StateSchema.with_starting_state(
+            SlotTimerState(),
+            DispatchState(),
+            DispatchThrottledState(),
+        )
+
+    def get_persistence_schema(self) -> PersistenceSchema:
+        return PersistenceSchema.create(
+            PersistenceField.data_attribute_def(DA_EMAILS, SlotEmails),
+            PersistenceField.data_attribute_def(DA_CLOSED, bool),
+            PersistenceField.data_attribute_def(DA_RESULTS, SlotResults),
+        )
+
+    @rpc(data_attribute_loading_policy=SLOT_LOCKING_POLICY)
+    def add_email(self, email: ScheduledEmail, persistence: Persistence) -> bool:
+        if persistence.get_data_attribute(DA_CLOSED):
+            return False
+        emails = persistence.get_data_attribute(DA_EMAILS) or SlotEmails({})
+        # keyed by the workflow id, so adding again(e.g. a retried wait_until) replaces it
+        emails.emails[email.workflow_id] = email
+        persistence.set_data_attribute(DA_EMAILS, emails)
+        return True
+
+    @rpc(data_attribute_loading_policy=SLOT_LOCKING_POLICY)
+    def remove_email(self, workflow_id: str, persistence: Persistence) -> bool:
+        if persistence.get_data_attribute(DA_CLOSED):
+            return False
+        emails = persistence.get_data_attribute(DA_EMAILS) or SlotEmails({})
+        emails.emails.pop(workflow_id, None)
+        persistence.set_data_attribute(DA_EMAILS, emails)
+        return True
+
+    @rpc(data_attribute_loading_policy=SLOT_LOCKING_POLICY)
+    def take_email(self, workflow_id: str, persistence: Persistence) -> bool:
+        """
+        Takes the email out of the slot, for its EmailAgentWorkflow to send it by itself, unless it's already
+        dispatched. Returns whether the slot has sent it.
+        """
+        results = persistence.get_data_attribute(DA_RESULTS) or SlotResults({})
+        if workflow_id in results.sent:
+            return results.sent[workflow_id]
+        emails = persistence.get_data_attribute(DA_EMAILS) or SlotEmails({})
+        if emails.emails.pop(workflow_id, None) is not None:
+            persistence.set_data_attribute(DA_EMAILS, emails)
+        return False
+
+
+class SlotTimerState(WorkflowState[int]):
+    def wait_until(self, ctx: WorkflowContext, dispatch_time: int, persistence: Persistence,
+                   communication: Communication) -> CommandRequest:
+        from ai_agent_workflow import get_timer_duration
+        return CommandRequest.for_all_command_completed(
+            TimerCommand.by_seconds(get_timer_duration(dispatch_time)),
+        )
+
+    def execute(self, ctx: WorkflowContext, dispatch_time: int, command_results: CommandResults,
+                persistence: Persistence, communication: Communication) -> StateDecision:
+        # close the slot first, so DispatchState sees the final list of emails
+        persistence.set_data_attribute(DA_CLOSED, True)
+        return StateDecision.single_next_state(DispatchState)
+
+    def get_state_options(self) -> WorkflowStateOptions:
+        # closed under the lock of add_email and remove_email, so that none of them is lost
+        return WorkflowStateOptions(execute_api_data_attributes_loading_policy=SLOT_LOCKING_POLICY)
+
+
+# a retried execute returns the decision of the attempt that timed out instead of sending its batch again
+@cache_execute_result
+class DispatchState(WorkflowState[None]):
+    def execute(self, ctx: WorkflowContext, ignored: None, command_results: CommandResults,
+                persistence: Persistence, communication: Communication) -> StateDecision:
+        from ai_agent_workflow import EmailAgentWorkflow
+        from iwf_config import client, smtp_sessions_per_slot
+
+        slot_results = persistence.get_data_attribute(DA_RESULTS) or SlotResults({})
+        pending = [
+            email for workflow_id, email in (persistence.get_data_attribute(DA_EMAILS) or SlotEmails({})).emails.items()
+            if workflow_id not in slot_results.sent
+        ]
+        emails = pending[:DISPATCH_BATCH_SIZE]
+        results, wait_seconds = send_emails(emails, smtp_sessions_per_slot)
+        slot_results.sent.update(results)
+        persistence.set_data_attribute(DA_RESULTS, slot_results)
+        logger.info("sent %d of %d emails, %d left", sum(results.values()), len(emails), len(pending) - len(results))
+
+        def notify(workflow_id: str):
+            try:
+                client.invoke_rpc(workflow_id, EmailAgentWorkflow.email_sent, results[workflow_id])
+            except Exception:
+                # the agent workflow falls back to send it by itself after a grace period
+                logger.exception("failed to notify %s", workflow_id)
+
+        with ThreadPoolExecutor(max_workers=NOTIFY_CONCURRENCY) as executor:
+            list(executor.map(notify, results))
+        if wait_seconds:
+            # rate limited, the rest of the slot is sent after a timer
+            return StateDecision.single_next_state(DispatchThrottledState, wait_seconds)
+        if len(pending) > len(results):
+            return StateDecision.single_next_state(DispatchState)
+        return StateDecision.graceful_complete_workflow(len(slot_results.sent))
+
+    def get_state_options(self) -> WorkflowStateOptions:
+        return WorkflowStateOptions(
+            # the emails of the batch can't be taken out of the slot while they are being sent
+            execute_api_data_attributes_loading_policy=SLOT_LOCKING_POLICY,
+            # a batch takes a while to send
+            execute_api_timeout_seconds=600,
+        )
+
+
+class DispatchThrottledState(WorkflowState[int]):
+    def wait_until(self, ctx: WorkflowContext, wait_seconds: int, persistence: Persistence,
+                   communication: Communication) -> CommandRequest:
+        return CommandRequest.for_all_command_completed(TimerCommand.by_seconds(wait_seconds))
+
+    def execute(self, ctx: WorkflowContext, wait_seconds: int, command_results: CommandResults,
+                persistence: Persistence, communication: Communication) -> StateDecision:
+        return StateDecision.single_next_state(DispatchState)
+
+    def get_state_options(self) -> WorkflowStateOptions:
+        return WorkflowStateOptions(
+            wait_until_api_data_attributes_loading_policy=LOAD_NONE_POLICY,
+            execute_api_data_attributes_loading_policy=LOAD_NONE_POLICY,
+        )
+
+
+def send_emails(emails: List[ScheduledEmail], sessions: int) -> Tuple[Dict[str, bool], int]:
+    """
+    Sends the emails over at most `sessions` concurrent SMTP sessions, each with a token of the rate limiter.
+    Returns if each workflow's email is sent, without the emails left for later when the tokens ran out, and the
+    seconds to wait for the next token then(0 if all were sent)
+    """
+    chunks = [emails[i::sessions] for i in range(sessions) if emails[i::sessions]]
+    results: Dict[str, bool] = {}
+    wait_seconds = 0
+    if not chunks:
+        return results, wait_seconds
+    with ThreadPoolExecutor(max_workers=len(chunks)) as executor:
+        for chunk_results, chunk_wait_seconds in executor.map(send_chunk, chunks):
+            results.update(chunk_results)
+            wait_seconds = max(wait_seconds, chunk_wait_seconds)
+    return results, wait_seconds
+
+
+def send_chunk(emails: List[ScheduledEmail]) -> Tuple[Dict[str, bool], int]:
+    from ai_agent_workflow import open_smtp_session, send_email
+    from iwf_config import blob_store
+
+    results: Dict[str, bool] = {}
+    # the session is opened once there is a token for the first email
+    session = None
+    try:
+        for email in emails:
+            wait_seconds = acquire_or_wait(DOWNSTREAM_SMTP)
+            if wait_seconds:
+                return results, wait_seconds
+            if session is None:
+                try:
+                    session = open_smtp_session()
+                except Exception:
+                    logger.exception("failed to open SMTP session for %d emails", len(emails))
+                    # none of the chunk can be sent
+                    return {failed.workflow_id: False for failed in emails}, 0
+            smtp_server, sender = session
+            try:
+                send_email(smtp_server, sender, email.recipient, email.subject, blob_store.resolve(email.body))
+                results[email.workflow_id] = True
+            except Exception:
+                logger.exception("failed to send email of %s", email.workflow_id)
+                results[email.workflow_id] = False
+    finally:
+        if session is not None:
+            try:
+                session[0].quit()
+            except Exception:
+                logger.exception("failed to close SMTP session")
+    return results, 0
+
+
+def slot_workflow_id(dispatch_time: int) -> str:
+    return f"email-slot-{dispatch_time}"
+
+
+def get_dispatch_time(send_time: int, slot_seconds: int) -> int:
+    # round up to the end of the slot, so that an email is never sent earlier than scheduled
+    return -(-send_time // slot_seconds) * slot_seconds
@@ -1,13 +1,56 @@
+import os
+
 from iwf.client import Client
-from iwf.registry import Registry
-from iwf.worker_service import (
-    WorkerService,
-)
+from iwf.client_options import ClientOptions
+from iwf.worker_service import WorkerOptions
+
+from common.background_tasks import BoundedTaskPool
+from common.blob_store import FileBlobStore
+from common.execute_cache import CachingWorkerService, execute_result_cache_from_env
+from common.lazy_registry import LazyRegistry
+from common.payload_encoder import object_encoder_from_env
+from common.priority_lanes import priority_lanes_from_env
+
+object_encoder = object_encoder_from_env()
+client_options = ClientOptions.local_default()
+client_options.object_encoder = object_encoder
+
+registry = LazyRegistry()
+# the execute callbacks of the @cache_execute_result states aren't executed again when retried
+worker_service = CachingWorkerService(registry, WorkerOptions(object_encoder), priority_lanes_from_env(),
+                                      execute_result_cache_from_env())
+client = Client(registry, client_options)
+
+# the workflows are imported and registered on first use
+registry.add_lazy_workflow("EmailAgentWorkflow", "ai_agent_workflow:EmailAgentWorkflow")
+registry.add_lazy_workflow("EmailSlotWorkflow", "email_slot_workflow:EmailSlotWorkflow")
+
+# large texts(email body, user request and draft) are stored here, with only the reference in data attributes
+blob_store = FileBlobStore(os.environ.get("AI_AGENT_BLOB_DIR", "ai_agent_blobs"))
+
+# set AI_AGENT_LLM_BACKEND=fake to run without OpenAI, e.g. for load testing.
+# It's created by get_llm_backend on first use, so that the LLM SDKs are only imported when an AgentState runs
+llm_backend = None
+
+
+def get_llm_backend():
+    global llm_backend
+    if llm_backend is None:
+        from llm_backend import llm_backend_from_env
+        llm_backend = llm_backend_from_env()
+    return llm_backend
 
-from ai_agent_workflow import EmailAgentWorkflow
 
-registry = Registry()
-worker_service = WorkerService(registry)
-client = Client(registry)
+# set AI_AGENT_ASYNC_LLM=true to run the LLM calls in background threads instead of the AgentState execute callback,
+# so that slow generations don't take all the worker threads from the other callbacks
+llm_task_pool = BoundedTaskPool(
+    max_workers=int(os.environ.get("AI_AGENT_LLM_THREADS", 16)),
+    max_pending=int(os.environ.get("AI_AGENT_LLM_MAX_PENDING", 256)),
+    max_pending_per_key=int(os.environ.get("AI_AGENT_LLM_MAX_PENDING_PER_TENANT", 16)),
+) if os.environ.get("AI_AGENT_ASYNC_LLM", "false").lower() == "true" else None
 
-registry.add_workflow(EmailAgentWorkflow())
+# set AI_AGENT_SEND_SLOT_SECONDS to send the scheduled emails in slots of that many seconds, by one EmailSlotWorkflow
+# per slot, instead of a timer and a SMTP session for every email. Emails are sent at the end of their slot.
+send_slot_seconds = int(os.environ.get("AI_AGENT_SEND_SLOT_SECONDS", 0))
+# the concurrent SMTP sessions to send the emails of a slot
+smtp_sessions_per_slot = int(os.environ.get("AI_AGENT_SMTP_SESSIONS_PER_SLOT", 4))
@@ -0,0 +1,163 @@
+import hashlib
+import logging
+import math
+import os
+import random
+import re
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+
+class AgentResponse(BaseModel):
+    email_recipient: str | None
+    email_subject: str | None
+    email_body: str | None
+    email_send_time_unix_seconds: int | None
+    cancel_operation: bool | None
+
+
+# the instructions don't change between calls, so that the provider can cache the prompt prefix.
+# Anything dynamic, like the current time, goes to the input after it.
+AGENT_INSTRUCTIONS = """
+        Help prepare an email to be sent. Based on user requests, return email's subject, body, recipient 
+        , sending time and/or cancel_operation, if any of them available. 
+        The email subject or body may need to be translated if user requests to.
+        The email subject and body must be complete, do not leave any place holders like [Your Name]. 
+        The email's recipient should be in a valid email format, other wise, return empty string for that field.
+        The sending time must be in unix timestamp in seconds. 
+        The current timestamp is provided at the beginning of the input.
+        User may use relative time description based on today/now, you should calculate the timestamp based on the current timestamp. 
+        For example, tomorrow means current timestamp plus 86400, 
+        X seconds later means current timestamp + X, 
+        X minutes later means current timestamp + X*60, 
+        X hours later means current timestamp + X * 3600.
+        MAKE SURE the sending time is ALWAYS greater than the provided current timestamp, if NOT, then it's wrong, you should always use current timestamp as the base. 
+        User may also ask to cancel the emailing operation, then return true for cancel_operation field.
+        All the fields are optional.
+        If there is no recipient, return empty string for the field.
+        If there is no body, return empty string for the field.
+        If there is no subject, return empty string for the field.
+        If there is no sending time, return 0 for the field.
+        If not asking to cancel emailing, return false for the field.
+        """
+
+
+@dataclass
+class LLMResult:
+    # the response id to continue the conversation with, as previous_response_id
+    response_id: Optional[str]
+    # AgentResponse in JSON
+    text: str
+
+
+class LLMBackend(ABC):
+    @abstractmethod
+    def generate(self, req: str, previous_response_id: Optional[str]) -> LLMResult:
+        raise NotImplementedError
+
+
+class OpenAIBackend(LLMBackend):
+    def __init__(self, model: str = "gpt-4o"):
+        self._model = model
+
+    def generate(self, req: str, previous_response_id: Optional[str]) -> LLMResult:
+        # imported here, they are slow to import and only needed when calling OpenAI
+        from agents import AgentOutputSchema
+        from agents.models.openai_responses import Converter
+        from openai import OpenAI
+
+        client = OpenAI()
+
+        current_timestamp = int(time.time())
+        response = client.responses.create(
+            model=self._model,
+            instructions=AGENT_INSTRUCTIONS,
+            input=[
+                {"role": "developer", "content": f"The current timestamp is {current_timestamp}."},
+                {"role": "user", "content": req},
+            ],
+            text=Converter.get_response_format(
+                AgentOutputSchema(AgentResponse)
+            ),
+            previous_response_id=previous_response_id
+        )
+        logger.debug("OpenAI response: %s", response)
+        response_id = response.id if isinstance(response.id, str) else None
+        return LLMResult(response_id, response.output[0].content[0].text)
+
+
+class FakeLLMBackend(LLMBackend):
+    """
+    A local stand-in of the LLM for load testing, without network or cost.
+    It returns a valid AgentResponse derived only from the request, after a latency sampled from the distribution:
+        * the first email address in the request is the recipient
+        * "cancel" cancels the operation
+        * "send" schedules the email 60 seconds later
+    """
+
+    def __init__(self, latency_seconds: Callable[[], float]):
+        self._latency_seconds = latency_seconds
+
+    def generate(self, req: str, previous_response_id: Optional[str]) -> LLMResult:
+        time.sleep(self._latency_seconds())
+
+        lower_req = req.lower()
+        recipient = re.search(r"[\w.+-]+@[\w-]+\.[\w.]+", req)
+        response = AgentResponse(
+            email_recipient=recipient.group(0) if recipient else "",
+            email_subject=f"About: {req[:40]}",
+            email_body=f"Hello,\n\n{req}\n\nBest regards",
+            email_send_time_unix_seconds=int(time.time()) + 60 if "send" in lower_req else 0,
+            cancel_operation="cancel" in lower_req,
+        )
+        # the id only depends on the conversation, so the same conversation replays the same ids
+        response_id = "fake_" + hashlib.sha256(f"{previous_response_id}:{req}".encode()).hexdigest()[:24]
+        return LLMResult(response_id, response.model_dump_json())
+
+
+def parse_latency_distribution(spec: str, seed: Optional[int] = None) -> Callable[[], float]:
+    """
+    Parse a latency distribution in seconds, one of:
+        fixed:<seconds>
+        uniform:<min>,<max>
+        exponential:<mean>
+        lognormal:<median>,<sigma>
+    """
+    rng = random.Random(seed)
+    name, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",")] if params else []
+    if name == "fixed" and len(values) == 1:
+        return lambda: values[0]
+    if name == "uniform" and len(values) == 2:
+        return lambda: rng.uniform(values[0], values[1])
+    if name == "exponential" and len(values) == 1:
+        return lambda: rng.expovariate(1 / values[0])
+    if name == "lognormal" and len(values) == 2:
+        mu = math.log(values[0])
+        return lambda: rng.lognormvariate(mu, values[1])
+    raise ValueError(f"invalid latency distribution: {spec}")
+
+
+def llm_backend_from_env() -> LLMBackend:
+    """
+    AI_AGENT_LLM_BACKEND: openai(default) or fake
+    AI_AGENT_FAKE_LATENCY: the latency distribution of the fake backend, default lognormal:2,0.5
+    AI_AGENT_FAKE_SEED: the random seed for the fake latency
+    """
+    backend = os.environ.get("AI_AGENT_LLM_BACKEND", "openai")
+    if backend == "openai":
+        return OpenAIBackend()
+    if backend == "fake":
+        seed = os.environ.get("AI_AGENT_FAKE_SEED")
+        return FakeLLMBackend(parse_latency_distribution(
+            os.environ.get("AI_AGENT_FAKE_LATENCY", "lognormal:2,0.5"),
+            int(seed) if seed is not None else None,
+        ))
+    raise ValueError(f"unknown LLM backend {backend}")
+
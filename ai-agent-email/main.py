@@ -1,3 +1,4 @@
+import logging
 import traceback
 
 from flask import Flask, request, render_template
@@ -9,14 +10,29 @@ from iwf.iwf_api.models import (
 from iwf.worker_service import (
     WorkerService,
 )
+from iwf.workflow_options import WorkflowOptions
 
-from ai_agent_workflow import EmailAgentWorkflow
-from iwf_config import client, worker_service
+from common.admission_control import install_admission_control
+from common.callback_recorder import install_callback_recorder
+from common.metrics_routes import install_metrics_routes
+from common.structured_logging import configure_logging
+
+from ai_agent_workflow import DA_TENANT, DEFAULT_TENANT, EmailAgentWorkflow, agent_response_cache
+from iwf_config import blob_store, client, llm_task_pool, registry, worker_service
 
 # Configure Flask to look for templates and static files in the correct directories
 flask_app = Flask(__name__, 
                  template_folder='templates',
                  static_folder='static')
+configure_logging(flask_app)
+admission_controller = install_admission_control(flask_app, registry)
+callback_recorder = install_callback_recorder(flask_app)
+# http://localhost:8802/metrics/<name>, see common/metrics_routes.py
+install_metrics_routes(flask_app, worker_service, admission_controller, callback_recorder, {
+    "agent_response_cache": agent_response_cache.stats,
+    "llm_task_pool": lambda: llm_task_pool.stats() if llm_task_pool is not None else {},
+})
+logger = logging.getLogger(__name__)
 
 
 @flask_app.route("/")
@@ -24,11 +40,14 @@ def index():
     return render_template("index.html")
 
 
-# http://localhost:8802/api/ai-agent/start?workflowId=test
+# http://localhost:8802/api/ai-agent/start?workflowId=test&tenant=acme
 @flask_app.route("/api/ai-agent/start")
 def ai_agent_start():
     wf_id = request.args["workflowId"]
-    client.start_workflow(EmailAgentWorkflow, wf_id, 86400)
+    tenant = request.args.get("tenant", DEFAULT_TENANT)
+    client.start_workflow(EmailAgentWorkflow, wf_id, 86400, None, WorkflowOptions(
+        initial_data_attributes={DA_TENANT: tenant},
+    ))
     return "workflow started"
 
 
@@ -46,7 +65,11 @@ def ai_agent_request():
 def ai_agent_describe():
     wf_id = request.args["workflowId"]
     wf_details = client.invoke_rpc(wf_id, EmailAgentWorkflow.describe)
-    print(f"Workflow details for {wf_id}: {wf_details}")
+    # the RPC returns the references of the large texts, load them only here for the UI.
+    # It's decoded without a type hint, as a dict
+    for key in ("current_request", "current_request_draft", "email_body"):
+        wf_details[key] = blob_store.resolve(wf_details.get(key))
+    logger.debug("workflow details for %s: %s", wf_id, wf_details)
     # Return as JSON
     from flask import jsonify
     return jsonify(wf_details)
@@ -89,7 +112,7 @@ def handle_rpc():
 # the WebUI will be able to show you the error with stacktrace
 @flask_app.errorhandler(Exception)
 def internal_error(exception):
-    print(traceback.format_exc())
+    logger.exception("error handling %s", request.path)
     return traceback.format_exc(), 500
 
 
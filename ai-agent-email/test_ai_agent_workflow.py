@@ -0,0 +1,56 @@
+from typing import List
+
+import pytest
+
+import ai_agent_workflow
+from ai_agent_workflow import generate_with_cache
+from common.ttl_cache import TTLCache
+from llm_backend import LLMResult
+
+
+@pytest.fixture
+def llm_calls(monkeypatch) -> List[tuple]:
+    calls = []
+
+    def do_process_user_request(req, previous_response_id):
+        calls.append((req, previous_response_id))
+        return LLMResult(f"resp-{len(calls)}", f"answer to {req}")
+
+    monkeypatch.setattr(ai_agent_workflow, "do_process_user_request", do_process_user_request)
+    monkeypatch.setattr(ai_agent_workflow, "agent_response_cache", TTLCache(max_size=100, ttl_seconds=60))
+    return calls
+
+
+def test_same_request_of_a_workflow_is_answered_once(llm_calls):
+    first = generate_with_cache("wf-1", "email bob  tomorrow", None)
+    # resent, or the execution is retried, with other whitespace
+    assert generate_with_cache("wf-1", " email bob tomorrow\n", None) == first
+    assert len(llm_calls) == 1
+
+
+def test_other_workflows_are_not_answered_from_the_cache(llm_calls):
+    generate_with_cache("wf-1", "email bob tomorrow", None)
+    # the first request of every workflow has no previous response
+    assert generate_with_cache("wf-2", "email bob tomorrow", None) == ("resp-2", "answer to email bob tomorrow")
+    assert len(llm_calls) == 2
+
+
+def test_request_on_another_previous_response_is_not_answered_from_the_cache(llm_calls):
+    response_id, _ = generate_with_cache("wf-1", "make it shorter", None)
+    generate_with_cache("wf-1", "make it shorter", response_id)
+    assert llm_calls == [("make it shorter", None), ("make it shorter", "resp-1")]
+
+
+def test_ttl_cache_expiry_and_eviction(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("common.ttl_cache.time.monotonic", lambda: now[0])
+    cache = TTLCache(max_size=2, ttl_seconds=60)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    # "b" is the least recently used
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    now[0] += 61
+    assert cache.get("a") is None
+    assert cache.stats()["evictions"] == 1
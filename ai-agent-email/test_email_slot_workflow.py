@@ -0,0 +1,183 @@
+import sys
+import types
+from typing import Dict, List, Optional
+
+import pytest
+from iwf.state_decision import StateDecision
+
+import ai_agent_workflow
+from common import rate_limiter
+from common.blob_store import FileBlobStore
+from common.rate_limiter import DOWNSTREAM_SMTP, RateLimit, RateLimiter
+from email_slot_workflow import (
+    DA_EMAILS,
+    DA_RESULTS,
+    DISPATCH_BATCH_SIZE,
+    DispatchState,
+    DispatchThrottledState,
+    ScheduledEmail,
+    SlotEmails,
+    SlotResults,
+    get_dispatch_time,
+    send_emails,
+    slot_workflow_id,
+)
+
+
+class FakeSMTPServer:
+    def __init__(self, sent: List[str]):
+        self.sent = sent
+        self.closed = False
+
+    def quit(self):
+        self.closed = True
+
+
+class FakeClient:
+    """Records the results the slot notifies to each EmailAgentWorkflow"""
+
+    def __init__(self):
+        self.notified: Dict[str, bool] = {}
+
+    def invoke_rpc(self, workflow_id, rpc, sent):
+        self.notified[workflow_id] = sent
+
+
+class FakePersistence:
+    def __init__(self, data_attributes=None):
+        self.data_attributes = dict(data_attributes or {})
+
+    def get_data_attribute(self, key):
+        return self.data_attributes.get(key)
+
+    def set_data_attribute(self, key, value):
+        self.data_attributes[key] = value
+
+
+@pytest.fixture(autouse=True)
+def iwf_config(monkeypatch, tmp_path):
+    # the iwf_config of this sample, other samples have one of the same name
+    config = types.SimpleNamespace(blob_store=FileBlobStore(str(tmp_path)), client=FakeClient(),
+                                   smtp_sessions_per_slot=4)
+    monkeypatch.setitem(sys.modules, "iwf_config", config)
+    return config
+
+
+@pytest.fixture
+def smtp(monkeypatch):
+    """The recipients of the emails sent, and the SMTP sessions opened"""
+    sent: List[str] = []
+    sessions: List[FakeSMTPServer] = []
+
+    def open_smtp_session():
+        sessions.append(FakeSMTPServer(sent))
+        return sessions[-1], "sender@example.com"
+
+    def send_email(smtp_server, sender, sent_to, subject, body):
+        if sent_to.startswith("bounce"):
+            raise RuntimeError("mailbox unavailable")
+        smtp_server.sent.append(sent_to)
+
+    monkeypatch.setattr(ai_agent_workflow, "open_smtp_session", open_smtp_session)
+    monkeypatch.setattr(ai_agent_workflow, "send_email", send_email)
+    return sent, sessions
+
+
+def make_emails(*recipients: str) -> List[ScheduledEmail]:
+    return [ScheduledEmail(f"wf-{recipient}", recipient, "subject", "body") for recipient in recipients]
+
+
+def slot_persistence(emails: List[ScheduledEmail], sent: Optional[Dict[str, bool]] = None) -> FakePersistence:
+    return FakePersistence({
+        DA_EMAILS: SlotEmails({email.workflow_id: email for email in emails}),
+        DA_RESULTS: SlotResults(dict(sent or {})),
+    })
+
+
+def dispatch(persistence: FakePersistence) -> StateDecision:
+    return DispatchState().execute(None, None, None, persistence, None)
+
+
+def limit_smtp(monkeypatch, tmp_path, burst: int):
+    limiter = RateLimiter({DOWNSTREAM_SMTP: RateLimit(rate_per_second=0.5, burst=burst)}, str(tmp_path / "limits.db"))
+    monkeypatch.setattr(rate_limiter, "rate_limiter", limiter)
+
+
+def test_emails_are_sent_over_the_sessions(smtp):
+    sent, sessions = smtp
+    results, wait_seconds = send_emails(make_emails("a", "b", "bounce-c", "d", "e"), sessions=2)
+    assert results == {"wf-a": True, "wf-b": True, "wf-bounce-c": False, "wf-d": True, "wf-e": True}
+    assert wait_seconds == 0
+    assert sorted(sent) == ["a", "b", "d", "e"]
+    assert len(sessions) == 2 and all(session.closed for session in sessions)
+
+
+def test_emails_without_a_token_are_left_for_later(smtp, monkeypatch, tmp_path):
+    sent, sessions = smtp
+    limit_smtp(monkeypatch, tmp_path, burst=2)
+    results, wait_seconds = send_emails(make_emails("a", "b", "c", "d"), sessions=1)
+    # neither sent nor failed: the slot sends them after the timer
+    assert results == {"wf-a": True, "wf-b": True}
+    assert wait_seconds == 2
+    assert sent == ["a", "b"]
+
+
+def test_no_session_is_opened_without_a_token(smtp, monkeypatch, tmp_path):
+    sent, sessions = smtp
+    limit_smtp(monkeypatch, tmp_path, burst=1)
+    send_emails(make_emails("a"), sessions=1)
+    results, wait_seconds = send_emails(make_emails("b", "c"), sessions=2)
+    assert (results, wait_seconds) == ({}, 2)
+    assert len(sessions) == 1
+
+
+def test_failed_session_fails_its_chunk(smtp, monkeypatch):
+    def open_smtp_session():
+        raise ConnectionError("smtp is down")
+
+    monkeypatch.setattr(ai_agent_workflow, "open_smtp_session", open_smtp_session)
+    results, wait_seconds = send_emails(make_emails("a", "b"), sessions=1)
+    assert (results, wait_seconds) == ({"wf-a": False, "wf-b": False}, 0)
+
+
+
+def test_dispatch_time_is_the_end_of_the_slot():
+    assert get_dispatch_time(100, 60) == 120
+    assert get_dispatch_time(120, 60) == 120
+    assert get_dispatch_time(121, 60) == 180
+    assert slot_workflow_id(get_dispatch_time(100, 60)) == "email-slot-120"
+
+
+def test_dispatch_sends_a_batch_at_a_time(smtp, iwf_config):
+    sent, sessions = smtp
+    persistence = slot_persistence(make_emails(*(f"r{i}" for i in range(DISPATCH_BATCH_SIZE + 10))))
+
+    assert dispatch(persistence) == StateDecision.single_next_state(DispatchState)
+    assert len(sent) == DISPATCH_BATCH_SIZE
+    assert len(iwf_config.client.notified) == DISPATCH_BATCH_SIZE
+
+    assert dispatch(persistence) == StateDecision.graceful_complete_workflow(DISPATCH_BATCH_SIZE + 10)
+    assert len(sent) == DISPATCH_BATCH_SIZE + 10
+    assert len(set(sent)) == len(sent)
+    assert len(persistence.get_data_attribute(DA_RESULTS).sent) == DISPATCH_BATCH_SIZE + 10
+
+
+def test_dispatch_skips_the_emails_with_a_result(smtp, iwf_config):
+    sent, sessions = smtp
+    persistence = slot_persistence(make_emails("a", "b", "c"), sent={"wf-a": True, "wf-b": False})
+
+    assert dispatch(persistence) == StateDecision.graceful_complete_workflow(3)
+    # a failed email is taken back by its agent workflow, not sent again by the slot
+    assert sent == ["c"]
+    assert iwf_config.client.notified == {"wf-c": True}
+
+
+def test_throttled_dispatch_waits_for_a_token(smtp, iwf_config, monkeypatch, tmp_path):
+    sent, sessions = smtp
+    limit_smtp(monkeypatch, tmp_path, burst=2)
+    iwf_config.smtp_sessions_per_slot = 1
+    persistence = slot_persistence(make_emails("a", "b", "c"))
+
+    assert dispatch(persistence) == StateDecision.single_next_state(DispatchThrottledState, 2)
+    assert persistence.get_data_attribute(DA_RESULTS).sent == {"wf-a": True, "wf-b": True}
+    assert iwf_config.client.notified == {"wf-a": True, "wf-b": True}
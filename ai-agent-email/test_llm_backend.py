@@ -0,0 +1,54 @@
+import statistics
+
+import pytest
+
+from llm_backend import AgentResponse, FakeLLMBackend, OpenAIBackend, llm_backend_from_env, parse_latency_distribution
+
+
+def test_fake_response_is_derived_from_the_request():
+    backend = FakeLLMBackend(lambda: 0)
+    result = backend.generate("send a thank you email to bob@example.com", None)
+    response = AgentResponse.model_validate_json(result.text)
+    assert response.email_recipient == "bob@example.com"
+    assert response.email_send_time_unix_seconds > 0
+    assert not response.cancel_operation
+    assert AgentResponse.model_validate_json(backend.generate("cancel it", result.response_id).text).cancel_operation
+
+
+def test_fake_response_ids_replay_the_conversation():
+    backend = FakeLLMBackend(lambda: 0)
+    first = backend.generate("write to bob@example.com", None).response_id
+    assert backend.generate("write to bob@example.com", None).response_id == first
+    assert backend.generate("write to bob@example.com", first).response_id != first
+
+
+@pytest.mark.parametrize("spec, mean", [
+    ("fixed:0.5", 0.5),
+    ("uniform:1,3", 2),
+    ("exponential:2", 2),
+    ("lognormal:2,0.5", 2 * 1.133),
+])
+def test_latency_distributions(spec, mean):
+    latency = parse_latency_distribution(spec, seed=1)
+    samples = [latency() for _ in range(5000)]
+    assert min(samples) >= 0
+    assert statistics.mean(samples) == pytest.approx(mean, rel=0.05)
+    # the same seed gives the same latencies
+    assert parse_latency_distribution(spec, seed=1)() == samples[0]
+
+
+@pytest.mark.parametrize("spec", ["fixed", "fixed:1,2", "uniform:1", "normal:1,1", "lognormal:x,1"])
+def test_invalid_latency_distributions(spec):
+    with pytest.raises(ValueError):
+        parse_latency_distribution(spec)
+
+
+def test_backend_from_env(monkeypatch):
+    monkeypatch.setenv("AI_AGENT_LLM_BACKEND", "fake")
+    monkeypatch.setenv("AI_AGENT_FAKE_LATENCY", "fixed:0")
+    assert isinstance(llm_backend_from_env(), FakeLLMBackend)
+    monkeypatch.delenv("AI_AGENT_LLM_BACKEND")
+    assert isinstance(llm_backend_from_env(), OpenAIBackend)
+    monkeypatch.setenv("AI_AGENT_LLM_BACKEND", "local")
+    with pytest.raises(ValueError):
+        llm_backend_from_env()
@@ -12,9 +12,15 @@ from iwf.workflow import ObjectWorkflow
 from iwf.workflow_context import WorkflowContext
 from iwf.workflow_state import WorkflowState
 
+from common.append_log import AppendLog
+
 TEST_APPROVAL_KEY = "Approval"
 TEST_STRING_KEY = "TestString"
 
+# append_string only loads and upserts the last chunk of the string, see common/append_log.py
+test_string_log = AppendLog(TEST_STRING_KEY)
+
+
 class BasicWorkflow(ObjectWorkflow):
     def get_workflow_states(self) -> StateSchema:
         return StateSchema.with_starting_state(
@@ -24,7 +30,7 @@ class BasicWorkflow(ObjectWorkflow):
 
     def get_persistence_schema(self) -> PersistenceSchema:
         return PersistenceSchema.create(
-            PersistenceField.data_attribute_def(TEST_STRING_KEY, str),
+            *test_string_log.persistence_fields(),
         )
 
     def get_communication_schema(self) -> CommunicationSchema:
@@ -32,14 +38,23 @@ class BasicWorkflow(ObjectWorkflow):
             CommunicationMethod.internal_channel_def(TEST_APPROVAL_KEY, str)
         )
 
-    @rpc()
+    @rpc(data_attribute_loading_policy=test_string_log.append_loading_policy())
     def append_string(self, st: str, persistence: Persistence) -> str:
-        current = persistence.get_data_attribute(TEST_STRING_KEY)
-        if current is None:
-            current = ""
-        current = current + ", " + st
-        persistence.set_data_attribute(TEST_STRING_KEY, current)
-        return current
+        """
+        Appends ", <st>" and returns what was appended. It used to return the whole string, but that would load every
+        chunk on every append: read it with get_string instead.
+        """
+        appended = ", " + st
+        test_string_log.append(persistence, appended)
+        return appended
+
+    @rpc(data_attribute_loading_policy=test_string_log.read_loading_policy())
+    def get_string(self, persistence: Persistence) -> str:
+        return test_string_log.read(persistence)
+
+    @rpc(data_attribute_loading_policy=test_string_log.compact_loading_policy())
+    def compact_string(self, persistence: Persistence) -> int:
+        return test_string_log.compact(persistence)
 
     @rpc()
     def approve(self, communication: Communication):
@@ -10,10 +10,20 @@ from iwf.worker_service import (
     WorkerService,
 )
 
+from common.admission_control import install_admission_control
+from common.callback_recorder import install_callback_recorder
+from common.metrics_routes import install_metrics_routes
+from common.structured_logging import configure_logging
+
 from basic.basic_workflow import BasicWorkflow
-from basic.iwf_config import client, worker_service
+from basic.iwf_config import client, registry, worker_service
 
 flask_app = Flask(__name__)
+configure_logging(flask_app)
+admission_controller = install_admission_control(flask_app, registry)
+callback_recorder = install_callback_recorder(flask_app)
+# http://localhost:8802/metrics/<name>, see common/metrics_routes.py
+install_metrics_routes(flask_app, worker_service, admission_controller, callback_recorder)
 
 
 # http://localhost:8802/basic/start?workflowId=test-1108&inputNum=4
@@ -30,8 +40,21 @@ def basic_start():
 def basic_append_string():
     workflow_id = request.args["workflowId"]
     st = request.args["str"]
-    client.invoke_rpc(workflow_id, BasicWorkflow.append_string, st)
-    return st
+    # the appended part, the whole string is at /basic/getString
+    return client.invoke_rpc(workflow_id, BasicWorkflow.append_string, st)
+
+# http://localhost:8802/basic/getString?workflowId=test-1108
+@flask_app.route("/basic/getString")
+def basic_get_string():
+    workflow_id = request.args["workflowId"]
+    return client.invoke_rpc(workflow_id, BasicWorkflow.get_string)
+
+# http://localhost:8802/basic/compactString?workflowId=test-1108
+@flask_app.route("/basic/compactString")
+def basic_compact_string():
+    workflow_id = request.args["workflowId"]
+    chunks = client.invoke_rpc(workflow_id, BasicWorkflow.compact_string)
+    return f"{chunks} chunks"
 
 # http://localhost:8802/basic/approve?workflowId=test-1108
 @flask_app.route("/basic/approve")
@@ -0,0 +1,115 @@
+"""
+How many concurrent agent workflows one worker sustains with the fake LLM backend, and how the queueing in front
+of the worker threads eats into AgentState's 90 seconds execute_api_timeout_seconds.
+
+AgentState.execute callbacks arrive as a Poisson process and are handled by a pool of worker threads, exactly
+like the Flask worker does, but calling the worker service in process (no iWF server needed).
+A callback whose queueing + execution exceeds the timeout would be timed out and retried by the iWF server.
+
+    poetry run python benchmarks/ai_agent_concurrency.py --rate 20 --worker-threads 32 --latency lognormal:2,0.5
+
+Use --time-scale to run faster: latencies and the timeout are multiplied by it, the reported numbers are not.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ai-agent-email"))
+os.environ.setdefault("AI_AGENT_BLOB_DIR", tempfile.mkdtemp(prefix="ai_agent_blobs_"))
+os.environ["AI_AGENT_LLM_BACKEND"] = "fake"
+
+import iwf_config  # noqa: E402
+from ai_agent_workflow import AgentState, CH_USER_INPUT  # noqa: E402
+from iwf.iwf_api.models import (  # noqa: E402
+    ChannelRequestStatus,
+    CommandResults,
+    Context,
+    InterStateChannelResult,
+    WorkflowStateExecuteRequest,
+)
+from iwf.workflow_state import get_state_id  # noqa: E402
+from llm_backend import FakeLLMBackend, parse_latency_distribution  # noqa: E402
+
+
+def build_request(i: int) -> WorkflowStateExecuteRequest:
+    return WorkflowStateExecuteRequest(
+        context=Context(
+            workflow_id=f"agent-bench-{i}",
+            workflow_run_id="run",
+            workflow_started_timestamp=int(time.time()),
+            state_execution_id=f"{get_state_id(AgentState())}-1",
+        ),
+        workflow_type="EmailAgentWorkflow",
+        workflow_state_id=get_state_id(AgentState()),
+        data_objects=[],
+        command_results=CommandResults(inter_state_channel_results=[
+            InterStateChannelResult(
+                command_id="",
+                request_status=ChannelRequestStatus.RECEIVED,
+                channel_name=CH_USER_INPUT,
+                value=iwf_config.object_encoder.encode(
+                    f"write an email to user{i}@example.com to say thank you for #{i}"),
+            )
+        ]),
+    )
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rate", type=float, default=10, help="AgentState executions arriving per second")
+    parser.add_argument("--workflows", type=int, default=500, help="number of agent workflows(one execution each)")
+    parser.add_argument("--worker-threads", type=int, default=32, help="worker threads serving callbacks")
+    parser.add_argument("--latency", default="lognormal:2,0.5", help="fake LLM latency distribution in seconds")
+    parser.add_argument("--timeout-seconds", type=float, default=90, help="execute_api_timeout_seconds of AgentState")
+    parser.add_argument("--time-scale", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    scale = args.time_scale
+    latency = parse_latency_distribution(args.latency, args.seed)
+    iwf_config.llm_backend = FakeLLMBackend(lambda: latency() * scale)
+
+    rng = random.Random(args.seed)
+    queue_waits: List[float] = []
+    totals: List[float] = []
+    lock = threading.Lock()
+
+    def run(request: WorkflowStateExecuteRequest, enqueued_at: float):
+        started_at = time.perf_counter()
+        iwf_config.worker_service.handle_workflow_state_execute(request)
+        finished_at = time.perf_counter()
+        with lock:
+            queue_waits.append((started_at - enqueued_at) / scale)
+            totals.append((finished_at - enqueued_at) / scale)
+
+    bench_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.worker_threads) as executor:
+        next_arrival = bench_start
+        for i in range(args.workflows):
+            next_arrival += rng.expovariate(args.rate) * scale
+            time.sleep(max(0.0, next_arrival - time.perf_counter()))
+            executor.submit(run, build_request(i), time.perf_counter())
+    elapsed = (time.perf_counter() - bench_start) / scale
+
+    timed_out = sum(1 for t in totals if t > args.timeout_seconds)
+    print(f"rate={args.rate}/s workflows={args.workflows} worker_threads={args.worker_threads} latency={args.latency}")
+    print(f"completed      {len(totals)} in {elapsed:.1f}s ({len(totals) / elapsed:.2f}/s)")
+    print(f"queue wait     p50={percentile(queue_waits, 0.5):.2f}s p99={percentile(queue_waits, 0.99):.2f}s")
+    print(f"callback total p50={percentile(totals, 0.5):.2f}s p99={percentile(totals, 0.99):.2f}s")
+    print(f"over {args.timeout_seconds:.0f}s timeout {timed_out} ({timed_out / max(1, len(totals)):.1%}), "
+          f"these would be retried by the server and run the LLM again")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Per-callback overhead of the worker for the money transfer states, with the SDK's Registry versus the samples'
+LazyRegistry, which builds the state options once at registration instead of on every state decision.
+
+    poetry run python benchmarks/callback_overhead.py --iterations 20000
+
+The callbacks are handled in process by a WorkerService, no iWF server needed. For each registry it reports the
+time per callback, the WorkflowStateOptions/RetryPolicy objects created per callback, and the peak memory
+allocated while handling one callback (tracemalloc).
+"""
+import argparse
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Tuple
+
+from iwf.iwf_api.models import (
+    CommandResults,
+    Context,
+    RetryPolicy,
+    WorkflowStateExecuteRequest,
+)
+from iwf.object_encoder import ObjectEncoder
+from iwf.registry import Registry
+from iwf.worker_service import WorkerOptions, WorkerService
+from iwf.workflow_state_options import WorkflowStateOptions
+
+from common.lazy_registry import LazyRegistry
+from moneytransfer.money_transfer_workflow import MoneyTransferWorkflow, TransferRequest
+
+# the next state of each has custom state options
+STATES = ["CreateDebitMemoState", "DebitState", "CreateCreditMemoState"]
+ROUNDS = 5
+
+
+def build_worker_service(registry: Registry) -> WorkerService:
+    registry.add_workflow(MoneyTransferWorkflow())
+    return WorkerService(registry, WorkerOptions(ObjectEncoder.default))
+
+
+def build_request(state_id: str) -> WorkflowStateExecuteRequest:
+    return WorkflowStateExecuteRequest(
+        context=Context(
+            workflow_id="callback-bench",
+            workflow_run_id="run",
+            workflow_started_timestamp=1,
+            state_execution_id=f"{state_id}-1",
+        ),
+        workflow_type="MoneyTransferWorkflow",
+        workflow_state_id=state_id,
+        state_input=ObjectEncoder.default.encode(TransferRequest("a", "b", 10, "notes")),
+        data_objects=[],
+        command_results=CommandResults(),
+    )
+
+
+def count_constructions(fn: Callable[[], None]) -> int:
+    """Counts the WorkflowStateOptions and RetryPolicy objects created by fn"""
+    counter = [0]
+    originals = []
+    for cls in (WorkflowStateOptions, RetryPolicy):
+        original = cls.__init__
+
+        def counting_init(self, *args, _original=original, **kwargs):
+            counter[0] += 1
+            _original(self, *args, **kwargs)
+
+        originals.append((cls, original))
+        cls.__init__ = counting_init
+    try:
+        fn()
+    finally:
+        for cls, original in originals:
+            cls.__init__ = original
+    return counter[0]
+
+
+def peak_bytes(fn: Callable[[], None]) -> int:
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        baseline, _ = tracemalloc.get_traced_memory()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+        return peak - baseline
+    finally:
+        tracemalloc.stop()
+
+
+def measure(worker_service: WorkerService, iterations: int) -> Dict[str, Tuple[float, int, int]]:
+    results = {}
+    for state_id in STATES:
+        request = build_request(state_id)
+
+        def callback():
+            worker_service.handle_workflow_state_execute(request)
+
+        # warm up, e.g. the lazy registration
+        callback()
+        # the best of a few rounds, to reduce the noise
+        per_call = float("inf")
+        for _ in range(ROUNDS):
+            start = time.perf_counter()
+            for _ in range(iterations):
+                callback()
+            per_call = min(per_call, (time.perf_counter() - start) / iterations)
+        results[state_id] = (per_call, count_constructions(callback), peak_bytes(callback))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    registries: List[Tuple[str, Registry]] = [("Registry", Registry()), ("LazyRegistry", LazyRegistry())]
+    print(f"{'state':<24}{'registry':<14}{'time/callback':>15}{'options/callback':>18}{'peak alloc':>12}")
+    for name, registry in registries:
+        results = measure(build_worker_service(registry), args.iterations)
+        for state_id, (per_call, constructions, peak) in results.items():
+            print(f"{state_id:<24}{name:<14}{per_call * 1e6:>13.1f}us{constructions:>18}{peak:>11}B")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,397 @@
+"""
+A fake iWF server for load tests, in memory, to find the saturation point of a sample's worker without the cost of
+a real server(and its database) in the measurement. Start it in place of the iWF server, then the sample, then
+benchmarks/load_generator.py:
+
+    poetry run python benchmarks/fake_iwf_server.py --timer-scale 0.01
+    poetry run python moneytransfer/main.py
+
+It implements the APIs used by the samples' routes: starting workflows and invoking RPCs. The workflows run for real
+through the worker's waitUntil/execute/RPC callbacks: the data attributes are kept(and loaded per the loading
+policies), internal channels are delivered to the waiting states, and timers fire after their duration multiplied by
+--timer-scale. The callbacks failing are retried --callback-retries times, then the workflow fails, or proceeds to
+the configured state. It doesn't persist anything, lock anything or handle signals, search attributes, resets and
+the other APIs. The counts of workflows and callbacks are at /metrics.
+"""
+import argparse
+import heapq
+import itertools
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import httpx
+from flask import Flask, request
+
+logger = logging.getLogger(__name__)
+
+WAIT_UNTIL_PATH = "/api/v1/workflowState/start"
+EXECUTE_PATH = "/api/v1/workflowState/decide"
+RPC_PATH = "/api/v1/workflowWorker/rpc"
+
+GRACEFUL_COMPLETE = "_SYS_GRACEFUL_COMPLETING_WORKFLOW"
+FORCE_COMPLETE = "_SYS_FORCE_COMPLETING_WORKFLOW"
+FORCE_FAIL = "_SYS_FORCE_FAILING_WORKFLOW"
+DEAD_END = "_SYS_DEAD_END"
+
+RUNNING = "RUNNING"
+COMPLETED = "COMPLETED"
+FAILED = "FAILED"
+
+
+class CallbackError(Exception):
+    pass
+
+
+class Workflow:
+    def __init__(self, workflow_id: str, workflow_type: str, worker_url: str, data_attributes: List[Dict[str, Any]]):
+        self.workflow_id = workflow_id
+        self.run_id = str(uuid.uuid4())
+        self.workflow_type = workflow_type
+        self.worker_url = worker_url
+        self.started_at = int(time.time())
+        self.status = RUNNING
+        self.data_attributes: Dict[str, Any] = {kv["key"]: kv["value"] for kv in data_attributes}
+        self.channels: Dict[str, List[Any]] = {}
+        # the state executions waiting for their commands, by state execution id
+        self.waiting: Dict[str, "WaitingState"] = {}
+        self.state_execution_counters: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+
+class WaitingState:
+    def __init__(self, state_execution_id: str, state_id: str, state_input: Any, options: Dict[str, Any],
+                 command_request: Dict[str, Any]):
+        self.state_execution_id = state_execution_id
+        self.state_id = state_id
+        self.state_input = state_input
+        self.options = options
+        self.waiting_type = command_request.get("commandWaitingType", "ALL_COMPLETED")
+        self.timers = command_request.get("timerCommands", [])
+        self.channel_commands = command_request.get("interStateChannelCommands", [])
+        self.fired_timers = set()
+        self.received: Dict[int, Any] = {}
+
+
+class FakeIwfServer:
+    def __init__(self, timer_scale: float, callback_retries: int, threads: int):
+        self._timer_scale = timer_scale
+        self._callback_retries = callback_retries
+        self._workflows: Dict[str, Workflow] = {}
+        self._lock = threading.Lock()
+        self._http = httpx.Client(timeout=120, limits=httpx.Limits(max_connections=threads))
+        self._executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="fake-iwf")
+        self._timers: List[Any] = []
+        self._timer_sequence = itertools.count()
+        self._timer_condition = threading.Condition()
+        self._counts: Dict[str, int] = {}
+        self._counts_lock = threading.Lock()
+        threading.Thread(target=self._run_timers, name="fake-iwf-timers", daemon=True).start()
+
+    # the APIs called by the samples
+
+    def start_workflow(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        workflow_id = body["workflowId"]
+        start_options = body.get("workflowStartOptions", {})
+        workflow = Workflow(workflow_id, body["iwfWorkflowType"], body["iwfWorkerUrl"],
+                            start_options.get("dataAttributes", []))
+        with self._lock:
+            existing = self._workflows.get(workflow_id)
+            if existing is not None and existing.status == RUNNING:
+                raise WorkflowError("WORKFLOW_ALREADY_STARTED_SUB_STATUS", f"workflow {workflow_id} is running")
+            self._workflows[workflow_id] = workflow
+        self._count("workflows_started")
+        if body.get("startStateId"):
+            self._executor.submit(self._start_state, workflow, body["startStateId"], body.get("stateInput"),
+                                  body.get("stateOptions", {}))
+        return {"workflowRunId": workflow.run_id}
+
+    def invoke_rpc(self, body: Dict[str, Any]) -> Dict[str, Any]:
+        workflow = self._running_workflow(body["workflowId"])
+        with workflow.lock:
+            data_attributes = load(workflow.data_attributes, body.get("dataAttributesLoadingPolicy"))
+        try:
+            response = self._callback(workflow, RPC_PATH, {
+                "context": self._context(workflow),
+                "workflowType": workflow.workflow_type,
+                "rpcName": body["rpcName"],
+                "input": body.get("input"),
+                "dataAttributes": data_attributes,
+            })
+        except CallbackError as e:
+            raise WorkflowError("WORKER_API_ERROR", str(e))
+        self._apply(workflow, response.get("upsertDataAttributes"), response.get("publishToInterStateChannel"))
+        self._decide(workflow, response.get("stateDecision"))
+        return {"output": response.get("output")}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            statuses: Dict[str, int] = {}
+            for workflow in self._workflows.values():
+                statuses[workflow.status] = statuses.get(workflow.status, 0) + 1
+        with self._counts_lock:
+            return {"workflows": statuses, "counts": dict(self._counts)}
+
+    # running the workflows
+
+    def _start_state(self, workflow: Workflow, state_id: str, state_input: Any, options: Dict[str, Any]):
+        with workflow.lock:
+            number = workflow.state_execution_counters.get(state_id, 0) + 1
+            workflow.state_execution_counters[state_id] = number
+        state_execution_id = f"{state_id}-{number}"
+        if options.get("skipWaitUntil"):
+            self._execute(workflow, state_execution_id, state_id, state_input, options, {})
+            return
+        try:
+            response = self._callback(workflow, WAIT_UNTIL_PATH, {
+                "context": self._context(workflow, state_execution_id),
+                "workflowType": workflow.workflow_type,
+                "workflowStateId": state_id,
+                "stateInput": state_input,
+                "dataObjects": self._load(workflow, options, "waitUntilApiDataAttributesLoadingPolicy"),
+            })
+        except CallbackError:
+            self._close(workflow, FAILED)
+            return
+        self._apply(workflow, response.get("upsertDataObjects"), response.get("publishToInterStateChannel"))
+        waiting = WaitingState(state_execution_id, state_id, state_input, options,
+                               response.get("commandRequest") or {})
+        with workflow.lock:
+            workflow.waiting[state_execution_id] = waiting
+        for timer in waiting.timers:
+            self._schedule_timer(workflow, waiting, timer)
+        self._check_waiting(workflow)
+
+    def _execute(self, workflow: Workflow, state_execution_id: str, state_id: str, state_input: Any,
+                 options: Dict[str, Any], command_results: Dict[str, Any]):
+        try:
+            response = self._callback(workflow, EXECUTE_PATH, {
+                "context": self._context(workflow, state_execution_id),
+                "workflowType": workflow.workflow_type,
+                "workflowStateId": state_id,
+                "stateInput": state_input,
+                # sic, the name in the iWF API
+                "DataObjects": self._load(workflow, options, "executeApiDataAttributesLoadingPolicy"),
+                "commandResults": command_results,
+            })
+        except CallbackError:
+            proceed_state_id = options.get("executeApiFailureProceedStateId")
+            if options.get("executeApiFailurePolicy") == "PROCEED_TO_CONFIGURED_STATE" and proceed_state_id:
+                self._start_state(workflow, proceed_state_id, state_input,
+                                  options.get("executeApiFailureProceedStateOptions", {}))
+            else:
+                self._close(workflow, FAILED)
+            return
+        self._apply(workflow, response.get("upsertDataObjects"), response.get("publishToInterStateChannel"))
+        self._decide(workflow, response.get("stateDecision"))
+
+    def _decide(self, workflow: Workflow, decision: Optional[Dict[str, Any]]):
+        if not decision:
+            return
+        for movement in decision.get("nextStates", []):
+            state_id = movement["stateId"]
+            if state_id in (GRACEFUL_COMPLETE, FORCE_COMPLETE):
+                self._close(workflow, COMPLETED)
+            elif state_id == FORCE_FAIL:
+                self._close(workflow, FAILED)
+            elif state_id != DEAD_END and workflow.status == RUNNING:
+                self._executor.submit(self._start_state, workflow, state_id, movement.get("stateInput"),
+                                      movement.get("stateOptions", {}))
+
+    def _check_waiting(self, workflow: Workflow):
+        """Executes the waiting states whose commands are completed"""
+        ready = []
+        with workflow.lock:
+            for waiting in list(workflow.waiting.values()):
+                command_results = self._complete_commands(workflow, waiting)
+                if command_results is not None:
+                    del workflow.waiting[waiting.state_execution_id]
+                    ready.append((waiting, command_results))
+        for waiting, command_results in ready:
+            self._executor.submit(self._execute, workflow, waiting.state_execution_id, waiting.state_id,
+                                  waiting.state_input, waiting.options, command_results)
+
+    def _complete_commands(self, workflow: Workflow, waiting: WaitingState) -> Optional[Dict[str, Any]]:
+        # the channel commands that could receive a value now
+        available = [i for i, command in enumerate(waiting.channel_commands)
+                     if i not in waiting.received and workflow.channels.get(command["channelName"])]
+        done = len(waiting.fired_timers) + len(waiting.received) + len(available)
+        total = len(waiting.timers) + len(waiting.channel_commands)
+        if waiting.waiting_type == "ALL_COMPLETED":
+            if done < total:
+                return None
+        elif done == 0 and total > 0:
+            return None
+        if waiting.waiting_type != "ALL_COMPLETED" and (waiting.fired_timers or waiting.received):
+            # any completed: a timer already fired, don't consume a channel value too
+            available = []
+        elif waiting.waiting_type != "ALL_COMPLETED":
+            available = available[:1]
+        for i in available:
+            waiting.received[i] = workflow.channels[waiting.channel_commands[i]["channelName"]].pop(0)
+        return {
+            "timerResults": [
+                {"commandId": timer.get("commandId", ""),
+                 "timerStatus": "FIRED" if i in waiting.fired_timers else "SCHEDULED"}
+                for i, timer in enumerate(waiting.timers)
+            ],
+            "interStateChannelResults": [
+                {"commandId": command.get("commandId", ""), "channelName": command["channelName"],
+                 "requestStatus": "RECEIVED" if i in waiting.received else "WAITING",
+                 **({"value": waiting.received[i]} if i in waiting.received else {})}
+                for i, command in enumerate(waiting.channel_commands)
+            ],
+            "stateStartApiSucceeded": True,
+        }
+
+    def _schedule_timer(self, workflow: Workflow, waiting: WaitingState, timer: Dict[str, Any]):
+        index = waiting.timers.index(timer)
+        fire_at = time.monotonic() + timer.get("durationSeconds", 0) * self._timer_scale
+        with self._timer_condition:
+            heapq.heappush(self._timers, (fire_at, next(self._timer_sequence), workflow, waiting, index))
+            self._timer_condition.notify()
+
+    def _run_timers(self):
+        while True:
+            with self._timer_condition:
+                while not self._timers or self._timers[0][0] > time.monotonic():
+                    self._timer_condition.wait(
+                        timeout=self._timers[0][0] - time.monotonic() if self._timers else None
+                    )
+                _, _, workflow, waiting, index = heapq.heappop(self._timers)
+            with workflow.lock:
+                if waiting.state_execution_id not in workflow.waiting:
+                    continue
+                waiting.fired_timers.add(index)
+            self._count("timers_fired")
+            self._check_waiting(workflow)
+
+    def _apply(self, workflow: Workflow, upserts: Optional[List[Dict[str, Any]]],
+               publishes: Optional[List[Dict[str, Any]]]):
+        with workflow.lock:
+            for kv in upserts or []:
+                workflow.data_attributes[kv["key"]] = kv.get("value")
+            for publishing in publishes or []:
+                workflow.channels.setdefault(publishing["channelName"], []).append(publishing.get("value"))
+        if publishes:
+            self._check_waiting(workflow)
+
+    def _close(self, workflow: Workflow, status: str):
+        with workflow.lock:
+            if workflow.status != RUNNING:
+                return
+            workflow.status = status
+            # only the status is kept, for the RPCs and restarts
+            workflow.data_attributes = {}
+            workflow.channels = {}
+            workflow.waiting = {}
+        self._count(f"workflows_{status.lower()}")
+
+    def _callback(self, workflow: Workflow, path: str, body: Dict[str, Any]) -> Dict[str, Any]:
+        for attempt in range(self._callback_retries + 1):
+            self._count(f"callbacks{path}")
+            try:
+                response = self._http.post(workflow.worker_url + path, json=body)
+                if response.status_code == 200:
+                    return response.json()
+                error = f"status {response.status_code}"
+            except httpx.HTTPError as e:
+                error = str(e)
+            self._count(f"callback_errors{path}")
+            if attempt < self._callback_retries:
+                time.sleep(0.1 * 2 ** attempt)
+        logger.warning("callback %s of %s failed: %s", path, workflow.workflow_id, error)
+        raise CallbackError(f"{path} failed: {error}")
+
+    def _running_workflow(self, workflow_id: str) -> Workflow:
+        with self._lock:
+            workflow = self._workflows.get(workflow_id)
+        if workflow is None or workflow.status != RUNNING:
+            raise WorkflowError("WORKFLOW_NOT_EXISTS_SUB_STATUS", f"workflow {workflow_id} is not running")
+        return workflow
+
+    def _load(self, workflow: Workflow, options: Dict[str, Any], api_policy: str) -> List[Dict[str, Any]]:
+        policy = options.get(api_policy) or options.get("dataAttributesLoadingPolicy")
+        with workflow.lock:
+            return load(workflow.data_attributes, policy)
+
+    def _context(self, workflow: Workflow, state_execution_id: Optional[str] = None) -> Dict[str, Any]:
+        context = {
+            "workflowId": workflow.workflow_id,
+            "workflowRunId": workflow.run_id,
+            "workflowStartedTimestamp": workflow.started_at,
+        }
+        if state_execution_id is not None:
+            context["stateExecutionId"] = state_execution_id
+            context["attempt"] = 1
+            context["firstAttemptTimestamp"] = int(time.time())
+        return context
+
+    def _count(self, name: str):
+        with self._counts_lock:
+            self._counts[name] = self._counts.get(name, 0) + 1
+
+
+class WorkflowError(Exception):
+    def __init__(self, sub_status: str, detail: str):
+        super().__init__(detail)
+        self.sub_status = sub_status
+        self.detail = detail
+
+
+def load(data_attributes: Dict[str, Any], policy: Optional[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    loading_type = (policy or {}).get("persistenceLoadingType", "LOAD_ALL_WITHOUT_LOCKING")
+    if loading_type == "LOAD_NONE":
+        return []
+    if loading_type.startswith("LOAD_PARTIAL"):
+        keys = policy.get("partialLoadingKeys", [])
+        if policy.get("useKeyAsPrefix"):
+            return [{"key": key, "value": value} for key, value in data_attributes.items()
+                    if any(key.startswith(prefix) for prefix in keys)]
+        return [{"key": key, "value": data_attributes[key]} for key in keys if key in data_attributes]
+    return [{"key": key, "value": value} for key, value in data_attributes.items()]
+
+
+def create_app(server: FakeIwfServer) -> Flask:
+    app = Flask(__name__)
+
+    @app.route("/api/v1/workflow/start", methods=["POST"])
+    def start_workflow():
+        return server.start_workflow(request.json)
+
+    @app.route("/api/v1/workflow/rpc", methods=["POST"])
+    def invoke_rpc():
+        return server.invoke_rpc(request.json)
+
+    @app.route("/metrics")
+    def metrics():
+        return server.stats()
+
+    @app.errorhandler(WorkflowError)
+    def workflow_error(e: WorkflowError):
+        return {"detail": e.detail, "subStatus": e.sub_status}, 400
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8801)
+    parser.add_argument("--timer-scale", type=float, default=1.0,
+                        help="multiplies the timer durations, e.g. 0.01 to fire a 10s timer after 0.1s")
+    parser.add_argument("--callback-retries", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=64, help="concurrent callbacks to the worker")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    server = FakeIwfServer(args.timer_scale, args.callback_retries, args.threads)
+    create_app(server).run(host="0.0.0.0", port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
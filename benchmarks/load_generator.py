@@ -0,0 +1,346 @@
+"""
+An open-loop HTTP load generator for the samples' public routes, to find the rate at which a sample saturates.
+
+The requests are sent at their scheduled times whether or not the previous ones have completed(open loop), with
+Poisson(default) or uniform arrivals, at one rate or at increasing steps of rates. The latency of a request is
+measured from its scheduled time, not from when it was sent, so that the requests delayed by a saturated system are
+counted with their waiting time(corrected for coordinated omission). The latencies are recorded in HDR-style
+log-linear histograms, at 1% precision.
+
+Run it against a sample, with benchmarks/fake_iwf_server.py in place of the iWF server:
+
+    poetry run python benchmarks/fake_iwf_server.py --timer-scale 0.01
+    poetry run python signup/main.py
+    poetry run python benchmarks/load_generator.py signup --rates 20,40,80,160 --step-seconds 30
+
+A step is saturated when less than 95% of its requests succeed, or its corrected p99 is over --slo-ms.
+The keys(usernames, accounts, instance ids, workflow ids) are drawn from --keys keys, uniformly, with a zipf
+distribution, or with --hot-fraction of the requests on --hot-keys keys. For ai-agent, the workflows of all the keys
+are started first, so set AI_AGENT_LLM_BACKEND=fake and dummy GOOGLE_EMAIL_ADDRESS/GOOGLE_EMAIL_APP_PASSWORD.
+"""
+import argparse
+import bisect
+import http.client
+import itertools
+import json
+import queue
+import random
+import sys
+import threading
+import time
+import urllib.parse
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+
+@dataclass
+class Scenario:
+    # {key} and {other_key} are drawn from the key distribution, {unique} is new for every request
+    path: str
+    key_prefix: str
+    # called for every key before the run, e.g. to start the workflows the requests are sent to
+    setup_path: Optional[str] = None
+    # a fixed set of keys, e.g. the configured instance ids, instead of {key_prefix}{i}
+    fixed_keys: Optional[List[str]] = None
+
+
+SCENARIOS = {
+    "signup": Scenario("/signup/submit?username={key}&email={key}%40example.com", "user"),
+    "moneytransfer": Scenario(
+        "/moneytransfer/start?fromAccount={key}&toAccount={other_key}&amount=1&notes=load", "account"
+    ),
+    # the instance ids must be known to the worker, see SPOT_INSTANCE_IDS in resourcecontrol/controller_workflow.py
+    "controller": Scenario(
+        "/controller/request?id={unique}&instance_id={key}", "instance",
+        fixed_keys=["permanentID1", "permanentID2"],
+    ),
+    "ai-agent": Scenario(
+        "/api/ai-agent/request?workflowId={key}&request=write%20a%20thank%20you%20email", "agent",
+        setup_path="/api/ai-agent/start?workflowId={key}",
+    ),
+}
+
+PERCENTILES = [50, 90, 99, 99.9, 99.99, 100]
+
+
+class LatencyHistogram:
+    """
+    Counts of latencies in microseconds, in buckets as wide as 1/128 of their lowest value, like an HDR histogram
+    with 2 significant digits: constant memory, and percentiles within 1% at any latency.
+    """
+
+    SUB_BUCKET_BITS = 8
+
+    def __init__(self):
+        self._counts: Dict[int, int] = {}
+        self.count = 0
+        self.max = 0
+        self.total = 0
+
+    def record(self, value_us: int):
+        value = max(0, int(value_us))
+        shift = max(0, value.bit_length() - self.SUB_BUCKET_BITS)
+        lowest = (value >> shift) << shift
+        self._counts[lowest] = self._counts.get(lowest, 0) + 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def merge(self, other: "LatencyHistogram"):
+        for lowest, count in other._counts.items():
+            self._counts[lowest] = self._counts.get(lowest, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def value_at_percentile(self, percentile: float) -> int:
+        if self.count == 0:
+            return 0
+        target = max(1, round(self.count * percentile / 100))
+        seen = 0
+        for lowest in sorted(self._counts):
+            seen += self._counts[lowest]
+            if seen >= target:
+                # the highest value of the bucket, never above the max recorded
+                shift = max(0, lowest.bit_length() - self.SUB_BUCKET_BITS)
+                return min(self.max, lowest + (1 << shift) - 1)
+        return self.max
+
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+def key_chooser(distribution: str, keys: int, zipf_s: float, hot_keys: int, hot_fraction: float,
+                rng: random.Random) -> Callable[[], int]:
+    if distribution == "uniform":
+        return lambda: rng.randrange(keys)
+    if distribution == "zipf":
+        cumulative = list(itertools.accumulate(1 / (rank ** zipf_s) for rank in range(1, keys + 1)))
+        return lambda: min(keys - 1, bisect.bisect_left(cumulative, rng.random() * cumulative[-1]))
+    if distribution == "hotspot":
+        hot_keys = min(hot_keys, keys)
+        return lambda: rng.randrange(hot_keys) if rng.random() < hot_fraction else rng.randrange(hot_keys, keys)
+    if distribution == "unique":
+        counter = itertools.count()
+        return lambda: next(counter)
+    raise ValueError(f"unknown key distribution {distribution}")
+
+
+def arrivals(rates: List[float], step_seconds: float, arrival: str, rng: random.Random) -> Iterator[Tuple[float, int]]:
+    """The scheduled times of the requests from the start, with the index of their step"""
+    for step, rate in enumerate(rates):
+        start = step * step_seconds
+        offset = 0.0
+        while True:
+            offset += rng.expovariate(rate) if arrival == "poisson" else 1 / rate
+            if offset >= step_seconds:
+                break
+            yield start + offset, step
+
+
+class StepResult:
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.corrected = LatencyHistogram()
+        self.service = LatencyHistogram()
+        self.statuses: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def record(self, corrected_us: int, service_us: Optional[int], status: str):
+        with self.lock:
+            self.corrected.record(corrected_us)
+            if service_us is not None:
+                self.service.record(service_us)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+
+
+class LoadGenerator:
+    def __init__(self, base_url: str, connections: int, timeout_seconds: float):
+        parsed = urllib.parse.urlsplit(base_url)
+        self._host = parsed.hostname
+        self._port = parsed.port or 80
+        self._timeout_seconds = timeout_seconds
+        self._connections = connections
+        self._queue: "queue.Queue[Optional[Tuple[float, StepResult, str]]]" = queue.Queue()
+        self.max_backlog = 0
+        self._in_flight: Dict[int, Tuple[float, StepResult]] = {}
+        self._in_flight_lock = threading.Lock()
+
+    def get(self, path: str) -> int:
+        conn = http.client.HTTPConnection(self._host, self._port, timeout=self._timeout_seconds)
+        try:
+            conn.request("GET", path)
+            response = conn.getresponse()
+            response.read()
+            return response.status
+        finally:
+            conn.close()
+
+    def run(self, schedule: Iterator[Tuple[float, int]], results: List[StepResult], path_of: Callable[[], str],
+            drain_seconds: float):
+        workers = [threading.Thread(target=self._work, daemon=True) for _ in range(self._connections)]
+        for worker in workers:
+            worker.start()
+        start = time.perf_counter()
+        for offset, step in schedule:
+            delay = start + offset - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self._queue.put((start + offset, results[step], path_of()))
+            self.max_backlog = max(self.max_backlog, self._queue.qsize())
+        for _ in workers:
+            self._queue.put(None)
+        deadline = time.perf_counter() + drain_seconds
+        for worker in workers:
+            worker.join(timeout=max(0.0, deadline - time.perf_counter()))
+        # what is still queued or in flight counts with its latency so far, as a lower bound
+        now = time.perf_counter()
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                scheduled, result, _ = item
+                result.record(int((now - scheduled) * 1e6), None, "unfinished")
+        with self._in_flight_lock:
+            for scheduled, result in self._in_flight.values():
+                result.record(int((now - scheduled) * 1e6), None, "unfinished")
+
+    def _work(self):
+        conn = http.client.HTTPConnection(self._host, self._port, timeout=self._timeout_seconds)
+        while True:
+            item = self._queue.get()
+            if item is None:
+                conn.close()
+                return
+            scheduled, result, path = item
+            with self._in_flight_lock:
+                self._in_flight[threading.get_ident()] = (scheduled, result)
+            sent = time.perf_counter()
+            try:
+                conn.request("GET", path)
+                response = conn.getresponse()
+                response.read()
+                status = str(response.status)
+            except (OSError, http.client.HTTPException) as e:
+                status = type(e).__name__
+                conn.close()
+                conn = http.client.HTTPConnection(self._host, self._port, timeout=self._timeout_seconds)
+            done = time.perf_counter()
+            with self._in_flight_lock:
+                del self._in_flight[threading.get_ident()]
+            result.record(int((done - scheduled) * 1e6), int((done - sent) * 1e6), status)
+
+
+def ok_count(result: StepResult) -> int:
+    return sum(count for status, count in result.statuses.items() if status.startswith("2"))
+
+
+def is_saturated(result: StepResult, slo_ms: float) -> bool:
+    # every scheduled request is recorded, the unfinished ones too
+    return (ok_count(result) < 0.95 * result.corrected.count
+            or result.corrected.value_at_percentile(99) > slo_ms * 1000)
+
+
+def print_report(results: List[StepResult], step_seconds: float, slo_ms: float, max_backlog: int, connections: int):
+    print(f"{'rate/s':>8}{'ok/s':>9}{'errors':>8}{'p50':>10}{'p90':>10}{'p99':>10}{'p99.9':>10}{'max':>10}"
+          f"{'svc p99':>10}  saturated")
+    saturation = None
+    for result in results:
+        errors = sum(count for status, count in result.statuses.items() if not status.startswith("2"))
+        saturated = is_saturated(result, slo_ms)
+        if saturated and saturation is None:
+            saturation = result.rate
+        p = [result.corrected.value_at_percentile(q) / 1000 for q in (50, 90, 99, 99.9, 100)]
+        print(f"{result.rate:>8g}{ok_count(result) / step_seconds:>9.1f}{errors:>8}"
+              + "".join(f"{v:>8.1f}ms" for v in p)
+              + f"{result.service.value_at_percentile(99) / 1000:>8.1f}ms  {'yes' if saturated else ''}")
+    errors: Dict[str, int] = {}
+    for result in results:
+        for status, count in result.statuses.items():
+            if not status.startswith("2"):
+                errors[status] = errors.get(status, 0) + count
+    if errors:
+        print(f"\nerrors: {errors}")
+    if max_backlog >= connections:
+        print(f"\nwarning: up to {max_backlog} requests waited for a connection, the latencies include that wait; "
+              f"increase --connections if the sample isn't saturated")
+    if saturation is None:
+        print(f"\nnot saturated up to {results[-1].rate:g} requests/s")
+    else:
+        print(f"\nsaturated at {saturation:g} requests/s(p99 SLO {slo_ms:g}ms)")
+
+
+def to_json(results: List[StepResult], step_seconds: float, slo_ms: float) -> Dict[str, object]:
+    return {
+        "step_seconds": step_seconds,
+        "steps": [
+            {
+                "rate": result.rate,
+                "statuses": result.statuses,
+                "saturated": is_saturated(result, slo_ms),
+                "corrected_ms": {str(p): result.corrected.value_at_percentile(p) / 1000 for p in PERCENTILES},
+                "service_ms": {str(p): result.service.value_at_percentile(p) / 1000 for p in PERCENTILES},
+                "corrected_mean_ms": result.corrected.mean() / 1000,
+            }
+            for result in results
+        ],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("scenario", choices=sorted(SCENARIOS))
+    parser.add_argument("--base-url", default="http://localhost:8802")
+    parser.add_argument("--rates", default="10", help="requests/s of each step, e.g. 10,20,40,80")
+    parser.add_argument("--step-seconds", type=float, default=30)
+    parser.add_argument("--arrival", choices=["poisson", "uniform"], default="poisson")
+    parser.add_argument("--key-distribution", choices=["uniform", "zipf", "hotspot", "unique"], default="uniform")
+    parser.add_argument("--keys", type=int, default=10000)
+    parser.add_argument("--zipf-s", type=float, default=1.1)
+    parser.add_argument("--hot-keys", type=int, default=10)
+    parser.add_argument("--hot-fraction", type=float, default=0.9)
+    parser.add_argument("--connections", type=int, default=256, help="concurrent requests at most")
+    parser.add_argument("--timeout-seconds", type=float, default=60)
+    parser.add_argument("--drain-seconds", type=float, default=30,
+                        help="how long to wait for the requests in flight after the last step")
+    parser.add_argument("--slo-ms", type=float, default=1000, help="the p99 over which a step is saturated")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args()
+
+    scenario = SCENARIOS[args.scenario]
+    rates = [float(rate) for rate in args.rates.split(",")]
+    rng = random.Random(args.seed)
+    run_id = int(time.time())
+    keys = len(scenario.fixed_keys) if scenario.fixed_keys else args.keys
+    choose = key_chooser(args.key_distribution, keys, args.zipf_s, args.hot_keys, args.hot_fraction, rng)
+    unique = itertools.count()
+
+    def key_of(i: int) -> str:
+        return scenario.fixed_keys[i % keys] if scenario.fixed_keys else f"{scenario.key_prefix}{i}"
+
+    def path_of() -> str:
+        return scenario.path.format(key=key_of(choose()), other_key=key_of(choose()),
+                                    unique=f"load-{run_id}-{next(unique)}")
+
+    generator = LoadGenerator(args.base_url, args.connections, args.timeout_seconds)
+    if scenario.setup_path is not None:
+        setup_keys = min(keys, args.hot_keys) if args.key_distribution == "hotspot" and args.hot_fraction >= 1 else keys
+        print(f"setting up {setup_keys} keys...", file=sys.stderr)
+        for i in range(setup_keys):
+            generator.get(scenario.setup_path.format(key=key_of(i)))
+
+    results = [StepResult(rate) for rate in rates]
+    print(f"{args.scenario}: {args.arrival} arrivals at {args.rates} requests/s, {args.step_seconds:g}s per step",
+          file=sys.stderr)
+    generator.run(arrivals(rates, args.step_seconds, args.arrival, rng), results, path_of, args.drain_seconds)
+    print_report(results, args.step_seconds, args.slo_ms, generator.max_backlog, args.connections)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(to_json(results, args.step_seconds, args.slo_ms), f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
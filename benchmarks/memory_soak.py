@@ -0,0 +1,136 @@
+"""
+Soak test of a sample's worker: runs callbacks in a loop for a long time and flags a monotonic growth of the RSS,
+to catch memory leaks before they get a long-running worker killed.
+
+    poetry run python benchmarks/memory_soak.py --duration 7200
+    poetry run python benchmarks/memory_soak.py --sample ai-agent-email --segments 'records/*.ndjson.gz' --duration 14400
+
+Without --segments it runs the money transfer states(as in callback_overhead.py); with --segments it runs the
+callbacks recorded by common/callback_recorder.py(see replay_callbacks.py) against --sample.
+The RSS is sampled every --interval seconds, after a gc. After a warm-up of the first 10% of the samples, the growth
+is flagged when the minimum RSS of each of --windows consecutive windows is higher than the previous one and the
+trend exceeds --max-growth-mb-per-hour; the exit status is then 1, for a CI job.
+Set IWF_TRACEMALLOC_SAMPLE_RATE(e.g. 0.01) to also print the allocating lines per callback at the end.
+"""
+import argparse
+import gc
+import glob
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from replay_callbacks import callback_of, load_worker_service  # noqa: E402
+
+from common.callback_recorder import read_records  # noqa: E402
+from common.memory_profiler import memory_stats, rss_bytes  # noqa: E402
+
+MONEY_TRANSFER_STATES = ["VerifyState", "CreateDebitMemoState", "DebitState", "CreateCreditMemoState", "CreditState"]
+WARM_UP_RATIO = 0.1
+
+
+def money_transfer_records() -> List[Dict[str, Any]]:
+    transfer = json.dumps({"from_account": "a", "to_account": "b", "amount": 1, "notes": "soak"})
+    return [
+        {
+            "path": "/api/v1/workflowState/decide",
+            "response": None,
+            "request": {
+                "context": {"workflowId": "soak", "workflowRunId": "run", "workflowStartedTimestamp": 1,
+                            "stateExecutionId": f"{state_id}-1"},
+                "workflowType": "MoneyTransferWorkflow",
+                "workflowStateId": state_id,
+                "stateInput": {"encoding": "json/plain", "data": transfer},
+                "commandResults": {},
+            },
+        }
+        for state_id in MONEY_TRANSFER_STATES
+    ]
+
+
+def soak(calls, duration: float, interval: float) -> Tuple[List[Tuple[float, int]], int]:
+    samples = []
+    callbacks = 0
+    start = time.monotonic()
+    next_sample = start
+    while True:
+        now = time.monotonic()
+        if now >= next_sample:
+            gc.collect()
+            samples.append((now - start, rss_bytes()))
+            print(f"{(now - start) / 60:>8.1f}min  rss {samples[-1][1] / 2 ** 20:>8.1f}MB  {callbacks} callbacks",
+                  flush=True)
+            next_sample += interval
+            if now - start >= duration:
+                return samples, callbacks
+        for call in calls:
+            try:
+                call()
+            except Exception:
+                pass
+            callbacks += 1
+
+
+def growth_mb_per_hour(samples: List[Tuple[float, int]]) -> float:
+    """The slope of the least squares line through the samples"""
+    n = len(samples)
+    mean_t = sum(t for t, _ in samples) / n
+    mean_rss = sum(rss for _, rss in samples) / n
+    variance = sum((t - mean_t) ** 2 for t, _ in samples)
+    if variance == 0:
+        return 0.0
+    slope = sum((t - mean_t) * (rss - mean_rss) for t, rss in samples) / variance
+    return slope * 3600 / 2 ** 20
+
+
+def is_monotonic(samples: List[Tuple[float, int]], windows: int) -> bool:
+    size = len(samples) // windows
+    if size == 0:
+        return False
+    minimums = [min(rss for _, rss in samples[i * size:(i + 1) * size]) for i in range(windows)]
+    return all(later > earlier for earlier, later in zip(minimums, minimums[1:]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sample", default="moneytransfer")
+    parser.add_argument("--segments", help="a glob of recorded callbacks, default the money transfer states")
+    parser.add_argument("--duration", type=float, default=3600, help="seconds")
+    parser.add_argument("--interval", type=float, default=60, help="seconds between the RSS samples")
+    parser.add_argument("--windows", type=int, default=5)
+    parser.add_argument("--max-growth-mb-per-hour", type=float, default=1.0)
+    args = parser.parse_args()
+
+    if args.segments:
+        records = [record for path in sorted(glob.glob(args.segments)) for record in read_records(path)]
+    else:
+        if args.sample != "moneytransfer":
+            sys.exit("--segments is required for samples other than moneytransfer")
+        records = money_transfer_records()
+    worker_service = load_worker_service(args.sample)
+    calls = [callback_of(worker_service, record)[1] for record in records]
+
+    samples, callbacks = soak(calls, args.duration, args.interval)
+    measured = samples[int(len(samples) * WARM_UP_RATIO):]
+    growth = growth_mb_per_hour(measured)
+    monotonic = is_monotonic(measured, args.windows)
+    leaking = monotonic and growth > args.max_growth_mb_per_hour
+    print(f"\n{callbacks} callbacks, RSS {measured[0][1] / 2 ** 20:.1f}MB -> {measured[-1][1] / 2 ** 20:.1f}MB, "
+          f"trend {growth:+.2f}MB/hour, {'monotonic' if monotonic else 'not monotonic'} over {args.windows} windows")
+
+    stats = memory_stats()
+    for name, callback in stats.get("callbacks", {}).items():
+        print(f"\n{name}: {callback['samples']} samples, avg net {callback['avg_net_bytes']}B")
+        for line, size in callback["top_lines"].items():
+            print(f"  {size:>10}B  {line}")
+
+    if leaking:
+        print("\nMEMORY GROWTH DETECTED")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Replays the worker callbacks recorded by common/callback_recorder.py through a sample's worker_service, in process,
+and reports the throughput and latency per callback. Run it on two versions of the code and compare:
+
+    poetry run python benchmarks/replay_callbacks.py moneytransfer 'records/*.ndjson.gz' --output before.json
+    (change the code)
+    poetry run python benchmarks/replay_callbacks.py moneytransfer 'records/*.ndjson.gz' --baseline before.json
+
+By default the callbacks are replayed one after another as fast as possible; with --pacing recorded, they are
+replayed at the pace they were recorded, on as many threads as needed. The callbacks run the real state and RPC
+code, so configure the sample to not call external services (e.g. AI_AGENT_LLM_BACKEND=fake).
+It also counts the responses that differ from the recorded ones, a hint that the replay didn't do the same work.
+With IWF_PERSISTENCE_USAGE=true, it also prints the data attributes each callback loaded and read,
+see common/persistence_usage.py.
+"""
+import argparse
+import glob
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from iwf.iwf_api.models import (  # noqa: E402
+    WorkflowStateExecuteRequest,
+    WorkflowStateWaitUntilRequest,
+    WorkflowWorkerRpcRequest,
+)
+from iwf.worker_service import WorkerService  # noqa: E402
+
+from common.callback_recorder import read_records  # noqa: E402
+
+
+def load_worker_service(sample: str) -> WorkerService:
+    # the samples' main modules are imported from their own directory, see worker_startup.py
+    os.environ.pop("IWF_RECORD_DIR", None)
+    os.environ.setdefault("IWF_LOG_LEVEL", "WARNING")
+    sys.path.insert(0, os.path.join(ROOT, sample))
+    import main  # type: ignore
+
+    return main.worker_service
+
+
+def callback_of(worker_service: WorkerService, record: Dict[str, Any]) -> Tuple[str, Callable[[], Dict[str, Any]]]:
+    """The name(for the report) and the call of a recorded callback"""
+    body = record["request"]
+    path = record["path"]
+    if path == WorkerService.api_path_workflow_worker_rpc:
+        request = WorkflowWorkerRpcRequest.from_dict(body)
+        name = f"{request.workflow_type}.{request.rpc_name}"
+        handle = worker_service.handle_workflow_worker_rpc
+    elif path == WorkerService.api_path_workflow_state_execute:
+        request = WorkflowStateExecuteRequest.from_dict(body)
+        name = f"{request.workflow_type}.{request.workflow_state_id}.execute"
+        handle = worker_service.handle_workflow_state_execute
+    else:
+        request = WorkflowStateWaitUntilRequest.from_dict(body)
+        name = f"{request.workflow_type}.{request.workflow_state_id}.waitUntil"
+        handle = worker_service.handle_workflow_state_wait_until
+    return name, lambda: handle(request).to_dict()
+
+
+def replay(worker_service: WorkerService, records: List[Dict[str, Any]], pacing: str) -> Dict[str, Any]:
+    latencies: Dict[str, List[float]] = {}
+    errors: Dict[str, int] = {}
+    mismatches: Dict[str, int] = {}
+    lock = threading.Lock()
+
+    def run(record: Dict[str, Any]):
+        name, call = callback_of(worker_service, record)
+        start = time.perf_counter()
+        try:
+            response: Optional[Dict[str, Any]] = call()
+        except Exception:
+            response = None
+        latency = time.perf_counter() - start
+        with lock:
+            latencies.setdefault(name, []).append(latency)
+            if response is None:
+                errors[name] = errors.get(name, 0) + 1
+            elif record["response"] is not None and response != record["response"]:
+                mismatches[name] = mismatches.get(name, 0) + 1
+
+    start = time.perf_counter()
+    if pacing == "max":
+        for record in records:
+            run(record)
+    else:
+        first_ts = records[0]["ts"]
+        threads = []
+        for record in records:
+            delay = (record["ts"] - first_ts) - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+            thread = threading.Thread(target=run, args=(record,))
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+    elapsed = time.perf_counter() - start
+
+    callbacks = {}
+    for name, values in sorted(latencies.items()):
+        values.sort()
+        callbacks[name] = {
+            "count": len(values),
+            "p50_ms": percentile(values, 0.5) * 1000,
+            "p99_ms": percentile(values, 0.99) * 1000,
+            "mean_ms": statistics.fmean(values) * 1000,
+            "errors": errors.get(name, 0),
+            "mismatches": mismatches.get(name, 0),
+        }
+    return {"callbacks": callbacks, "total": len(records), "elapsed_s": elapsed, "throughput": len(records) / elapsed}
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(p * len(sorted_values)))]
+
+
+def print_report(result: Dict[str, Any], baseline: Optional[Dict[str, Any]]):
+    def diff(name: str, key: str, value: float) -> str:
+        if baseline is None or name not in baseline["callbacks"]:
+            return ""
+        before = baseline["callbacks"][name][key]
+        return f" ({(value - before) / before * 100:+.0f}%)" if before else ""
+
+    print(f"{'callback':<56}{'count':>7}{'p50':>20}{'p99':>20}{'errors':>8}{'mismatch':>10}")
+    for name, stats in result["callbacks"].items():
+        p50 = f"{stats['p50_ms']:.2f}ms{diff(name, 'p50_ms', stats['p50_ms'])}"
+        p99 = f"{stats['p99_ms']:.2f}ms{diff(name, 'p99_ms', stats['p99_ms'])}"
+        print(f"{name:<56}{stats['count']:>7}{p50:>20}{p99:>20}{stats['errors']:>8}{stats['mismatches']:>10}")
+    throughput = f"{result['throughput']:.0f} callbacks/s"
+    if baseline is not None:
+        throughput += f" ({(result['throughput'] - baseline['throughput']) / baseline['throughput'] * 100:+.0f}%)"
+    print(f"\n{result['total']} callbacks in {result['elapsed_s']:.2f}s, {throughput}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("sample", help="the sample directory, e.g. moneytransfer")
+    parser.add_argument("segments", help="a glob of the recorded segments")
+    parser.add_argument("--pacing", choices=["max", "recorded"], default="max")
+    parser.add_argument("--output", help="write the result as JSON, to be used as a baseline")
+    parser.add_argument("--baseline", help="a result written by --output, to compare with")
+    args = parser.parse_args()
+
+    records = [record for path in sorted(glob.glob(args.segments)) for record in read_records(path)]
+    if not records:
+        sys.exit(f"no records in {args.segments}")
+    records.sort(key=lambda record: record["ts"])
+
+    result = replay(load_worker_service(args.sample), records, args.pacing)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+    from common.persistence_usage import persistence_usage_report
+
+    usage = persistence_usage_report()
+    if usage:
+        print(f"\ndata attributes loaded and read:\n{json.dumps(usage, indent=2)}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Concurrent /signup/describe throughput on one hot username, optionally while /signup/verify keeps being called
+on the same workflow.
+
+Start an iWF server and `signup/main.py`, then:
+
+    poetry run python benchmarks/signup_describe_throughput.py --threads 32 --seconds 20
+
+To compare before/after, run it against the worker built from each commit. With the exclusive lock every describe
+is serialized on the workflow, so the throughput stays flat when adding threads; without the lock it scales
+until the server or the worker saturates.
+"""
+import argparse
+import statistics
+import threading
+import time
+import urllib.parse
+import urllib.request
+from typing import List
+
+
+def call(url: str) -> float:
+    start = time.perf_counter()
+    with urllib.request.urlopen(url, timeout=30) as resp:
+        resp.read()
+    return time.perf_counter() - start
+
+
+def run_clients(url: str, threads: int, seconds: float) -> List[float]:
+    latencies: List[float] = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def loop():
+        local = []
+        while time.perf_counter() < deadline:
+            local.append(call(url))
+        with lock:
+            latencies.extend(local)
+
+    workers = [threading.Thread(target=loop) for _ in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return latencies
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8802")
+    parser.add_argument("--username", default="hot-user")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--verify-threads", type=int, default=0,
+                        help="threads calling /signup/verify on the same user at the same time")
+    parser.add_argument("--skip-submit", action="store_true", help="the workflow is already started")
+    args = parser.parse_args()
+
+    query = urllib.parse.urlencode({"username": args.username})
+    if not args.skip_submit:
+        submit_query = urllib.parse.urlencode({"username": args.username, "email": f"{args.username}@example.com"})
+        call(f"{args.base_url}/signup/submit?{submit_query}")
+
+    verifiers = []
+    if args.verify_threads:
+        verify_url = f"{args.base_url}/signup/verify?{query}&source=benchmark"
+        verifiers = [threading.Thread(target=run_clients, args=(verify_url, 1, args.seconds))
+                     for _ in range(args.verify_threads)]
+        for v in verifiers:
+            v.start()
+
+    latencies = run_clients(f"{args.base_url}/signup/describe?{query}", args.threads, args.seconds)
+    for v in verifiers:
+        v.join()
+
+    print(f"threads={args.threads} verify_threads={args.verify_threads} seconds={args.seconds}")
+    print(f"requests     {len(latencies)}")
+    print(f"throughput   {len(latencies) / args.seconds:.1f} req/s")
+    print(f"latency p50  {percentile(latencies, 0.5) * 1000:.1f} ms")
+    print(f"latency p99  {percentile(latencies, 0.99) * 1000:.1f} ms")
+    print(f"latency mean {statistics.mean(latencies) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
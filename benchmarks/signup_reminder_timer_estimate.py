@@ -0,0 +1,109 @@
+"""
+An estimate of the timer events (and state executions) N pending, never-verified sign-up users produce, with the old
+fixed 10-second reminder loop versus the ReminderPolicy.
+
+    poetry run python benchmarks/signup_reminder_timer_estimate.py --users 1000000 --horizon-hours 24
+
+It's an analytical model, not a load test: nothing is sent to an iWF server or a worker, the timer schedule of every
+user is computed the same way VerifyState does. No timer fires after the workflow timeout(3600s, as signup/main.py
+starts the workflows), before or after. To measure the timers for real, run the signup scenario of
+benchmarks/load_generator.py against benchmarks/fake_iwf_server.py, whose /metrics counts the timers fired.
+"""
+import argparse
+from collections import Counter
+
+from signup.signup_workflow import DEFAULT_REMINDER_POLICY, ReminderPolicy
+
+FIXED_INTERVAL_SECONDS = 10
+# the workflow timeout of signup/main.py
+WORKFLOW_TIMEOUT_SECONDS = 3600
+
+
+def fixed_interval_events(users: int, signup_window: int, horizon: int, bucket: int, timeout: int) -> Counter:
+    # every user fires a timer every FIXED_INTERVAL_SECONDS until its workflow times out,
+    # so the rate at any time is (users signed up within the timeout) / interval
+    def signed_up(t: float) -> float:
+        return users * min(max(t, 0), signup_window) / signup_window if signup_window else users * (t >= 0)
+
+    def active(t: float) -> float:
+        return signed_up(t - FIXED_INTERVAL_SECONDS) - signed_up(t - timeout)
+
+    buckets: Counter = Counter()
+    for b in range(0, horizon, bucket):
+        e = min(b + bucket, horizon)
+        buckets[b] = int((active(b) + active(e)) / 2 * (e - b) / FIXED_INTERVAL_SECONDS)
+    return buckets
+
+
+def policy_events(users: int, signup_window: int, horizon: int, bucket: int, timeout: int,
+                  policy: ReminderPolicy) -> Counter:
+    offsets = []
+    t = 0
+    for count in range(policy.max_reminders):
+        t += policy.get_interval_seconds(count)
+        if t > timeout:
+            break
+        offsets.append(t)
+
+    buckets: Counter = Counter()
+    for start in _signup_times(users, signup_window):
+        for offset in offsets:
+            fire_at = start + offset
+            if fire_at >= horizon:
+                break
+            buckets[fire_at // bucket * bucket] += 1
+    return buckets
+
+
+def _signup_times(users: int, signup_window: int):
+    # sign-ups arrive evenly during the window
+    if users <= 0:
+        return
+    step = signup_window / users
+    for i in range(users):
+        yield int(i * step)
+
+
+def report(name: str, buckets: Counter, bucket: int, horizon: int):
+    total = sum(buckets.values())
+    peak = max(buckets.values()) if buckets else 0
+    last = buckets.get((horizon - 1) // bucket * bucket, 0)
+    print(f"{name}:")
+    print(f"  timer events        {total}")
+    # every timer firing is one execute callback plus one wait_until callback for the next loop
+    print(f"  state executions    {total * 2}")
+    print(f"  avg events/second   {total / horizon:.2f}")
+    print(f"  peak events/second  {peak / bucket:.2f}")
+    print(f"  final events/second {last / bucket:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100000, help="number of pending users that never verify")
+    parser.add_argument("--signup-window-seconds", type=int, default=3600, help="sign-ups arrive during this window")
+    parser.add_argument("--horizon-hours", type=float, default=24)
+    parser.add_argument("--bucket-seconds", type=int, default=60, help="resolution of the rate measurement")
+    parser.add_argument("--workflow-timeout-seconds", type=int, default=WORKFLOW_TIMEOUT_SECONDS)
+    args = parser.parse_args()
+
+    horizon = int(args.horizon_hours * 3600)
+    print(f"{args.users} pending users, sign-ups over {args.signup_window_seconds}s, horizon {horizon}s")
+    print(f"policy: {DEFAULT_REMINDER_POLICY}")
+    timeout = args.workflow_timeout_seconds
+    report(
+        f"before (fixed {FIXED_INTERVAL_SECONDS}s timer until the {timeout}s workflow timeout)",
+        fixed_interval_events(args.users, args.signup_window_seconds, horizon, args.bucket_seconds, timeout),
+        args.bucket_seconds,
+        horizon,
+    )
+    report(
+        "after (exponential backoff with reminder cap)",
+        policy_events(args.users, args.signup_window_seconds, horizon, args.bucket_seconds, timeout,
+                      DEFAULT_REMINDER_POLICY),
+        args.bucket_seconds,
+        horizon,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+import threading
+import time
+
+import pytest
+from flask import Flask, request
+from iwf.client import Client
+from iwf.client_options import ClientOptions
+from iwf.command_request import CommandRequest, InternalChannelCommand, TimerCommand
+from iwf.command_results import CommandResults
+from iwf.communication import Communication
+from iwf.communication_schema import CommunicationMethod, CommunicationSchema
+from iwf.errors import WorkflowAlreadyStartedError
+from iwf.iwf_api.models import (
+    PersistenceLoadingPolicy,
+    PersistenceLoadingType,
+    WorkflowStateExecuteRequest,
+    WorkflowStateWaitUntilRequest,
+    WorkflowWorkerRpcRequest,
+)
+from iwf.object_encoder import ObjectEncoder
+from iwf.persistence import Persistence
+from iwf.persistence_schema import PersistenceField, PersistenceSchema
+from iwf.registry import Registry
+from iwf.rpc import rpc
+from iwf.state_decision import StateDecision
+from iwf.state_schema import StateSchema
+from iwf.worker_service import WorkerOptions, WorkerService
+from iwf.workflow import ObjectWorkflow
+from iwf.workflow_context import WorkflowContext
+from iwf.workflow_state import WorkflowState
+from werkzeug.serving import make_server
+
+from fake_iwf_server import FakeIwfServer, create_app, load
+
+CH_MESSAGES = "Messages"
+DA_TIMER = "Timer"
+DA_MESSAGE = "Message"
+
+
+class TimerState(WorkflowState[None]):
+    def wait_until(self, ctx: WorkflowContext, input: None, persistence: Persistence,
+                   communication: Communication) -> CommandRequest:
+        return CommandRequest.for_all_command_completed(TimerCommand.by_seconds(100))
+
+    def execute(self, ctx: WorkflowContext, input: None, command_results: CommandResults, persistence: Persistence,
+                communication: Communication) -> StateDecision:
+        persistence.set_data_attribute(DA_TIMER, "fired")
+        persistence.set_data_attribute(DA_MESSAGE, "waiting")
+        return StateDecision.single_next_state(ChannelState)
+
+
+class ChannelState(WorkflowState[None]):
+    def wait_until(self, ctx: WorkflowContext, input: None, persistence: Persistence,
+                   communication: Communication) -> CommandRequest:
+        return CommandRequest.for_any_command_completed(InternalChannelCommand.by_name(CH_MESSAGES))
+
+    def execute(self, ctx: WorkflowContext, input: None, command_results: CommandResults, persistence: Persistence,
+                communication: Communication) -> StateDecision:
+        message = command_results.internal_channel_commands[0].value
+        persistence.set_data_attribute(DA_MESSAGE, message)
+        return StateDecision.graceful_complete_workflow(message)
+
+
+class FakeServerWorkflow(ObjectWorkflow):
+    def get_workflow_states(self) -> StateSchema:
+        return StateSchema.with_starting_state(TimerState(), ChannelState())
+
+    def get_persistence_schema(self) -> PersistenceSchema:
+        return PersistenceSchema.create(
+            PersistenceField.data_attribute_def(DA_TIMER, str),
+            PersistenceField.data_attribute_def(DA_MESSAGE, str),
+        )
+
+    def get_communication_schema(self) -> CommunicationSchema:
+        return CommunicationSchema.create(CommunicationMethod.internal_channel_def(CH_MESSAGES, str))
+
+    @rpc()
+    def send(self, message: str, communication: Communication):
+        communication.publish_to_internal_channel(CH_MESSAGES, message)
+
+    @rpc(data_attribute_loading_policy=PersistenceLoadingPolicy(
+        persistence_loading_type=PersistenceLoadingType.LOAD_PARTIAL_WITHOUT_LOCKING,
+        partial_loading_keys=[DA_TIMER],
+    ))
+    def describe(self, persistence: Persistence) -> str:
+        return f"{persistence.get_data_attribute(DA_TIMER)}/{persistence.get_data_attribute(DA_MESSAGE)}"
+
+
+def test_load_follows_the_loading_policy():
+    data_attributes = {"Form": 1, "FormStatus": 2, "Email": 3}
+    assert load(data_attributes, None) == [{"key": "Form", "value": 1}, {"key": "FormStatus", "value": 2},
+                                           {"key": "Email", "value": 3}]
+    assert load(data_attributes, {"persistenceLoadingType": "LOAD_NONE"}) == []
+    partial = {"persistenceLoadingType": "LOAD_PARTIAL_WITHOUT_LOCKING", "partialLoadingKeys": ["Email", "Missing"]}
+    assert load(data_attributes, partial) == [{"key": "Email", "value": 3}]
+    prefix = dict(partial, partialLoadingKeys=["Form"], useKeyAsPrefix=True)
+    assert load(data_attributes, prefix) == [{"key": "Form", "value": 1}, {"key": "FormStatus", "value": 2}]
+
+
+def serve(app: Flask):
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def create_worker_app(worker_service: WorkerService) -> Flask:
+    app = Flask("worker")
+
+    @app.route(WorkerService.api_path_workflow_state_wait_until, methods=["POST"])
+    def handle_wait_until():
+        return worker_service.handle_workflow_state_wait_until(
+            WorkflowStateWaitUntilRequest.from_dict(request.json)).to_dict()
+
+    @app.route(WorkerService.api_path_workflow_state_execute, methods=["POST"])
+    def handle_execute():
+        return worker_service.handle_workflow_state_execute(
+            WorkflowStateExecuteRequest.from_dict(request.json)).to_dict()
+
+    @app.route(WorkerService.api_path_workflow_worker_rpc, methods=["POST"])
+    def handle_rpc():
+        return worker_service.handle_workflow_worker_rpc(WorkflowWorkerRpcRequest.from_dict(request.json)).to_dict()
+
+    return app
+
+
+@pytest.fixture
+def fake_iwf():
+    """The fake server, and a client of it with a worker of FakeServerWorkflow"""
+    registry = Registry()
+    registry.add_workflow(FakeServerWorkflow())
+    worker, worker_url = serve(create_worker_app(WorkerService(registry, WorkerOptions(ObjectEncoder.default))))
+    fake_server = FakeIwfServer(timer_scale=0.001, callback_retries=0, threads=8)
+    server, server_url = serve(create_app(fake_server))
+    yield fake_server, Client(registry, ClientOptions(server_url, worker_url, ObjectEncoder.default))
+    for http_server in (server, worker):
+        http_server.shutdown()
+        http_server.server_close()
+
+
+def wait_for(condition, timeout_seconds: float = 5):
+    deadline = time.monotonic() + timeout_seconds
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_workflow_runs_through_the_timer_and_the_channel(fake_iwf):
+    fake_server, client = fake_iwf
+    client.start_workflow(FakeServerWorkflow, "wf-1", 60)
+    # the message waits in the channel until ChannelState is reached
+    client.invoke_rpc("wf-1", FakeServerWorkflow.send, "hello")
+    wait_for(lambda: fake_server.stats()["counts"].get("timers_fired") == 1)
+    wait_for(lambda: fake_server.stats()["workflows"] == {"COMPLETED": 1})
+    assert fake_server.stats()["counts"]["callbacks/api/v1/workflowState/decide"] == 2
+
+
+def test_rpc_loads_the_keys_of_its_policy(fake_iwf):
+    fake_server, client = fake_iwf
+    client.start_workflow(FakeServerWorkflow, "wf-1", 60)
+    wait_for(lambda: client.invoke_rpc("wf-1", FakeServerWorkflow.describe) != "None/None")
+    # Message is set along with Timer, but isn't loaded for describe
+    assert client.invoke_rpc("wf-1", FakeServerWorkflow.describe) == "fired/None"
+
+
+def test_already_started_workflow_is_rejected(fake_iwf):
+    fake_server, client = fake_iwf
+    client.start_workflow(FakeServerWorkflow, "wf-1", 60)
+    with pytest.raises(WorkflowAlreadyStartedError):
+        client.start_workflow(FakeServerWorkflow, "wf-1", 60)
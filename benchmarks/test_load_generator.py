@@ -0,0 +1,113 @@
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from load_generator import LatencyHistogram, LoadGenerator, StepResult, arrivals, is_saturated, key_chooser
+
+
+def test_histogram_percentiles_are_within_one_percent():
+    histogram = LatencyHistogram()
+    values = list(range(1, 100001))
+    random.Random(1).shuffle(values)
+    for value in values:
+        histogram.record(value)
+    for percentile in (50, 90, 99, 99.9):
+        expected = 100000 * percentile / 100
+        assert abs(histogram.value_at_percentile(percentile) - expected) <= expected * 0.01
+    assert histogram.value_at_percentile(100) == 100000
+    assert histogram.mean() == pytest.approx(50000.5)
+
+
+def test_merged_histogram_counts_both():
+    fast, slow = LatencyHistogram(), LatencyHistogram()
+    for _ in range(99):
+        fast.record(1000)
+    slow.record(500000)
+    fast.merge(slow)
+    assert fast.count == 100
+    assert fast.value_at_percentile(99) <= 1000 * 1.01
+    assert fast.value_at_percentile(100) == 500000
+
+
+def test_key_distributions():
+    rng = random.Random(1)
+    zipf = key_chooser("zipf", keys=1000, zipf_s=1.1, hot_keys=0, hot_fraction=0, rng=rng)
+    draws = [zipf() for _ in range(10000)]
+    assert all(0 <= key < 1000 for key in draws)
+    assert draws.count(0) > draws.count(999) * 20
+
+    hotspot = key_chooser("hotspot", keys=1000, zipf_s=0, hot_keys=10, hot_fraction=0.9, rng=rng)
+    assert 0.85 < sum(hotspot() < 10 for _ in range(10000)) / 10000 < 0.95
+
+    unique = key_chooser("unique", keys=1, zipf_s=0, hot_keys=0, hot_fraction=0, rng=rng)
+    assert [unique() for _ in range(3)] == [0, 1, 2]
+
+    with pytest.raises(ValueError):
+        key_chooser("gaussian", keys=1, zipf_s=0, hot_keys=0, hot_fraction=0, rng=rng)
+
+
+def test_arrivals_follow_the_rate_of_each_step():
+    uniform = list(arrivals([4, 8], step_seconds=1, arrival="uniform", rng=random.Random(1)))
+    assert uniform == [(0.25, 0), (0.5, 0), (0.75, 0)] + [(1 + i / 8, 1) for i in range(1, 8)]
+
+    poisson = list(arrivals([1000], step_seconds=10, arrival="poisson", rng=random.Random(1)))
+    assert 9500 < len(poisson) < 10500
+    assert [offset for offset, _ in poisson] == sorted(offset for offset, _ in poisson)
+
+
+def test_step_is_saturated_by_errors_or_latency():
+    result = StepResult(rate=10)
+    for _ in range(95):
+        result.record(10000, 10000, "200")
+    for _ in range(5):
+        result.record(10000, 10000, "503")
+    assert not is_saturated(result, slo_ms=100)
+
+    # the requests still in flight at the end count as failed
+    result.record(10000, None, "unfinished")
+    assert is_saturated(result, slo_ms=100)
+
+    slow = StepResult(rate=10)
+    slow.record(200000, 200000, "200")
+    assert is_saturated(slow, slo_ms=100)
+
+
+class SlowHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        time.sleep(0.05)
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def slow_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SlowHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_latency_counts_the_wait_behind_a_slow_request(slow_server):
+    generator = LoadGenerator(slow_server, connections=1, timeout_seconds=5)
+    result = StepResult(rate=100)
+    # 10 requests 10ms apart, each served in 50ms over the one connection: they queue up behind each other
+    schedule = iter([(i * 0.01, 0) for i in range(10)])
+    generator.run(schedule, [result], lambda: "/", drain_seconds=5)
+
+    assert result.statuses == {"200": 10}
+    assert result.service.value_at_percentile(100) < 200000
+    # the last one completes about 10 * 50ms - 9 * 10ms after its scheduled time
+    assert result.corrected.value_at_percentile(100) > 350000
+    assert generator.max_backlog > 1
@@ -0,0 +1,129 @@
+"""
+Cold start of each sample's worker: how long until `main` is imported and the first callback is served,
+in a fresh interpreter with `python -X importtime`.
+
+    poetry run python benchmarks/worker_startup.py --runs 5
+
+For each sample, it reports the process wall time to the end of the first callback, the import time of `main`
+(cumulative, from -X importtime), the first callback's latency (which includes anything imported lazily by it),
+and the modules with the largest self import time. Run it on two commits to compare.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# sample dir -> (route, request model, request dict) of a first callback without external side effects
+FIRST_CALLBACKS: Dict[str, Tuple[str, str, str]] = {
+    "basic": (
+        "api_path_workflow_state_execute", "WorkflowStateExecuteRequest",
+        "dict(context=CONTEXT, workflowType='BasicWorkflow', workflowStateId='BasicWorkflowState1', "
+        "stateInput=dict(encoding='json/plain', data='1'), commandResults=dict())",
+    ),
+    "moneytransfer": (
+        "api_path_workflow_state_execute", "WorkflowStateExecuteRequest",
+        "dict(context=CONTEXT, workflowType='MoneyTransferWorkflow', workflowStateId='VerifyState', "
+        "stateInput=dict(encoding='json/plain', data='{\"from_account\": \"a\", \"to_account\": \"b\", "
+        "\"amount\": 1, \"notes\": \"n\"}'), commandResults=dict())",
+    ),
+    "signup": (
+        "api_path_workflow_worker_rpc", "WorkflowWorkerRpcRequest",
+        "dict(context=CONTEXT, workflowType='UserSignupWorkflow', rpcName='describe', dataAttributes=[])",
+    ),
+    "resourcecontrol": (
+        "api_path_workflow_worker_rpc", "WorkflowWorkerRpcRequest",
+        "dict(context=CONTEXT, workflowType='ControllerWorkflow', rpcName='enqueue', "
+        "input=dict(encoding='json/plain', data='{\"id\": \"1\", \"data\": \"abcd\"}'), dataAttributes=[])",
+    ),
+    "ai-agent-email": (
+        "api_path_workflow_state_execute", "WorkflowStateExecuteRequest",
+        "dict(context=CONTEXT, workflowType='EmailAgentWorkflow', workflowStateId='AgentState', "
+        "commandResults=dict(interStateChannelResults=[dict(commandId='', requestStatus='RECEIVED', "
+        "channelName='UserInput', value=dict(encoding='json/plain', data='\"write to a@b.com\"'))]))",
+    ),
+}
+
+CHILD_SCRIPT = """
+import json, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+from iwf.iwf_api import models
+from iwf.worker_service import WorkerService
+CONTEXT = dict(workflowId='startup-bench', workflowRunId='run', workflowStartedTimestamp=1,
+               stateExecutionId='state-1')
+request = models.{model}.from_dict({request})
+response = main.flask_app.test_client().post(getattr(WorkerService, '{route}'), json=request.to_dict())
+assert response.status_code == 200, response.get_data(as_text=True)
+done = time.perf_counter()
+print(json.dumps(dict(import_main=imported - start, first_callback=done - imported)))
+"""
+
+
+def run_once(sample: str, work_dir: str) -> Tuple[float, Dict[str, float], List[Tuple[int, str]]]:
+    route, model, request = FIRST_CALLBACKS[sample]
+    env = dict(
+        os.environ,
+        PYTHONPATH=ROOT,
+        AI_AGENT_LLM_BACKEND="fake",
+        AI_AGENT_FAKE_LATENCY="fixed:0",
+        AI_AGENT_BLOB_DIR=os.path.join(work_dir, "blobs"),
+        SIGNUP_EMAIL_INDEX_DB=os.path.join(work_dir, "email_index.db"),
+        IWF_LOG_LEVEL="WARNING",
+    )
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", CHILD_SCRIPT.format(model=model, request=request, route=route)],
+        cwd=os.path.join(ROOT, sample), env=env, capture_output=True, text=True,
+    )
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"{sample} failed:\n{result.stderr[-3000:]}")
+
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    modules = []
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        modules.append((int(self_us), name.strip()))
+    return wall, timings, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", nargs="*", default=list(FIRST_CALLBACKS), choices=list(FIRST_CALLBACKS))
+    parser.add_argument("--runs", type=int, default=3, help="fresh processes per sample, the median is reported")
+    parser.add_argument("--top", type=int, default=5, help="slowest modules to show per sample")
+    args = parser.parse_args()
+
+    print(f"{'sample':<18}{'wall':>10}{'import main':>14}{'1st callback':>14}")
+    slowest: Dict[str, List[Tuple[int, str]]] = {}
+    for sample in args.samples:
+        walls, imports, callbacks = [], [], []
+        for _ in range(args.runs):
+            with tempfile.TemporaryDirectory() as work_dir:
+                wall, timings, modules = run_once(sample, work_dir)
+            walls.append(wall)
+            imports.append(timings["import_main"])
+            callbacks.append(timings["first_callback"])
+            slowest[sample] = sorted(modules, reverse=True)[:args.top]
+        print(f"{sample:<18}{statistics.median(walls) * 1000:>8.0f}ms{statistics.median(imports) * 1000:>12.0f}ms"
+              f"{statistics.median(callbacks) * 1000:>12.0f}ms")
+
+    for sample, modules in slowest.items():
+        print(f"\n{sample}, slowest modules by self import time:")
+        for self_us, name in modules:
+            print(f"  {self_us / 1000:>8.1f}ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
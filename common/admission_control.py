@@ -0,0 +1,162 @@
+"""
+Admission control for the worker APIs called by the iWF server.
+
+Without it, an overloaded worker accepts every callback, they all slow down together until the server times them out
+and retries them, which adds even more load. With it, a callback only starts when its route and its workflow type
+are under their in-flight limits. Otherwise it waits in a short queue, for at most a fraction of its own timeout
+(there is no point starting a callback that will be timed out anyway), and is then rejected with a fast
+503 and Retry-After, so that the server's backoff retry spreads the load.
+
+Configured by environment variables, disabled unless IWF_ADMISSION_MAX_IN_FLIGHT_PER_ROUTE is set:
+    IWF_ADMISSION_MAX_IN_FLIGHT_PER_ROUTE: concurrent callbacks per worker API
+    IWF_ADMISSION_MAX_IN_FLIGHT_PER_WORKFLOW_TYPE: concurrent callbacks per workflow type, default no limit
+    IWF_ADMISSION_MAX_QUEUED_PER_ROUTE: callbacks waiting per worker API, default 16
+    IWF_ADMISSION_MAX_QUEUE_WAIT_SECONDS: the longest wait, default 1
+    IWF_ADMISSION_RETRY_AFTER_SECONDS: the Retry-After of the 503, default 1
+"""
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from iwf.registry import Registry
+from iwf.worker_service import WorkerService
+
+# the iWF server's timeout of a state API when the state options don't set one
+DEFAULT_STATE_API_TIMEOUT_SECONDS = 30
+# the share of the callback's timeout it can spend waiting to be admitted
+QUEUE_WAIT_TIMEOUT_RATIO = 0.25
+
+
+class AdmissionRejectedError(Exception):
+    pass
+
+
+class AdmissionController:
+    def __init__(
+            self,
+            max_in_flight_per_route: int,
+            max_in_flight_per_workflow_type: Optional[int] = None,
+            max_queued_per_route: int = 16,
+            max_queue_wait_seconds: float = 1.0,
+    ):
+        self._max_in_flight_per_route = max_in_flight_per_route
+        self._max_in_flight_per_workflow_type = max_in_flight_per_workflow_type
+        self._max_queued_per_route = max_queued_per_route
+        self._max_queue_wait_seconds = max_queue_wait_seconds
+        self._in_flight_per_route: Dict[str, int] = {}
+        self._in_flight_per_workflow_type: Dict[str, int] = {}
+        self._queued_per_route: Dict[str, int] = {}
+        self._admitted = 0
+        self._rejected = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, route: str, workflow_type: str, timeout_seconds: float):
+        """Blocks until the callback can run, or raises AdmissionRejectedError"""
+        wait_seconds = min(self._max_queue_wait_seconds, timeout_seconds * QUEUE_WAIT_TIMEOUT_RATIO)
+        deadline = time.monotonic() + wait_seconds
+        with self._condition:
+            if not self._has_capacity(route, workflow_type):
+                if self._queued_per_route.get(route, 0) >= self._max_queued_per_route:
+                    self._rejected += 1
+                    raise AdmissionRejectedError(f"too many callbacks queued for {route}")
+                self._queued_per_route[route] = self._queued_per_route.get(route, 0) + 1
+                try:
+                    while not self._has_capacity(route, workflow_type):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._rejected += 1
+                            raise AdmissionRejectedError(f"no capacity for {workflow_type} on {route}")
+                        self._condition.wait(remaining)
+                finally:
+                    self._queued_per_route[route] -= 1
+            self._in_flight_per_route[route] = self._in_flight_per_route.get(route, 0) + 1
+            self._in_flight_per_workflow_type[workflow_type] = self._in_flight_per_workflow_type.get(workflow_type, 0) + 1
+            self._admitted += 1
+
+    def release(self, route: str, workflow_type: str):
+        with self._condition:
+            self._in_flight_per_route[route] -= 1
+            self._in_flight_per_workflow_type[workflow_type] -= 1
+            self._condition.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._condition:
+            return {
+                "in_flight_per_route": dict(self._in_flight_per_route),
+                "in_flight_per_workflow_type": dict(self._in_flight_per_workflow_type),
+                "queued_per_route": dict(self._queued_per_route),
+                "admitted": self._admitted,
+                "rejected": self._rejected,
+            }
+
+    def _has_capacity(self, route: str, workflow_type: str) -> bool:
+        if self._in_flight_per_route.get(route, 0) >= self._max_in_flight_per_route:
+            return False
+        return (self._max_in_flight_per_workflow_type is None
+                or self._in_flight_per_workflow_type.get(workflow_type, 0) < self._max_in_flight_per_workflow_type)
+
+
+def admission_controller_from_env() -> Optional[AdmissionController]:
+    max_in_flight_per_route = int(os.environ.get("IWF_ADMISSION_MAX_IN_FLIGHT_PER_ROUTE", 0))
+    if max_in_flight_per_route <= 0:
+        return None
+    max_in_flight_per_workflow_type = os.environ.get("IWF_ADMISSION_MAX_IN_FLIGHT_PER_WORKFLOW_TYPE")
+    return AdmissionController(
+        max_in_flight_per_route=max_in_flight_per_route,
+        max_in_flight_per_workflow_type=int(max_in_flight_per_workflow_type) if max_in_flight_per_workflow_type else None,
+        max_queued_per_route=int(os.environ.get("IWF_ADMISSION_MAX_QUEUED_PER_ROUTE", 16)),
+        max_queue_wait_seconds=float(os.environ.get("IWF_ADMISSION_MAX_QUEUE_WAIT_SECONDS", 1)),
+    )
+
+
+def callback_timeout_seconds(registry: Registry, path: str, body: Dict[str, Any]) -> float:
+    """The timeout the iWF server uses for this callback, from the state options or the RPC definition"""
+    workflow_type = body["workflowType"]
+    if path == WorkerService.api_path_workflow_worker_rpc:
+        return registry.get_rpc_infos(workflow_type)[body["rpcName"]].timeout_seconds
+    options = registry.get_workflow_state_with_check(workflow_type, body["workflowStateId"]).get_state_options()
+    timeout = None
+    if options is not None:
+        if path == WorkerService.api_path_workflow_state_execute:
+            timeout = options.execute_api_timeout_seconds
+        else:
+            timeout = options.wait_until_api_timeout_seconds
+    return timeout or DEFAULT_STATE_API_TIMEOUT_SECONDS
+
+
+def install_admission_control(flask_app, registry: Registry) -> Optional[AdmissionController]:
+    """Puts the worker APIs of the flask_app behind an AdmissionController configured from the environment"""
+    controller = admission_controller_from_env()
+    if controller is None:
+        return None
+
+    from flask import g, request
+
+    worker_paths = {
+        WorkerService.api_path_workflow_state_wait_until,
+        WorkerService.api_path_workflow_state_execute,
+        WorkerService.api_path_workflow_worker_rpc,
+    }
+    retry_after = os.environ.get("IWF_ADMISSION_RETRY_AFTER_SECONDS", "1")
+
+    @flask_app.before_request
+    def _admit():
+        if request.path not in worker_paths:
+            return None
+        body = request.get_json()
+        workflow_type = body["workflowType"]
+        try:
+            controller.acquire(request.path, workflow_type, callback_timeout_seconds(registry, request.path, body))
+        except AdmissionRejectedError as e:
+            return str(e), 503, {"Retry-After": retry_after}
+        g.admitted = (request.path, workflow_type)
+        return None
+
+    @flask_app.teardown_request
+    def _release(_):
+        admitted = g.pop("admitted", None)
+        if admitted is not None:
+            controller.release(*admitted)
+
+    return controller
@@ -0,0 +1,111 @@
+"""
+A string data attribute that is appended to, stored as an append-only log of fixed-size chunks.
+
+Appending to a single string data attribute loads and upserts the whole string, so N appends move O(N^2) bytes
+through the iWF server. An AppendLog keeps the text in data attributes sharing its key as prefix:
+    <key>Tail: the last, partially filled chunk, with the index it will be sealed at
+    <key>Chunk_<i>: the sealed chunks, each chunk_size characters, written once and never loaded by an append
+    <key>: the text written before the log was used, if any(see compact)
+An append only loads and upserts the tail, plus the chunks it seals, so its cost doesn't depend on the length.
+The whole text is only loaded by read, with a prefix loading policy.
+
+compact rewrites the text into chunks of the current chunk_size, merging the legacy single value, e.g. after a
+workflow started before the log was used, or after changing the chunk size. It loads everything, so it's meant to be
+called on demand, not on every append.
+"""
+from dataclasses import dataclass
+from typing import List
+
+from iwf.iwf_api.models import PersistenceLoadingPolicy, PersistenceLoadingType
+from iwf.persistence import Persistence
+from iwf.persistence_schema import PersistenceField
+
+DEFAULT_CHUNK_SIZE = 4096
+
+
+@dataclass
+class AppendLogTail:
+    # the index of the chunk this tail becomes when sealed, i.e. the number of sealed chunks
+    index: int
+    text: str
+
+
+class AppendLog:
+    def __init__(self, key: str, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        if chunk_size <= 0:
+            raise ValueError("chunk_size must be positive")
+        self.key = key
+        self.tail_key = f"{key}Tail"
+        self.chunk_prefix = f"{key}Chunk_"
+        self.chunk_size = chunk_size
+
+    def persistence_fields(self) -> List[PersistenceField]:
+        return [
+            PersistenceField.data_attribute_def(self.key, str),
+            PersistenceField.data_attribute_def(self.tail_key, AppendLogTail),
+            PersistenceField.data_attribute_prefix_def(self.chunk_prefix, str),
+        ]
+
+    def append_loading_policy(self) -> PersistenceLoadingPolicy:
+        # locked, so that concurrent appends don't overwrite each other's tail
+        return PersistenceLoadingPolicy(
+            persistence_loading_type=PersistenceLoadingType.LOAD_PARTIAL_WITH_EXCLUSIVE_LOCK,
+            partial_loading_keys=[self.tail_key],
+            locking_keys=[self.tail_key],
+        )
+
+    def read_loading_policy(self) -> PersistenceLoadingPolicy:
+        # all the keys of the log start with the key
+        return PersistenceLoadingPolicy(
+            persistence_loading_type=PersistenceLoadingType.LOAD_PARTIAL_WITHOUT_LOCKING,
+            partial_loading_keys=[self.key],
+            use_key_as_prefix=True,
+        )
+
+    def compact_loading_policy(self) -> PersistenceLoadingPolicy:
+        return PersistenceLoadingPolicy(
+            persistence_loading_type=PersistenceLoadingType.LOAD_PARTIAL_WITH_EXCLUSIVE_LOCK,
+            partial_loading_keys=[self.key],
+            locking_keys=[self.tail_key],
+            use_key_as_prefix=True,
+        )
+
+    def append(self, persistence: Persistence, text: str) -> int:
+        """Appends the text, and returns the number of sealed chunks"""
+        tail = self._tail(persistence)
+        tail.text += text
+        tail.index = self._seal_full_chunks(persistence, tail)
+        persistence.set_data_attribute(self.tail_key, tail)
+        return tail.index
+
+    def read(self, persistence: Persistence) -> str:
+        """Returns the whole text. Requires the read_loading_policy or compact_loading_policy"""
+        tail = self._tail(persistence)
+        legacy = persistence.get_data_attribute(self.key) or ""
+        chunks = [persistence.get_data_attribute(f"{self.chunk_prefix}{i}") or "" for i in range(tail.index)]
+        return legacy + "".join(chunks) + tail.text
+
+    def compact(self, persistence: Persistence) -> int:
+        """Rewrites the whole text into chunks of chunk_size, and returns the number of sealed chunks"""
+        previous_chunks = self._tail(persistence).index
+        tail = AppendLogTail(index=0, text=self.read(persistence))
+        tail.index = self._seal_full_chunks(persistence, tail)
+        # data attributes can't be deleted, so the ones no longer used are emptied
+        for i in range(tail.index, previous_chunks):
+            persistence.set_data_attribute(f"{self.chunk_prefix}{i}", "")
+        if persistence.get_data_attribute(self.key):
+            persistence.set_data_attribute(self.key, "")
+        persistence.set_data_attribute(self.tail_key, tail)
+        return tail.index
+
+    def _tail(self, persistence: Persistence) -> AppendLogTail:
+        tail = persistence.get_data_attribute(self.tail_key)
+        return tail if tail is not None else AppendLogTail(index=0, text="")
+
+    def _seal_full_chunks(self, persistence: Persistence, tail: AppendLogTail) -> int:
+        index = tail.index
+        while len(tail.text) >= self.chunk_size:
+            persistence.set_data_attribute(f"{self.chunk_prefix}{index}", tail.text[:self.chunk_size])
+            tail.text = tail.text[self.chunk_size:]
+            index += 1
+        return index
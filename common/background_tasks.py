@@ -0,0 +1,52 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+
+class TaskRejectedError(Exception):
+    pass
+
+
+class BoundedTaskPool:
+    """
+    A thread pool for long-running work(like LLM calls) that should not hold the worker threads serving
+    the iWF callbacks.
+
+    It's bounded in two ways, and rejects a task with TaskRejectedError instead of queueing it forever:
+        * max_pending: the total number of tasks running or waiting in the pool
+        * max_pending_per_key: the number of tasks of one key(e.g. a tenant), so that one tenant can't take it all
+    When a state execution gets rejected, raising the error lets the iWF server retry the execution with backoff.
+    """
+
+    def __init__(self, max_workers: int, max_pending: int, max_pending_per_key: int):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="background-task")
+        self._max_pending = max_pending
+        self._max_pending_per_key = max_pending_per_key
+        self._pending = 0
+        self._pending_per_key: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, key: str, fn: Callable[..., Any], *args: Any) -> Future:
+        with self._lock:
+            if self._pending >= self._max_pending:
+                raise TaskRejectedError(f"too many pending tasks: {self._pending}")
+            key_pending = self._pending_per_key.get(key, 0)
+            if key_pending >= self._max_pending_per_key:
+                raise TaskRejectedError(f"too many pending tasks for {key}: {key_pending}")
+            self._pending += 1
+            self._pending_per_key[key] = key_pending + 1
+
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(lambda _: self._release(key))
+        return future
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"pending": self._pending, "pending_per_key": dict(self._pending_per_key)}
+
+    def _release(self, key: str):
+        with self._lock:
+            self._pending -= 1
+            self._pending_per_key[key] -= 1
+            if self._pending_per_key[key] == 0:
+                del self._pending_per_key[key]
@@ -0,0 +1,69 @@
+import hashlib
+import os
+import tempfile
+from typing import Optional
+
+# a reference looks like "iwf-blob://sha256/<hex digest>"
+BLOB_REF_PREFIX = "iwf-blob://sha256/"
+
+DEFAULT_INLINE_THRESHOLD = 256
+
+
+class BlobNotFoundError(Exception):
+    pass
+
+
+class FileBlobStore:
+    """
+    A content-addressed store for large text values, so that only a short reference is kept in the data attributes
+    instead of the value itself. This is a local filesystem stand-in for an object store like S3.
+
+    Values are stored by their SHA-256, so writing the same value again (e.g. a retried state execution,
+    or an auto-saved draft that didn't change) is a no-op, and the blobs are immutable.
+    """
+
+    def __init__(self, root_dir: str, inline_threshold: int = DEFAULT_INLINE_THRESHOLD):
+        self._root_dir = root_dir
+        self._inline_threshold = inline_threshold
+
+    def put(self, value: str) -> str:
+        data = value.encode()
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        if not os.path.exists(path):
+            # the root directory too: it's created on the first write, not when the store is created at import
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # write to a temp file then rename, so a reader never sees a partial blob
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        return BLOB_REF_PREFIX + digest
+
+    def get(self, ref: str) -> str:
+        if not is_blob_ref(ref):
+            raise ValueError(f"not a blob reference: {ref}")
+        try:
+            with open(self._path(ref[len(BLOB_REF_PREFIX):]), "rb") as f:
+                return f.read().decode()
+        except FileNotFoundError:
+            raise BlobNotFoundError(ref)
+
+    def offload(self, value: Optional[str]) -> Optional[str]:
+        """Returns a reference for a large value, or the value itself if it's small enough to keep inline"""
+        if value is None or len(value) < self._inline_threshold:
+            return value
+        return self.put(value)
+
+    def resolve(self, value: Optional[str]) -> Optional[str]:
+        """The reverse of offload: returns the stored value for a reference, or the value itself if it's inline"""
+        if value is None or not is_blob_ref(value):
+            return value
+        return self.get(value)
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self._root_dir, digest[:2], digest)
+
+
+def is_blob_ref(value: str) -> bool:
+    return value.startswith(BLOB_REF_PREFIX)
@@ -0,0 +1,148 @@
+"""
+Records a sample of the worker callbacks, request and response, for replaying them offline with
+benchmarks/replay_callbacks.py, e.g. to reproduce a slowdown seen in production or compare two versions of the code.
+
+The records are gzipped NDJSON, one segment file per IWF_RECORD_SEGMENT_RECORDS records, each line being like
+{"ts": ..., "path": ..., "latency_ms": ..., "status": ..., "request": {...}, "response": {...}}
+with the JSON bodies of the callback as sent by the iWF server and returned by the worker.
+They are written by a background thread; when it falls behind, records are dropped instead of slowing the callbacks.
+
+Configured by environment variables, disabled unless IWF_RECORD_DIR is set:
+    IWF_RECORD_DIR: the directory of the segments
+    IWF_RECORD_SAMPLE_RATE: the fraction of workflows to record (all of their callbacks), default 0.01
+    IWF_RECORD_SEGMENT_RECORDS: the records per segment, default 10000
+"""
+import gzip
+import json
+import os
+import queue
+import threading
+import time
+import zlib
+from typing import Any, Dict, Iterator, Optional
+
+from iwf.worker_service import WorkerService
+
+WORKER_PATHS = (
+    WorkerService.api_path_workflow_state_wait_until,
+    WorkerService.api_path_workflow_state_execute,
+    WorkerService.api_path_workflow_worker_rpc,
+)
+MAX_QUEUED_RECORDS = 10000
+
+
+class CallbackRecorder:
+    def __init__(self, directory: str, sample_rate: float, segment_records: int):
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._threshold = int(sample_rate * 0xFFFFFFFF)
+        self._segment_records = segment_records
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(MAX_QUEUED_RECORDS)
+        # the counters are updated by the request threads and the writer thread
+        self._counters_lock = threading.Lock()
+        self._recorded = 0
+        self._dropped = 0
+        self._segments = 0
+        threading.Thread(target=self._write_segments, name="callback-recorder", daemon=True).start()
+
+    def is_sampled(self, workflow_id: str) -> bool:
+        # by the hash of the workflow id, so that a sampled workflow has all its callbacks recorded
+        return zlib.crc32(workflow_id.encode()) <= self._threshold
+
+    def record(self, entry: Dict[str, Any]):
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            with self._counters_lock:
+                self._dropped += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._counters_lock:
+            return {
+                "recorded": self._recorded,
+                "queued": self._queue.qsize(),
+                "dropped": self._dropped,
+                "segments": self._segments,
+            }
+
+    def _write_segments(self):
+        while True:
+            # a segment is only created once there is something to write
+            entry = self._queue.get()
+            with self._counters_lock:
+                self._segments += 1
+            # the process id keeps the segments of the worker processes sharing the directory apart, and the segment
+            # number the ones of this process started in the same millisecond
+            path = os.path.join(
+                self._directory, f"callbacks-{int(time.time() * 1000)}-{os.getpid()}-{self._segments:06d}.ndjson.gz"
+            )
+            with gzip.open(path, "wt", encoding="utf-8") as segment:
+                for written in range(1, self._segment_records + 1):
+                    segment.write(json.dumps(entry, separators=(",", ":")) + "\n")
+                    with self._counters_lock:
+                        self._recorded += 1
+                    if written == self._segment_records:
+                        break
+                    try:
+                        entry = self._queue.get_nowait()
+                    except queue.Empty:
+                        # so that the segment can already be read up to here
+                        segment.flush()
+                        entry = self._queue.get()
+
+
+def callback_recorder_from_env() -> Optional[CallbackRecorder]:
+    directory = os.environ.get("IWF_RECORD_DIR")
+    if not directory:
+        return None
+    return CallbackRecorder(
+        directory,
+        sample_rate=float(os.environ.get("IWF_RECORD_SAMPLE_RATE", 0.01)),
+        segment_records=int(os.environ.get("IWF_RECORD_SEGMENT_RECORDS", 10000)),
+    )
+
+
+def install_callback_recorder(flask_app) -> Optional[CallbackRecorder]:
+    """Records the sampled worker callbacks of the flask_app, with a CallbackRecorder configured from the environment"""
+    recorder = callback_recorder_from_env()
+    if recorder is None:
+        return None
+
+    from flask import g, request
+
+    @flask_app.before_request
+    def _start_recording():
+        if request.path in WORKER_PATHS:
+            body = request.get_json()
+            if recorder.is_sampled(body["context"]["workflowId"]):
+                g.recording = (time.time(), time.perf_counter(), body)
+
+    @flask_app.after_request
+    def _record(response):
+        recording = g.pop("recording", None)
+        if recording is not None:
+            ts, start, body = recording
+            recorder.record({
+                "ts": ts,
+                "path": request.path,
+                "latency_ms": (time.perf_counter() - start) * 1000,
+                "status": response.status_code,
+                "request": body,
+                "response": response.get_json(silent=True),
+            })
+        return response
+
+    return recorder
+
+
+def read_records(path: str) -> Iterator[Dict[str, Any]]:
+    """The records of a segment, skipping a truncated last line of a segment still being written"""
+    with gzip.open(path, "rt", encoding="utf-8") as segment:
+        try:
+            for line in segment:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    return
+        except EOFError:
+            return
@@ -0,0 +1,165 @@
+"""
+A circuit breaker per downstream API, shared by all the workflows of the worker process.
+
+During a downstream outage, every in-flight workflow keeps calling the broken API until its retry policy is
+exhausted. After failure_threshold consecutive failures, the breaker opens: the calls fail fast with
+CircuitOpenError, without calling the API, for open_seconds. Then it's half-open: one call is let through as a probe,
+closing the breaker when it succeeds and opening it again when it fails. The other calls keep failing fast until then.
+
+A state can fail fast into a compensation when the breaker is open, or park in a state waiting for a durable timer
+until the probe, see moneytransfer/money_transfer_workflow.py:
+
+    def execute(...) -> StateDecision:
+        try:
+            with circuit_breakers.call(DOWNSTREAM_ACCOUNT):
+                ...call the API
+        except CircuitOpenError as e:
+            return StateDecision.single_next_state(AccountServiceWaitState, ...e.retry_after_seconds...)
+
+Configured by environment variables:
+    IWF_CIRCUIT_FAILURE_THRESHOLD: consecutive failures to open a breaker, default 5
+    IWF_CIRCUIT_OPEN_SECONDS: how long a breaker stays open before the probe, default 30
+    IWF_CIRCUIT_PROBE_WAIT_SECONDS: how long the parked workflows wait while the probe is running, default 5
+"""
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+logger = logging.getLogger(__name__)
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, downstream: str, retry_after_seconds: float):
+        super().__init__(f"the circuit breaker of {downstream} is open, retry after {retry_after_seconds:.1f}s")
+        self.downstream = downstream
+        self.retry_after_seconds = retry_after_seconds
+
+
+class CircuitBreaker:
+    def __init__(self, downstream: str, failure_threshold: int, open_seconds: float, probe_wait_seconds: float):
+        self.downstream = downstream
+        self._failure_threshold = failure_threshold
+        self._open_seconds = open_seconds
+        self._probe_wait_seconds = probe_wait_seconds
+        self._lock = threading.Lock()
+        self._state = STATE_CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._probe_started_at = 0.0
+        self._rejected = 0
+        self._opened = 0
+
+    def retry_after(self) -> float:
+        """0 if a call would be allowed now, otherwise the seconds to wait before trying again"""
+        with self._lock:
+            return self._retry_after(time.monotonic())
+
+    def before_call(self):
+        """Raises CircuitOpenError if the call isn't allowed. When half-open, the first call becomes the probe"""
+        with self._lock:
+            now = time.monotonic()
+            retry_after = self._retry_after(now)
+            if retry_after > 0:
+                self._rejected += 1
+                raise CircuitOpenError(self.downstream, retry_after)
+            if self._state == STATE_OPEN:
+                self._state = STATE_HALF_OPEN
+            if self._state == STATE_HALF_OPEN:
+                self._probing = True
+                self._probe_started_at = now
+
+    def on_success(self):
+        with self._lock:
+            if self._state != STATE_CLOSED:
+                logger.info("circuit breaker of %s is closed", self.downstream)
+            self._state = STATE_CLOSED
+            self._consecutive_failures = 0
+            self._probing = False
+
+    def on_failure(self):
+        with self._lock:
+            self._consecutive_failures += 1
+            probe_failed = self._state == STATE_HALF_OPEN
+            self._probing = False
+            if probe_failed or (self._state == STATE_CLOSED and self._consecutive_failures >= self._failure_threshold):
+                logger.warning("circuit breaker of %s is open after %s consecutive failures",
+                               self.downstream, self._consecutive_failures)
+                self._state = STATE_OPEN
+                self._opened_at = time.monotonic()
+                self._opened += 1
+
+    @contextmanager
+    def call(self) -> Iterator[None]:
+        self.before_call()
+        try:
+            yield
+        except BaseException:
+            self.on_failure()
+            raise
+        self.on_success()
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "state": self._state,
+                "consecutive_failures": self._consecutive_failures,
+                "retry_after_seconds": self._retry_after(time.monotonic()),
+                "opened": self._opened,
+                "rejected": self._rejected,
+            }
+
+    def _retry_after(self, now: float) -> float:
+        if self._state == STATE_OPEN:
+            remaining = self._opened_at + self._open_seconds - now
+            if remaining > 0:
+                return remaining
+            # half-open from now on, the next call is the probe
+            return 0.0
+        # a probe that never reports back(e.g. the worker was killed) is replaced after open_seconds
+        if self._state == STATE_HALF_OPEN and self._probing and now - self._probe_started_at < self._open_seconds:
+            return self._probe_wait_seconds
+        return 0.0
+
+
+class CircuitBreakers:
+    def __init__(self, failure_threshold: int, open_seconds: float, probe_wait_seconds: float):
+        self._failure_threshold = failure_threshold
+        self._open_seconds = open_seconds
+        self._probe_wait_seconds = probe_wait_seconds
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def get(self, downstream: str) -> CircuitBreaker:
+        breaker = self._breakers.get(downstream)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.setdefault(downstream, CircuitBreaker(
+                    downstream, self._failure_threshold, self._open_seconds, self._probe_wait_seconds
+                ))
+        return breaker
+
+    def call(self, downstream: str):
+        return self.get(downstream).call()
+
+    def stats(self) -> Dict[str, Dict[str, object]]:
+        return {downstream: breaker.stats() for downstream, breaker in sorted(self._breakers.items())}
+
+
+def circuit_breakers_from_env() -> CircuitBreakers:
+    return CircuitBreakers(
+        failure_threshold=int(os.environ.get("IWF_CIRCUIT_FAILURE_THRESHOLD", 5)),
+        open_seconds=float(os.environ.get("IWF_CIRCUIT_OPEN_SECONDS", 30)),
+        probe_wait_seconds=float(os.environ.get("IWF_CIRCUIT_PROBE_WAIT_SECONDS", 5)),
+    )
+
+
+circuit_breakers = circuit_breakers_from_env()
+
@@ -0,0 +1,82 @@
+"""
+The decisions of the state executions with expensive side effects, kept to be returned again when iWF retries them.
+
+When an execute callback takes longer than its timeout, the iWF server retries it, while the first attempt may still
+be running: the LLM generation, the child workflow starts or the SMTP send run again. For the states decorated with
+@cache_execute_result, the decision is kept by workflow id(and run id) and state execution id: a retry waits for the
+attempt in flight and returns its decision, or returns the decision of an attempt that has completed, instead of
+executing again. Only the decisions are kept, a failed attempt is executed again. A retry waiting for an attempt that
+hangs fails after IWF_EXECUTE_CACHE_WAIT_SECONDS, to be retried again by the server.
+
+    @cache_execute_result
+    class SendingState(WorkflowState[None]):
+        ...
+
+The decisions are kept in an in-memory LRU, and optionally in SQLite (a local stand-in for a shared key-value store)
+so that they survive a restart, see result_store.py. Configured by environment variables:
+    IWF_EXECUTE_CACHE_SIZE: decisions kept in memory, default 10000
+    IWF_EXECUTE_CACHE_TTL_SECONDS: how long a decision is kept, default 3600
+    IWF_EXECUTE_CACHE_DB: the path of the SQLite database, default none(memory only)
+    IWF_EXECUTE_CACHE_WAIT_SECONDS: how long a retry waits for the attempt in flight, default 60
+"""
+import json
+import os
+from typing import Optional, Type, TypeVar
+
+from iwf.iwf_api.models import WorkflowStateExecuteRequest, WorkflowStateExecuteResponse
+from iwf.registry import Registry
+from iwf.worker_service import WorkerOptions
+from iwf.workflow_state import WorkflowState
+
+from common.priority_lanes import LanedWorkerService, PriorityLanes
+from common.result_store import ResultStore
+
+S = TypeVar("S", bound=Type[WorkflowState])
+
+_CACHE_EXECUTE_RESULT_ATTR = "_cache_execute_result"
+
+
+def cache_execute_result(state_class: S) -> S:
+    """Decorates a WorkflowState class to return the kept decision when its execute callback is retried"""
+    setattr(state_class, _CACHE_EXECUTE_RESULT_ATTR, True)
+    return state_class
+
+
+def _encode(response: WorkflowStateExecuteResponse) -> bytes:
+    return json.dumps(response.to_dict()).encode()
+
+
+def _decode(value: bytes) -> WorkflowStateExecuteResponse:
+    return WorkflowStateExecuteResponse.from_dict(json.loads(value))
+
+
+def execute_result_cache_from_env() -> ResultStore[WorkflowStateExecuteResponse]:
+    return ResultStore(
+        "execute_results", _encode, _decode,
+        max_size=int(os.environ.get("IWF_EXECUTE_CACHE_SIZE", 10000)),
+        ttl_seconds=float(os.environ.get("IWF_EXECUTE_CACHE_TTL_SECONDS", 3600)),
+        db_path=os.environ.get("IWF_EXECUTE_CACHE_DB"),
+        wait_timeout_seconds=float(os.environ.get("IWF_EXECUTE_CACHE_WAIT_SECONDS", 60)),
+    )
+
+
+class CachingWorkerService(LanedWorkerService):
+    """A LanedWorkerService returning the kept decisions of the @cache_execute_result states when they are retried"""
+
+    def __init__(self, registry: Registry, options: WorkerOptions, lanes: Optional[PriorityLanes] = None,
+                 execute_cache: Optional[ResultStore[WorkflowStateExecuteResponse]] = None):
+        super().__init__(registry, options, lanes)
+        self.execute_cache = execute_cache
+
+    def handle_workflow_state_execute(self, request: WorkflowStateExecuteRequest) -> WorkflowStateExecuteResponse:
+        if self.execute_cache is None:
+            return super().handle_workflow_state_execute(request)
+        state = self._registry.get_workflow_state_with_check(request.workflow_type, request.workflow_state_id)
+        if not getattr(state, _CACHE_EXECUTE_RESULT_ATTR, False):
+            return super().handle_workflow_state_execute(request)
+        # checked before the lanes, a retry doesn't wait for a thread to return a kept decision
+        # with the run id, as a workflow id started again counts its state executions from 1 again
+        context = request.context
+        key = f"{context.workflow_id}:{context.workflow_run_id}:{context.state_execution_id}"
+        execute = super().handle_workflow_state_execute
+        return self.execute_cache.run(key, lambda: execute(request))
@@ -0,0 +1,118 @@
+"""
+Idempotency keys for the client-facing routes that start workflows or invoke RPCs.
+
+A client retrying a request (after a timeout, a dropped connection, a double click...) sends the same key, in the
+Idempotency-Key header or the idempotencyKey query parameter, and gets the response of the first request
+without calling the iWF server again. Concurrent requests with the same key wait for the first one, and get a 409
+if it's still running after IWF_IDEMPOTENCY_WAIT_SECONDS. Only the successful(2xx) responses are kept, so a failed
+request can be retried for real. A key reused with other parameters or body is a client bug, it gets a 422 instead of
+the response of another request.
+
+The responses are kept in an in-memory LRU, and optionally in SQLite (a local stand-in for a shared key-value store)
+so that they survive a restart, see result_store.py. Configured by environment variables:
+    IWF_IDEMPOTENCY_CACHE_SIZE: responses kept in memory, default 10000
+    IWF_IDEMPOTENCY_TTL_SECONDS: how long a response is kept, default 86400
+    IWF_IDEMPOTENCY_DB: the path of the SQLite database, default none(memory only)
+    IWF_IDEMPOTENCY_WAIT_SECONDS: how long a request waits for the first one with the same key, default 30
+"""
+import base64
+import functools
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+from common.result_store import InFlightTimeoutError, ResultStore
+
+IDEMPOTENCY_KEY_HEADER = "Idempotency-Key"
+IDEMPOTENCY_KEY_PARAM = "idempotencyKey"
+
+
+@dataclass
+class StoredResponse:
+    status: int
+    body: bytes
+    content_type: str
+    # of the request's parameters and body, to tell a retry from another request reusing the key
+    request_hash: str
+
+
+def _encode(response: StoredResponse) -> bytes:
+    return json.dumps({
+        "status": response.status,
+        "body": base64.b64encode(response.body).decode("ascii"),
+        "content_type": response.content_type,
+        "request_hash": response.request_hash,
+    }).encode()
+
+
+def _decode(value: bytes) -> StoredResponse:
+    fields = json.loads(value)
+    return StoredResponse(
+        fields["status"], base64.b64decode(fields["body"]), fields["content_type"], fields["request_hash"]
+    )
+
+
+def idempotency_store_from_env() -> ResultStore[StoredResponse]:
+    return ResultStore(
+        "idempotent_responses", _encode, _decode,
+        max_size=int(os.environ.get("IWF_IDEMPOTENCY_CACHE_SIZE", 10000)),
+        ttl_seconds=float(os.environ.get("IWF_IDEMPOTENCY_TTL_SECONDS", 86400)),
+        db_path=os.environ.get("IWF_IDEMPOTENCY_DB"),
+        wait_timeout_seconds=float(os.environ.get("IWF_IDEMPOTENCY_WAIT_SECONDS", 30)),
+    )
+
+
+def get_idempotency_key() -> Optional[str]:
+    from flask import request
+
+    return request.headers.get(IDEMPOTENCY_KEY_HEADER) or request.args.get(IDEMPOTENCY_KEY_PARAM)
+
+
+def get_request_hash() -> str:
+    from flask import request
+
+    params = sorted((name, value) for name, value in request.args.items(multi=True) if name != IDEMPOTENCY_KEY_PARAM)
+    digest = hashlib.sha256(json.dumps([request.method, params]).encode())
+    digest.update(request.get_data())
+    return digest.hexdigest()
+
+
+def idempotent(store: ResultStore[StoredResponse]):
+    """Decorates a Flask route to replay the response of a request with the same idempotency key"""
+
+    def decorator(route):
+        @functools.wraps(route)
+        def wrapper(*args, **kwargs):
+            from flask import make_response, request
+
+            key = get_idempotency_key()
+            if key is None:
+                return route(*args, **kwargs)
+
+            request_hash = get_request_hash()
+            # the response of the route when this request runs it, returned as is with its headers
+            ran = []
+
+            def call_route() -> StoredResponse:
+                response = make_response(route(*args, **kwargs))
+                ran.append(response)
+                return StoredResponse(response.status_code, response.get_data(), response.content_type, request_hash)
+
+            try:
+                # only the successful responses are kept, so that a failed request can be retried for real
+                stored = store.run(
+                    f"{request.path}:{key}", call_route, keep=lambda response: 200 <= response.status < 300
+                )
+            except InFlightTimeoutError:
+                return "a request with the same idempotency key is still in progress, retry later", 409
+            if ran:
+                return ran[0]
+            if stored.request_hash != request_hash:
+                return "the idempotency key was already used by a request with other parameters", 422
+            return stored.body, stored.status, {"Content-Type": stored.content_type}
+
+        return wrapper
+
+    return decorator
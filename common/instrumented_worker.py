@@ -0,0 +1,79 @@
+"""
+The WorkerService of the samples, instrumenting every callback with the tools of common/:
+    structured_logging: the logs of the callback are tagged with the workflow id, type and state/RPC
+    payload_metrics: the encoded sizes of the data attributes loaded and upserted are recorded
+    memory_profiler: the memory allocations of the callback are tracked, when enabled
+    persistence_usage: the data attributes read by the callback are tracked, when enabled
+
+Each of them is a context manager entered around the callback by callback_instrumentation, so that one can be added
+or left out without changing the others.
+"""
+from contextlib import ExitStack, contextmanager
+from typing import Any, Iterator, List, Union
+
+from iwf.iwf_api.models import (
+    KeyValue,
+    WorkflowStateExecuteRequest,
+    WorkflowStateExecuteResponse,
+    WorkflowStateWaitUntilRequest,
+    WorkflowStateWaitUntilResponse,
+    WorkflowWorkerRpcRequest,
+    WorkflowWorkerRpcResponse,
+)
+from iwf.iwf_api.types import Unset
+from iwf.registry import Registry
+from iwf.worker_service import WorkerOptions, WorkerService
+
+from common.memory_profiler import callback_memory_profiler
+from common.payload_metrics import payload_size_metrics
+from common.persistence_usage import persistence_usage_tracker
+from common.structured_logging import log_context
+
+
+@contextmanager
+def callback_instrumentation(workflow_type: str, name: str, loaded: Union[List[KeyValue], None, Unset],
+                             **log_fields: Any) -> Iterator[None]:
+    """Instruments a callback of the workflow type, name is the RPC or <state id>.<waitUntil|execute>"""
+    with ExitStack() as stack:
+        stack.enter_context(log_context(workflow_type=workflow_type, **log_fields))
+        payload_size_metrics.record(workflow_type, "load", loaded)
+        if persistence_usage_tracker is not None:
+            loaded_keys = [kv.key for kv in loaded] if isinstance(loaded, list) else []
+            stack.enter_context(persistence_usage_tracker.track(workflow_type, name, loaded_keys))
+        if callback_memory_profiler is not None:
+            stack.enter_context(callback_memory_profiler.track(workflow_type, name))
+        yield
+
+
+class InstrumentedWorkerService(WorkerService):
+    """A WorkerService whose callbacks are instrumented by callback_instrumentation"""
+
+    def __init__(self, registry: Registry, options: WorkerOptions):
+        if persistence_usage_tracker is not None:
+            registry = persistence_usage_tracker.wrap_registry(registry)
+        super().__init__(registry, options)
+
+    def handle_workflow_worker_rpc(self, request: WorkflowWorkerRpcRequest) -> WorkflowWorkerRpcResponse:
+        with callback_instrumentation(request.workflow_type, request.rpc_name, request.data_attributes,
+                                      workflow_id=request.context.workflow_id, rpc=request.rpc_name):
+            response = super().handle_workflow_worker_rpc(request)
+        payload_size_metrics.record(request.workflow_type, "upsert", response.upsert_data_attributes)
+        return response
+
+    def handle_workflow_state_wait_until(
+            self, request: WorkflowStateWaitUntilRequest
+    ) -> WorkflowStateWaitUntilResponse:
+        with callback_instrumentation(request.workflow_type, f"{request.workflow_state_id}.waitUntil",
+                                      request.data_objects, workflow_id=request.context.workflow_id,
+                                      state_execution_id=request.context.state_execution_id):
+            response = super().handle_workflow_state_wait_until(request)
+        payload_size_metrics.record(request.workflow_type, "upsert", response.upsert_data_objects)
+        return response
+
+    def handle_workflow_state_execute(self, request: WorkflowStateExecuteRequest) -> WorkflowStateExecuteResponse:
+        with callback_instrumentation(request.workflow_type, f"{request.workflow_state_id}.execute",
+                                      request.data_objects, workflow_id=request.context.workflow_id,
+                                      state_execution_id=request.context.state_execution_id):
+            response = super().handle_workflow_state_execute(request)
+        payload_size_metrics.record(request.workflow_type, "upsert", response.upsert_data_objects)
+        return response
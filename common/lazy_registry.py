@@ -0,0 +1,84 @@
+import importlib
+import threading
+from typing import Dict, Optional
+
+from iwf.registry import Registry
+from iwf.type_store import TypeStore
+from iwf.workflow import ObjectWorkflow, get_workflow_type
+from iwf.workflow_state import WorkflowState
+
+
+class LazyRegistry(Registry):
+    """
+    A Registry where a workflow can be added by its type and "module:ClassName", and is only imported and registered
+    when it's first used by the client or a callback. So a worker starts without loading the workflows it
+    doesn't serve yet, along with everything they import.
+
+    It also builds the state options of every registered state once. The SDK calls get_state_options of the next
+    states for every state decision, and the samples create new WorkflowStateOptions(and RetryPolicy) in it each time.
+    This requires the options to be static: the same for every execution, and never modified.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._lazy_workflows: Dict[str, str] = {}
+        self._lazy_lock = threading.Lock()
+
+    def add_lazy_workflow(self, wf_type: str, path: str):
+        """wf_type is the class name of the workflow, path is like "signup.signup_workflow:UserSignupWorkflow\""""
+        self._lazy_workflows[wf_type] = path
+
+    def add_workflow(self, wf: ObjectWorkflow):
+        super().add_workflow(wf)
+        for state in super().get_state_store(get_workflow_type(wf)).values():
+            options = state.get_state_options()
+            state.get_state_options = lambda frozen=options: frozen
+
+    def get_workflow_with_check(self, wf_type: str) -> ObjectWorkflow:
+        self._ensure_registered(wf_type)
+        return super().get_workflow_with_check(wf_type)
+
+    def get_workflow_starting_state(self, wf_type: str) -> Optional[WorkflowState]:
+        self._ensure_registered(wf_type)
+        return super().get_workflow_starting_state(wf_type)
+
+    def get_workflow_state_with_check(self, wf_type: str, state_id: str) -> WorkflowState:
+        self._ensure_registered(wf_type)
+        return super().get_workflow_state_with_check(wf_type, state_id)
+
+    def get_state_store(self, wf_type: str) -> dict[str, WorkflowState]:
+        self._ensure_registered(wf_type)
+        return super().get_state_store(wf_type)
+
+    def get_internal_channel_type_store(self, wf_type: str) -> TypeStore:
+        self._ensure_registered(wf_type)
+        return super().get_internal_channel_type_store(wf_type)
+
+    def get_signal_channel_types(self, wf_type: str) -> dict[str, Optional[type]]:
+        self._ensure_registered(wf_type)
+        return super().get_signal_channel_types(wf_type)
+
+    def get_data_attribute_types(self, wf_type: str) -> TypeStore:
+        self._ensure_registered(wf_type)
+        return super().get_data_attribute_types(wf_type)
+
+    def get_search_attribute_types(self, wf_type: str):
+        self._ensure_registered(wf_type)
+        return super().get_search_attribute_types(wf_type)
+
+    def get_rpc_infos(self, wf_type: str):
+        self._ensure_registered(wf_type)
+        return super().get_rpc_infos(wf_type)
+
+    def _ensure_registered(self, wf_type: str):
+        if wf_type not in self._lazy_workflows:
+            return
+        # other threads wait here until the workflow is fully registered
+        with self._lazy_lock:
+            path = self._lazy_workflows.get(wf_type)
+            if path is None:
+                return
+            module_name, _, class_name = path.partition(":")
+            workflow_class = getattr(importlib.import_module(module_name), class_name)
+            self.add_workflow(workflow_class())
+            del self._lazy_workflows[wf_type]
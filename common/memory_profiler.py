@@ -0,0 +1,114 @@
+"""
+Memory accounting of the worker callbacks with tracemalloc, to find what a long-running worker keeps allocating.
+
+For a sample of the callbacks, it takes a tracemalloc snapshot before and after the callback and keeps, per workflow
+type and state/RPC, the memory still allocated after the callback and the source lines that allocated it.
+A callback that leaks shows up with a net allocation that never goes down. Other threads allocate at the same time,
+so the numbers of one callback are approximate, but a leak adds up over the samples.
+
+Tracing slows down every allocation of the process, not only of the sampled callbacks, so it's meant for
+a canary or a soak test(benchmarks/memory_soak.py) rather than every worker. Configured by environment variables,
+disabled unless IWF_TRACEMALLOC_SAMPLE_RATE is set:
+    IWF_TRACEMALLOC_SAMPLE_RATE: the fraction of callbacks to take snapshots around
+    IWF_TRACEMALLOC_FRAMES: the frames of the stack kept per allocation, default 1
+    IWF_TRACEMALLOC_TOP: the allocating lines kept per workflow type and state/RPC, default 10
+"""
+import os
+import random
+import resource
+import sys
+import threading
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+
+class _CallbackMemoryStats:
+    def __init__(self):
+        self.samples = 0
+        self.net_bytes = 0
+        self.max_net_bytes = 0
+        self.lines: Dict[str, int] = {}
+
+
+class CallbackMemoryProfiler:
+    def __init__(self, sample_rate: float, frames: int = 1, top: int = 10):
+        self._sample_rate = sample_rate
+        self._top = top
+        self._stats: Dict[str, _CallbackMemoryStats] = {}
+        self._lock = threading.Lock()
+        self._filters = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ]
+        tracemalloc.start(frames)
+
+    @contextmanager
+    def track(self, workflow_type: str, name: str) -> Iterator[None]:
+        """Tracks a sample of the callbacks, named like the state id or the RPC name"""
+        if random.random() >= self._sample_rate:
+            yield
+            return
+        before = tracemalloc.take_snapshot().filter_traces(self._filters)
+        yield
+        after = tracemalloc.take_snapshot().filter_traces(self._filters)
+        diff = after.compare_to(before, "lineno")
+        net = sum(stat.size_diff for stat in diff)
+        with self._lock:
+            stats = self._stats.setdefault(f"{workflow_type}.{name}", _CallbackMemoryStats())
+            stats.samples += 1
+            stats.net_bytes += net
+            stats.max_net_bytes = max(stats.max_net_bytes, net)
+            for stat in diff:
+                if stat.size_diff > 0:
+                    line = str(stat.traceback)
+                    stats.lines[line] = stats.lines.get(line, 0) + stat.size_diff
+            # keep the largest only, so the stats don't grow with the number of lines seen
+            if len(stats.lines) > self._top * 10:
+                stats.lines = dict(sorted(stats.lines.items(), key=lambda item: -item[1])[:self._top])
+
+    def snapshot(self) -> Dict[str, Any]:
+        traced, peak = tracemalloc.get_traced_memory()
+        with self._lock:
+            callbacks = {
+                key: {
+                    "samples": stats.samples,
+                    "avg_net_bytes": stats.net_bytes // stats.samples,
+                    "max_net_bytes": stats.max_net_bytes,
+                    "top_lines": dict(sorted(stats.lines.items(), key=lambda item: -item[1])[:self._top]),
+                }
+                for key, stats in self._stats.items()
+            }
+        return {"traced_bytes": traced, "traced_peak_bytes": peak, "callbacks": callbacks}
+
+
+def rss_bytes() -> int:
+    """The current resident set size of the process, or the max one where /proc is not available"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # in bytes on macOS, in kilobytes elsewhere
+        return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def memory_profiler_from_env() -> Optional[CallbackMemoryProfiler]:
+    sample_rate = float(os.environ.get("IWF_TRACEMALLOC_SAMPLE_RATE", 0))
+    if sample_rate <= 0:
+        return None
+    return CallbackMemoryProfiler(
+        sample_rate,
+        frames=int(os.environ.get("IWF_TRACEMALLOC_FRAMES", 1)),
+        top=int(os.environ.get("IWF_TRACEMALLOC_TOP", 10)),
+    )
+
+
+callback_memory_profiler = memory_profiler_from_env()
+
+
+def memory_stats() -> Dict[str, Any]:
+    stats: Dict[str, Any] = {"rss_bytes": rss_bytes()}
+    if callback_memory_profiler is not None:
+        stats.update(callback_memory_profiler.snapshot())
+    return stats
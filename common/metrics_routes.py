@@ -0,0 +1,42 @@
+"""
+The /metrics routes of the samples' workers, e.g. http://localhost:8802/metrics/payload_sizes.
+
+install_metrics_routes registers the metrics of the tools of common/ that every worker has, plus the ones of the
+sample itself, e.g. {"idempotency": idempotency_store.stats}. A tool that isn't enabled reports {}.
+"""
+from typing import Any, Callable, Dict, Optional
+
+from common.admission_control import AdmissionController
+from common.callback_recorder import CallbackRecorder
+from common.memory_profiler import memory_stats
+from common.payload_metrics import payload_size_metrics
+from common.persistence_usage import persistence_usage_report
+from common.priority_lanes import LanedWorkerService
+from common.rate_limiter import rate_limiter_stats
+from common.structured_logging import logging_stats
+
+
+def install_metrics_routes(
+        flask_app,
+        worker_service: LanedWorkerService,
+        admission_controller: Optional[AdmissionController] = None,
+        callback_recorder: Optional[CallbackRecorder] = None,
+        sample_metrics: Optional[Dict[str, Callable[[], Any]]] = None,
+):
+    """Registers /metrics/<name> for the common metrics, and for each of the sample_metrics by name"""
+    # only the CachingWorkerService has one
+    execute_cache = getattr(worker_service, "execute_cache", None)
+    metrics: Dict[str, Callable[[], Any]] = {
+        "payload_sizes": payload_size_metrics.snapshot,
+        "logging": logging_stats,
+        "admission": lambda: admission_controller.stats() if admission_controller else {},
+        "lanes": lambda: worker_service.lanes.stats() if worker_service.lanes else {},
+        "recorder": lambda: callback_recorder.stats() if callback_recorder else {},
+        "memory": memory_stats,
+        "persistence_usage": persistence_usage_report,
+        "rate_limits": rate_limiter_stats,
+        "execute_cache": lambda: execute_cache.stats() if execute_cache else {},
+    }
+    metrics.update(sample_metrics or {})
+    for name, stats in metrics.items():
+        flask_app.add_url_rule(f"/metrics/{name}", f"metrics_{name}", stats)
@@ -0,0 +1,60 @@
+"""
+The encoded sizes of the data attributes per workflow type and key, recorded by the InstrumentedWorkerService for
+every callback(see instrumented_worker.py), and reported at /metrics/payload_sizes.
+"""
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Tuple, Union
+
+from iwf.iwf_api.models import KeyValue
+from iwf.iwf_api.types import Unset
+
+
+@dataclass
+class _SizeStats:
+    count: int = 0
+    total_bytes: int = 0
+    max_bytes: int = 0
+
+    def add(self, size: int):
+        self.count += 1
+        self.total_bytes += size
+        self.max_bytes = max(self.max_bytes, size)
+
+
+class PayloadSizeMetrics:
+    """
+    Encoded sizes of data attributes per workflow type and key, for what the worker loaded("load") from the server
+    and what it wrote back("upsert").
+    """
+
+    def __init__(self):
+        self._stats: Dict[Tuple[str, str, str], _SizeStats] = {}
+        self._lock = threading.Lock()
+
+    def record(self, workflow_type: str, direction: str, key_values: Union[List[KeyValue], None, Unset]):
+        if not isinstance(key_values, list):
+            return
+        with self._lock:
+            for kv in key_values:
+                value = kv.value
+                if isinstance(kv.key, Unset) or isinstance(value, Unset) or value is None:
+                    continue
+                size = len(value.data) if isinstance(value.data, str) else 0
+                self._stats.setdefault((workflow_type, kv.key, direction), _SizeStats()).add(size)
+
+    def snapshot(self) -> Dict[str, Dict[str, Dict[str, Dict[str, int]]]]:
+        """Returns {workflow_type: {key: {direction: {count, total_bytes, avg_bytes, max_bytes}}}}"""
+        result: Dict[str, Dict[str, Dict[str, Dict[str, int]]]] = {}
+        with self._lock:
+            for (wf_type, key, direction), stats in self._stats.items():
+                result.setdefault(wf_type, {}).setdefault(key, {})[direction] = {
+                    "count": stats.count,
+                    "total_bytes": stats.total_bytes,
+                    "avg_bytes": stats.total_bytes // stats.count,
+                    "max_bytes": stats.max_bytes,
+                }
+        return result
+
+
+payload_size_metrics = PayloadSizeMetrics()
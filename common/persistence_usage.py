@@ -0,0 +1,170 @@
+"""
+Checks which data attributes each RPC and state callback actually reads, versus the ones it's sent by the iWF server,
+to find where a partial loading policy would shrink the callback payloads (or where one is missing a key).
+
+For every callback, it records the keys loaded(sent in the request) and the keys read with
+Persistence.get_data_attribute before being set by the callback itself. Per workflow type and state/RPC it reports:
+    unused: the keys loaded but never read, which a partial loading policy could leave out
+    missing: the keys read but not loaded in some callbacks, e.g. not in the partial_loading_keys of the policy
+(a key that isn't set yet is not sent either, so "missing" can also be a key read before it's first set)
+
+The worker service is given a wrapped registry(see wrap_registry), whose states and RPCs are passed a Persistence that
+records the reads and writes of the callback being tracked. Only the worker's own callbacks are affected, the SDK's
+Persistence class isn't changed. It's for development and tests, enabled by IWF_PERSISTENCE_USAGE=true, the report is
+at /metrics/persistence_usage.
+"""
+import contextvars
+import copy
+import dataclasses
+import functools
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple, Type
+
+from iwf.persistence import Persistence
+from iwf.registry import Registry
+from iwf.rpc import RPCInfo
+from iwf.workflow_state import WorkflowState, should_skip_wait_until
+
+
+class _CallbackUsage:
+    def __init__(self):
+        self.read: Set[str] = set()
+        self.written: Set[str] = set()
+
+
+class _UsageStats:
+    def __init__(self):
+        self.calls = 0
+        self.loaded: Dict[str, int] = {}
+        self.read: Dict[str, int] = {}
+        self.missing: Dict[str, int] = {}
+
+
+_current_usage: "contextvars.ContextVar[Optional[_CallbackUsage]]" = contextvars.ContextVar(
+    "persistence_usage", default=None
+)
+
+
+class PersistenceUsageTracker:
+    def __init__(self):
+        self._stats: Dict[str, _UsageStats] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def track(self, workflow_type: str, name: str, loaded_keys: List[str]) -> Iterator[None]:
+        usage = _CallbackUsage()
+        token = _current_usage.set(usage)
+        try:
+            yield
+        finally:
+            _current_usage.reset(token)
+            loaded = set(loaded_keys)
+            with self._lock:
+                stats = self._stats.setdefault(f"{workflow_type}.{name}", _UsageStats())
+                stats.calls += 1
+                for key in loaded:
+                    stats.loaded[key] = stats.loaded.get(key, 0) + 1
+                for key in usage.read:
+                    stats.read[key] = stats.read.get(key, 0) + 1
+                    if key not in loaded:
+                        stats.missing[key] = stats.missing.get(key, 0) + 1
+
+    def report(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                name: {
+                    "calls": stats.calls,
+                    "loaded": dict(stats.loaded),
+                    "read": dict(stats.read),
+                    "unused": sorted(key for key in stats.loaded if key not in stats.read),
+                    "missing": sorted(stats.missing),
+                }
+                for name, stats in sorted(self._stats.items())
+            }
+
+    def wrap_registry(self, registry: Registry) -> Registry:
+        """Returns the registry to give to the WorkerService, to record the data attributes its callbacks read"""
+        return _TrackedRegistry(registry)  # type: ignore
+
+
+class _TrackedPersistence(Persistence):
+    def __init__(self, persistence: Persistence, usage: _CallbackUsage):
+        super().__init__(persistence._data_attributes, persistence._search_attributes,
+                         persistence._state_execution_locals)
+        self._usage = usage
+
+    def get_data_attribute(self, key: str) -> Any:
+        if key not in self._usage.written:
+            self._usage.read.add(key)
+        return super().get_data_attribute(key)
+
+    def set_data_attribute(self, key: str, value: Any):
+        self._usage.written.add(key)
+        super().set_data_attribute(key, value)
+
+
+def _tracked(func: Callable) -> Callable:
+    @functools.wraps(func)
+    def wrapper(*args):
+        usage = _current_usage.get()
+        if usage is not None:
+            args = tuple(_TrackedPersistence(arg, usage) if isinstance(arg, Persistence) else arg for arg in args)
+        return func(*args)
+
+    return wrapper
+
+
+def _tracked_state_class(state: WorkflowState) -> Type[WorkflowState]:
+    """A subclass of the class of the state whose callbacks are passed a _TrackedPersistence"""
+    state_class = type(state)
+    overrides: Dict[str, Any] = {"execute": _tracked(state_class.execute)}
+    # a state without its own wait_until skips it, keep it inherited for should_skip_wait_until
+    if not should_skip_wait_until(state):
+        overrides["wait_until"] = _tracked(state_class.wait_until)
+    return type(state_class.__name__, (state_class,), overrides)
+
+
+class _TrackedRegistry:
+    """A Registry whose states and RPCs are passed a _TrackedPersistence, the rest is the registry's own"""
+
+    def __init__(self, registry: Registry):
+        self._registry = registry
+        self._states: Dict[Tuple[str, str], WorkflowState] = {}
+        self._rpc_infos: Dict[str, Dict[str, RPCInfo]] = {}
+
+    def get_workflow_state_with_check(self, wf_type: str, state_id: str) -> WorkflowState:
+        tracked = self._states.get((wf_type, state_id))
+        if tracked is None:
+            state = self._registry.get_workflow_state_with_check(wf_type, state_id)
+            tracked = copy.copy(state)
+            tracked.__class__ = _tracked_state_class(state)
+            self._states[(wf_type, state_id)] = tracked
+        return tracked
+
+    def get_rpc_infos(self, wf_type: str) -> Dict[str, RPCInfo]:
+        rpc_infos = self._rpc_infos.get(wf_type)
+        if rpc_infos is None:
+            rpc_infos = {
+                name: dataclasses.replace(info, method_func=_tracked(info.method_func))
+                for name, info in self._registry.get_rpc_infos(wf_type).items()
+            }
+            self._rpc_infos[wf_type] = rpc_infos
+        return rpc_infos
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._registry, name)
+
+
+def persistence_usage_tracker_from_env() -> Optional[PersistenceUsageTracker]:
+    if os.environ.get("IWF_PERSISTENCE_USAGE", "false").lower() != "true":
+        return None
+    return PersistenceUsageTracker()
+
+
+persistence_usage_tracker = persistence_usage_tracker_from_env()
+
+
+def persistence_usage_report() -> Dict[str, Dict[str, Any]]:
+    return persistence_usage_tracker.report() if persistence_usage_tracker is not None else {}
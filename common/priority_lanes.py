@@ -0,0 +1,130 @@
+"""
+Separate thread pools("lanes") for the RPC callbacks and the state callbacks of a worker.
+
+The RPCs are mostly user-facing (e.g. a user submitting a request) while the state callbacks can be long and
+numerous (e.g. an agent state calling an LLM). When they all run on the HTTP server's threads, the RPCs compete
+with every state callback in flight. With the lanes, at most IWF_STATE_LANE_THREADS state callbacks run at a time,
+the others wait in the state lane's queue, and the RPCs run on their own IWF_RPC_LANE_THREADS threads.
+
+Configured by environment variables, disabled unless IWF_PRIORITY_LANES=true:
+    IWF_RPC_LANE_THREADS: threads running the RPC callbacks, default 8
+    IWF_STATE_LANE_THREADS: threads running the waitUntil/execute callbacks, default 16
+"""
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+from iwf.iwf_api.models import (
+    WorkflowStateExecuteRequest,
+    WorkflowStateExecuteResponse,
+    WorkflowStateWaitUntilRequest,
+    WorkflowStateWaitUntilResponse,
+    WorkflowWorkerRpcRequest,
+    WorkflowWorkerRpcResponse,
+)
+from iwf.registry import Registry
+from iwf.worker_service import WorkerOptions
+
+from common.instrumented_worker import InstrumentedWorkerService
+
+LANE_RPC = "rpc"
+LANE_STATE = "state"
+
+T = TypeVar("T")
+
+
+class Lane:
+    def __init__(self, name: str, max_workers: int):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-lane")
+        self._max_workers = max_workers
+        self._queued = 0
+        self._running = 0
+        self._max_queued = 0
+        self._completed = 0
+        self._total_wait_seconds = 0.0
+        self._max_wait_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def run(self, fn: Callable[..., T], *args: Any) -> T:
+        """Runs fn on the lane and waits for its result, with the log context of the caller"""
+        context = contextvars.copy_context()
+        submitted = time.monotonic()
+        with self._lock:
+            self._queued += 1
+            self._max_queued = max(self._max_queued, self._queued)
+
+        def task():
+            waited = time.monotonic() - submitted
+            with self._lock:
+                self._queued -= 1
+                self._running += 1
+                self._total_wait_seconds += waited
+                self._max_wait_seconds = max(self._max_wait_seconds, waited)
+            try:
+                return context.run(fn, *args)
+            finally:
+                with self._lock:
+                    self._running -= 1
+                    self._completed += 1
+
+        return self._executor.submit(task).result()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "threads": self._max_workers,
+                "queued": self._queued,
+                "running": self._running,
+                "max_queued": self._max_queued,
+                "completed": self._completed,
+                "avg_wait_ms": self._total_wait_seconds * 1000 / self._completed if self._completed else 0,
+                "max_wait_ms": self._max_wait_seconds * 1000,
+            }
+
+
+class PriorityLanes:
+    def __init__(self, rpc_threads: int, state_threads: int):
+        self.lanes = {LANE_RPC: Lane(LANE_RPC, rpc_threads), LANE_STATE: Lane(LANE_STATE, state_threads)}
+
+    def run(self, lane: str, fn: Callable[..., T], *args: Any) -> T:
+        return self.lanes[lane].run(fn, *args)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: lane.stats() for name, lane in self.lanes.items()}
+
+
+def priority_lanes_from_env() -> Optional[PriorityLanes]:
+    if os.environ.get("IWF_PRIORITY_LANES", "false").lower() != "true":
+        return None
+    return PriorityLanes(
+        rpc_threads=int(os.environ.get("IWF_RPC_LANE_THREADS", 8)),
+        state_threads=int(os.environ.get("IWF_STATE_LANE_THREADS", 16)),
+    )
+
+
+class LanedWorkerService(InstrumentedWorkerService):
+    """An InstrumentedWorkerService running the RPC and the state callbacks on their own lanes, when lanes are given"""
+
+    def __init__(self, registry: Registry, options: WorkerOptions, lanes: Optional[PriorityLanes] = None):
+        super().__init__(registry, options)
+        self.lanes = lanes
+
+    def handle_workflow_worker_rpc(self, request: WorkflowWorkerRpcRequest) -> WorkflowWorkerRpcResponse:
+        if self.lanes is None:
+            return super().handle_workflow_worker_rpc(request)
+        return self.lanes.run(LANE_RPC, super().handle_workflow_worker_rpc, request)
+
+    def handle_workflow_state_wait_until(
+            self, request: WorkflowStateWaitUntilRequest
+    ) -> WorkflowStateWaitUntilResponse:
+        if self.lanes is None:
+            return super().handle_workflow_state_wait_until(request)
+        return self.lanes.run(LANE_STATE, super().handle_workflow_state_wait_until, request)
+
+    def handle_workflow_state_execute(self, request: WorkflowStateExecuteRequest) -> WorkflowStateExecuteResponse:
+        if self.lanes is None:
+            return super().handle_workflow_state_execute(request)
+        return self.lanes.run(LANE_STATE, super().handle_workflow_state_execute, request)
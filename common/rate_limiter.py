@@ -0,0 +1,200 @@
+"""
+A token bucket rate limiter per downstream API(account service, instance API, SMTP, OpenAI...), shared by all the
+worker processes of a host.
+
+Instead of calling a throttled API, failing with a 429 and being retried by the iWF server with backoff, a state takes
+a token in execute, and when there is none, moves to a throttled state waiting for a durable timer until the next
+token is expected. Only the throttled executions pay for the wait_until callback of the timer:
+
+    def execute(...) -> StateDecision:
+        if not try_acquire(DOWNSTREAM_OPENAI):
+            return StateDecision.single_next_state(AgentThrottledState)
+        ...call the API
+
+    class AgentThrottledState(WorkflowState[None]):
+        def wait_until(...) -> CommandRequest:
+            return throttle(DOWNSTREAM_OPENAI)
+
+        def execute(...) -> StateDecision:
+            if is_throttled(command_results):
+                # no token was acquired, try again
+                return StateDecision.single_next_state(AgentThrottledState)
+            ...call the API
+
+A workflow with many such states can instead wait for acquire_or_wait() seconds in one waiting state and go back to
+the state that was throttled, see AccountServiceWaitState of the money transfer.
+
+The buckets are kept in SQLite(a local stand-in for a shared store like Redis), updated in a transaction, so that
+the pre-forked worker processes share them. If the database can't be used, the call is allowed, the limiter must
+not stop the workflows. Configured by environment variables:
+    IWF_RATE_LIMITS: the limits, e.g. "account=50,smtp=2:10" for 50 calls/s to the account service and 2 calls/s to
+        SMTP with bursts of 10(default burst: one second of calls). The downstreams not listed are not limited.
+        Default none, which disables the limiter
+    IWF_RATE_LIMIT_DB: the path of the SQLite database, default iwf_rate_limits.sqlite3 in the temp directory
+"""
+import logging
+import math
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from iwf.command_request import CommandRequest, TimerCommand
+from iwf.command_results import CommandResults
+
+logger = logging.getLogger(__name__)
+
+DOWNSTREAM_ACCOUNT = "account"
+DOWNSTREAM_INSTANCE = "instance"
+DOWNSTREAM_SMTP = "smtp"
+DOWNSTREAM_OPENAI = "openai"
+
+# the command_id of the timers of throttled states
+THROTTLE_TIMER_ID = "throttle"
+
+
+@dataclass
+class RateLimit:
+    rate_per_second: float
+    burst: float
+
+
+class RateLimiter:
+    def __init__(self, limits: Dict[str, RateLimit], db_path: str):
+        self._limits = limits
+        self._db_path = db_path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._acquired: Dict[str, int] = {downstream: 0 for downstream in limits}
+        self._throttled: Dict[str, int] = {downstream: 0 for downstream in limits}
+        self._errors = 0
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS token_buckets ("
+            "downstream TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    def try_acquire(self, downstream: str, tokens: float = 1) -> float:
+        """Takes the tokens and returns 0, or returns the seconds until they are expected to be available"""
+        limit = self._limits.get(downstream)
+        if limit is None:
+            return 0.0
+        try:
+            wait_seconds = self._try_acquire(downstream, limit, tokens)
+        except sqlite3.Error:
+            logger.exception("failed to acquire a token for %s, allowing the call", downstream)
+            with self._lock:
+                self._errors += 1
+            return 0.0
+        with self._lock:
+            if wait_seconds > 0:
+                self._throttled[downstream] += 1
+            else:
+                self._acquired[downstream] += 1
+        return wait_seconds
+
+    def _try_acquire(self, downstream: str, limit: RateLimit, tokens: float) -> float:
+        conn = self._conn()
+        # IMMEDIATE takes the write lock first, so that the other processes wait instead of reading the same tokens
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            now = time.time()
+            row = conn.execute(
+                "SELECT tokens, updated_at FROM token_buckets WHERE downstream = ?", (downstream,)
+            ).fetchone()
+            available = limit.burst if row is None else min(
+                limit.burst, row[0] + max(0.0, now - row[1]) * limit.rate_per_second
+            )
+            wait_seconds = 0.0
+            if available >= tokens:
+                available -= tokens
+            else:
+                wait_seconds = (tokens - available) / limit.rate_per_second
+            conn.execute(
+                "INSERT OR REPLACE INTO token_buckets (downstream, tokens, updated_at) VALUES (?, ?, ?)",
+                (downstream, available, now),
+            )
+            conn.execute("COMMIT")
+            return wait_seconds
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "limits": {downstream: vars(limit) for downstream, limit in self._limits.items()},
+                "acquired": dict(self._acquired),
+                "throttled": dict(self._throttled),
+                "errors": self._errors,
+            }
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # autocommit, the transactions are explicit
+            conn = sqlite3.connect(self._db_path, timeout=5, isolation_level=None)
+            self._local.conn = conn
+        return conn
+
+
+def parse_rate_limits(spec: str) -> Dict[str, RateLimit]:
+    limits = {}
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        downstream, _, value = item.partition("=")
+        rate, _, burst = value.partition(":")
+        rate_per_second = float(rate)
+        if rate_per_second <= 0:
+            raise ValueError(f"the rate limit of {downstream} must be positive: {item}")
+        limits[downstream.strip()] = RateLimit(
+            rate_per_second=rate_per_second,
+            burst=float(burst) if burst else max(1.0, rate_per_second),
+        )
+    return limits
+
+
+def rate_limiter_from_env() -> Optional[RateLimiter]:
+    limits = parse_rate_limits(os.environ.get("IWF_RATE_LIMITS", ""))
+    if not limits:
+        return None
+    db_path = os.environ.get("IWF_RATE_LIMIT_DB", os.path.join(tempfile.gettempdir(), "iwf_rate_limits.sqlite3"))
+    return RateLimiter(limits, db_path)
+
+
+rate_limiter = rate_limiter_from_env()
+
+
+def try_acquire(downstream: str) -> bool:
+    """Takes a token if there is one, for a state that only waits for a timer when throttled"""
+    return rate_limiter is None or rate_limiter.try_acquire(downstream) <= 0
+
+
+def acquire_or_wait(downstream: str) -> int:
+    """Takes a token and returns 0, or returns the seconds of the durable timer to wait for one"""
+    wait_seconds = rate_limiter.try_acquire(downstream) if rate_limiter is not None else 0.0
+    if wait_seconds <= 0:
+        return 0
+    return max(1, math.ceil(wait_seconds))
+
+
+def throttle(downstream: str) -> CommandRequest:
+    """For the wait_until of a throttled state: proceeds to execute right away with a token, or after a timer"""
+    wait_seconds = acquire_or_wait(downstream)
+    if not wait_seconds:
+        return CommandRequest.empty()
+    return CommandRequest.for_all_command_completed(TimerCommand.by_seconds(wait_seconds, command_id=THROTTLE_TIMER_ID))
+
+
+def is_throttled(command_results: CommandResults) -> bool:
+    """For execute: whether wait_until didn't get a token, and the state must try again"""
+    return any(result.command_id == THROTTLE_TIMER_ID for result in command_results.timer_commands)
+
+
+def rate_limiter_stats() -> Dict[str, object]:
+    return rate_limiter.stats() if rate_limiter is not None else {}
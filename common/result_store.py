@@ -0,0 +1,119 @@
+"""
+Results kept by key, computed once at a time per key, shared by the idempotency keys of the routes and the execute
+results of the states.
+
+The results are kept in an in-memory LRU, and optionally in a SQLite table (a local stand-in for a shared key-value
+store) so that they survive a restart. A caller finding the result of its key being computed by another thread waits
+for it, at most wait_timeout_seconds, so that a hung computation doesn't block the retries forever.
+"""
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Generic, Optional, TypeVar
+
+from common.ttl_cache import TTLCache
+
+V = TypeVar("V")
+
+
+class InFlightTimeoutError(Exception):
+    def __init__(self, key: str, wait_timeout_seconds: float):
+        super().__init__(f"the result of {key} is still being computed after {wait_timeout_seconds:g}s")
+        self.key = key
+
+
+class ResultStore(Generic[V]):
+    def __init__(self, table: str, encode: Callable[[V], bytes], decode: Callable[[bytes], V], max_size: int,
+                 ttl_seconds: float, db_path: Optional[str] = None, wait_timeout_seconds: float = 60):
+        self._table = table
+        self._encode = encode
+        self._decode = decode
+        self._ttl_seconds = ttl_seconds
+        self._wait_timeout_seconds = wait_timeout_seconds
+        self._cache = TTLCache(max_size, ttl_seconds)
+        self._db_path = db_path
+        self._local = threading.local()
+        self._in_flight: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+        self._computed = 0
+        self._reused = 0
+        self._wait_timeouts = 0
+        if db_path is not None:
+            self._conn().execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def get(self, key: str) -> Optional[V]:
+        value = self._cache.get(key)
+        if value is None and self._db_path is not None:
+            row = self._conn().execute(
+                f"SELECT value FROM {self._table} WHERE key = ? AND expires_at > ?", (key, time.time())
+            ).fetchone()
+            if row is not None:
+                value = self._decode(row[0])
+                self._cache.put(key, value)
+        return value
+
+    def put(self, key: str, value: V):
+        self._cache.put(key, value)
+        if self._db_path is not None:
+            conn = self._conn()
+            with conn:
+                conn.execute(
+                    f"INSERT OR REPLACE INTO {self._table} (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, self._encode(value), time.time() + self._ttl_seconds),
+                )
+
+    def run(self, key: str, fn: Callable[[], V], keep: Callable[[V], bool] = lambda value: True) -> V:
+        """
+        Returns the kept result of the key, or runs fn to get it, once at a time per key. The result is kept if keep
+        returns True for it. Raises InFlightTimeoutError if another thread is still computing it after the timeout.
+        """
+        deadline = time.monotonic() + self._wait_timeout_seconds
+        while True:
+            value = self.get(key)
+            if value is not None:
+                with self._lock:
+                    self._reused += 1
+                return value
+            with self._lock:
+                in_flight = self._in_flight.get(key)
+                if in_flight is None:
+                    self._in_flight[key] = threading.Event()
+                    self._computed += 1
+                    break
+            # another thread is computing it, check again once it's done
+            if not in_flight.wait(max(0.0, deadline - time.monotonic())):
+                with self._lock:
+                    self._wait_timeouts += 1
+                raise InFlightTimeoutError(key, self._wait_timeout_seconds)
+
+        try:
+            value = fn()
+            if keep(value):
+                self.put(key, value)
+            return value
+        finally:
+            with self._lock:
+                self._in_flight.pop(key).set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = {
+                "computed": self._computed,
+                "reused": self._reused,
+                "wait_timeouts": self._wait_timeouts,
+                "in_flight": len(self._in_flight),
+            }
+        stats["cache"] = self._cache.stats()
+        return stats
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite connections can't be shared across threads, so keep one per thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._db_path)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
@@ -0,0 +1,164 @@
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import uuid
+import zlib
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Dict, Iterator, Optional
+
+# the ids of the request/workflow being handled by the current thread, added to every log record
+_log_context: "contextvars.ContextVar[Dict[str, str]]" = contextvars.ContextVar("log_context", default={})
+
+# the attributes every LogRecord has, anything else is from the extra argument of a logging call
+_RECORD_ATTRIBUTES = set(logging.LogRecord("", 0, "", 0, "", None, None).__dict__) | {"message", "asctime"}
+
+_configure_lock = threading.Lock()
+_listener: Optional[QueueListener] = None
+_queue_handler: Optional["NonBlockingQueueHandler"] = None
+
+
+@contextmanager
+def log_context(**ids: str) -> Iterator[None]:
+    """Tags the logs in the block with the ids, e.g. log_context(workflow_id=ctx.workflow_id)"""
+    token = _log_context.set({**_log_context.get(), **{k: v for k, v in ids.items() if v}})
+    try:
+        yield
+    finally:
+        _log_context.reset(token)
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats a record as one JSON line, with the log context and the extra fields of the logging call"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        entry.update(getattr(record, "log_context", {}))
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES and key != "log_context":
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class DebugSamplingFilter(logging.Filter):
+    """
+    Keeps the records at or above level, and the DEBUG records of a sample_rate fraction of the workflows.
+    The sampling is by the hash of the workflow id(or request id), so a sampled workflow has all its debug logs.
+    """
+
+    def __init__(self, level: int, sample_rate: float):
+        super().__init__()
+        self._level = level
+        self._threshold = int(sample_rate * 0xFFFFFFFF)
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        # runs on the calling thread: capture the context here, the listener thread doesn't have it
+        context = _log_context.get()
+        record.log_context = context
+        if record.levelno >= self._level:
+            return True
+        key = context.get("workflow_id") or context.get("request_id")
+        return key is not None and zlib.crc32(key.encode()) <= self._threshold
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Puts the records into a bounded queue to be formatted and written by the listener thread.
+    Unlike QueueHandler, only the message and the traceback are formatted on the logging thread(so that the record
+    doesn't hold on to the args and the frames), the JSON line is built by the listener thread. A record is dropped
+    (and counted) when the queue is full, instead of blocking the callback.
+    """
+
+    _exception_formatter = logging.Formatter()
+
+    def __init__(self, log_queue: "queue.Queue[logging.LogRecord]"):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # the args may be changed by the caller before the listener gets to them, merge them into the message now
+        # and keep the extra fields of the call as they are
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self._exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def configure_logging(flask_app=None):
+    """
+    Sends the logs of the process to stdout as JSON lines, through a queue so that logging never blocks the caller.
+    Configured by the environment variables:
+        IWF_LOG_LEVEL: the level always logged, default INFO
+        IWF_LOG_DEBUG_SAMPLE_RATE: the fraction of workflows to also log DEBUG for, default 0
+        IWF_LOG_QUEUE_SIZE: the records waiting to be written before dropping, default 10000
+    If a flask_app is given, the logs of each request are tagged with a request_id(from X-Request-Id, or generated).
+    It's safe to call more than once.
+    """
+    global _listener, _queue_handler
+    with _configure_lock:
+        if _listener is None:
+            level = logging.getLevelName(os.environ.get("IWF_LOG_LEVEL", "INFO").upper())
+            sample_rate = float(os.environ.get("IWF_LOG_DEBUG_SAMPLE_RATE", 0))
+
+            stream_handler = logging.StreamHandler(sys.stdout)
+            stream_handler.setFormatter(JSONFormatter())
+            log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(int(os.environ.get("IWF_LOG_QUEUE_SIZE", 10000)))
+            _queue_handler = NonBlockingQueueHandler(log_queue)
+            _queue_handler.addFilter(DebugSamplingFilter(level, sample_rate))
+
+            root = logging.getLogger()
+            root.handlers = [_queue_handler]
+            # let the DEBUG records reach the sampling filter only when some are going to be kept
+            root.setLevel(logging.DEBUG if sample_rate > 0 else level)
+            _listener = QueueListener(log_queue, stream_handler)
+            _listener.start()
+            # so that the records still queued are written before the process exits
+            atexit.register(_listener.stop)
+
+    if flask_app is not None:
+        _install_request_context(flask_app)
+
+
+def logging_stats() -> Dict[str, int]:
+    if _queue_handler is None:
+        return {}
+    return {"queued": _queue_handler.queue.qsize(), "dropped": _queue_handler.dropped}
+
+
+def _install_request_context(flask_app):
+    from flask import g, request
+
+    @flask_app.before_request
+    def _set_request_id():
+        request_id = request.headers.get("X-Request-Id") or uuid.uuid4().hex
+        g.log_context_token = _log_context.set({**_log_context.get(), "request_id": request_id})
+
+    @flask_app.teardown_request
+    def _reset_request_id(_):
+        token = g.pop("log_context_token", None)
+        if token is not None:
+            _log_context.reset(token)
@@ -0,0 +1,120 @@
+import threading
+import time
+
+import pytest
+from flask import Flask
+from iwf.command_results import CommandResults
+from iwf.communication import Communication
+from iwf.persistence import Persistence
+from iwf.registry import Registry
+from iwf.state_decision import StateDecision
+from iwf.state_schema import StateSchema
+from iwf.worker_service import WorkerService
+from iwf.workflow import ObjectWorkflow
+from iwf.workflow_context import WorkflowContext
+from iwf.workflow_state import WorkflowState
+from iwf.workflow_state_options import WorkflowStateOptions
+
+from common.admission_control import AdmissionController, AdmissionRejectedError, install_admission_control
+
+EXECUTE = WorkerService.api_path_workflow_state_execute
+
+
+class TimedState(WorkflowState[None]):
+    def execute(self, ctx: WorkflowContext, input: None, command_results: CommandResults, persistence: Persistence,
+                communication: Communication) -> StateDecision:
+        return StateDecision.graceful_complete_workflow()
+
+    def get_state_options(self) -> WorkflowStateOptions:
+        return WorkflowStateOptions(execute_api_timeout_seconds=2)
+
+
+class AdmittedWorkflow(ObjectWorkflow):
+    def get_workflow_states(self) -> StateSchema:
+        return StateSchema.with_starting_state(TimedState())
+
+
+def test_callback_over_the_limit_is_admitted_when_one_is_released():
+    controller = AdmissionController(max_in_flight_per_route=1, max_queue_wait_seconds=5)
+    controller.acquire(EXECUTE, "wf", timeout_seconds=30)
+    admitted = threading.Event()
+
+    def queued_callback():
+        controller.acquire(EXECUTE, "wf", timeout_seconds=30)
+        admitted.set()
+
+    thread = threading.Thread(target=queued_callback)
+    thread.start()
+    assert not admitted.wait(0.1)
+    assert controller.stats()["queued_per_route"] == {EXECUTE: 1}
+
+    controller.release(EXECUTE, "wf")
+    assert admitted.wait(5)
+    thread.join()
+    assert controller.stats()["in_flight_per_route"] == {EXECUTE: 1}
+    assert controller.stats()["admitted"] == 2
+
+
+def test_queue_wait_is_bounded_by_the_callback_timeout():
+    controller = AdmissionController(max_in_flight_per_route=1, max_queue_wait_seconds=10)
+    controller.acquire(EXECUTE, "wf", timeout_seconds=30)
+    start = time.monotonic()
+    with pytest.raises(AdmissionRejectedError):
+        # waits a quarter of the 0.4s timeout, not the 10s of max_queue_wait_seconds
+        controller.acquire(EXECUTE, "wf", timeout_seconds=0.4)
+    assert time.monotonic() - start < 1
+    assert controller.stats()["rejected"] == 1
+    assert controller.stats()["queued_per_route"] == {EXECUTE: 0}
+
+
+def test_full_queue_is_rejected_without_waiting():
+    controller = AdmissionController(max_in_flight_per_route=1, max_queued_per_route=0, max_queue_wait_seconds=10)
+    controller.acquire(EXECUTE, "wf", timeout_seconds=30)
+    start = time.monotonic()
+    with pytest.raises(AdmissionRejectedError):
+        controller.acquire(EXECUTE, "wf", timeout_seconds=30)
+    assert time.monotonic() - start < 0.5
+
+
+def test_workflow_type_limit_leaves_room_for_the_others():
+    controller = AdmissionController(max_in_flight_per_route=10, max_in_flight_per_workflow_type=1,
+                                     max_queue_wait_seconds=0.05)
+    controller.acquire(EXECUTE, "busy", timeout_seconds=30)
+    with pytest.raises(AdmissionRejectedError):
+        controller.acquire(EXECUTE, "busy", timeout_seconds=30)
+    controller.acquire(EXECUTE, "other", timeout_seconds=30)
+    assert controller.stats()["in_flight_per_workflow_type"] == {"busy": 1, "other": 1}
+
+
+@pytest.fixture
+def admitted_app(monkeypatch):
+    monkeypatch.setenv("IWF_ADMISSION_MAX_IN_FLIGHT_PER_ROUTE", "1")
+    monkeypatch.setenv("IWF_ADMISSION_MAX_QUEUE_WAIT_SECONDS", "0.05")
+    monkeypatch.setenv("IWF_ADMISSION_RETRY_AFTER_SECONDS", "3")
+    registry = Registry()
+    registry.add_workflow(AdmittedWorkflow())
+    flask_app = Flask(__name__)
+    flask_app.add_url_rule(EXECUTE, "execute", lambda: "ok", methods=["POST"])
+    controller = install_admission_control(flask_app, registry)
+    return flask_app.test_client(), controller
+
+
+def test_rejected_callback_gets_a_503_with_retry_after(admitted_app):
+    client, controller = admitted_app
+    body = {"workflowType": "AdmittedWorkflow", "workflowStateId": "TimedState"}
+
+    response = client.post(EXECUTE, json=body)
+    assert response.status_code == 200
+    # released after the request
+    assert controller.stats()["in_flight_per_route"] == {EXECUTE: 0}
+
+    controller.acquire(EXECUTE, "AdmittedWorkflow", timeout_seconds=30)
+    response = client.post(EXECUTE, json=body)
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "3"
+    assert controller.stats()["in_flight_per_route"] == {EXECUTE: 1}
+
+
+def test_admission_control_is_disabled_by_default(monkeypatch):
+    monkeypatch.delenv("IWF_ADMISSION_MAX_IN_FLIGHT_PER_ROUTE", raising=False)
+    assert install_admission_control(Flask(__name__), Registry()) is None
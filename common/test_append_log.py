@@ -0,0 +1,90 @@
+import pytest
+
+from common.append_log import AppendLog, AppendLogTail
+
+
+class FakePersistence:
+    """The data attributes of a workflow, recording the keys a callback reads and writes"""
+
+    def __init__(self, data_attributes=None):
+        self.data_attributes = dict(data_attributes or {})
+        self.read = set()
+        self.written = set()
+
+    def get_data_attribute(self, key):
+        self.read.add(key)
+        return self.data_attributes.get(key)
+
+    def set_data_attribute(self, key, value):
+        self.written.add(key)
+        self.data_attributes[key] = value
+
+
+def test_append_seals_full_chunks():
+    log = AppendLog("Text", chunk_size=4)
+    persistence = FakePersistence()
+    assert log.append(persistence, "abc") == 0
+    assert log.append(persistence, "defghij") == 2
+    assert persistence.data_attributes["TextChunk_0"] == "abcd"
+    assert persistence.data_attributes["TextChunk_1"] == "efgh"
+    assert persistence.data_attributes["TextTail"] == AppendLogTail(index=2, text="ij")
+    assert log.read(persistence) == "abcdefghij"
+
+
+def test_append_only_touches_the_tail_and_the_chunks_it_seals():
+    log = AppendLog("Text", chunk_size=4)
+    persistence = FakePersistence()
+    for _ in range(10):
+        log.append(persistence, "abc")
+
+    persistence.read.clear()
+    persistence.written.clear()
+    log.append(persistence, "x")
+    assert persistence.read == {"TextTail"}
+    assert persistence.written == {"TextTail"}
+
+    log.append(persistence, "yz")
+    assert persistence.read == {"TextTail"}
+    assert persistence.written == {"TextTail", "TextChunk_7"}
+    assert log.read(persistence) == "abc" * 10 + "xyz"
+
+
+def test_compact_merges_the_legacy_value():
+    log = AppendLog("Text", chunk_size=4)
+    # a workflow started before the log was used
+    persistence = FakePersistence({"Text": "legacy"})
+    log.append(persistence, "-new")
+    assert log.read(persistence) == "legacy-new"
+
+    assert log.compact(persistence) == 2
+    assert persistence.data_attributes["Text"] == ""
+    assert [persistence.data_attributes[f"TextChunk_{i}"] for i in range(2)] == ["lega", "cy-n"]
+    assert persistence.data_attributes["TextTail"] == AppendLogTail(index=2, text="ew")
+    assert log.read(persistence) == "legacy-new"
+
+
+def test_compact_to_a_larger_chunk_size_empties_the_unused_chunks():
+    persistence = FakePersistence()
+    small = AppendLog("Text", chunk_size=2)
+    small.append(persistence, "abcdefg")
+    assert small.read(persistence) == "abcdefg"
+
+    large = AppendLog("Text", chunk_size=4)
+    assert large.compact(persistence) == 1
+    assert persistence.data_attributes["TextChunk_0"] == "abcd"
+    assert persistence.data_attributes["TextChunk_1"] == ""
+    assert persistence.data_attributes["TextChunk_2"] == ""
+    assert large.read(persistence) == "abcdefg"
+
+
+def test_loading_policies():
+    log = AppendLog("Text")
+    assert log.append_loading_policy().partial_loading_keys == ["TextTail"]
+    assert log.append_loading_policy().locking_keys == ["TextTail"]
+    assert log.read_loading_policy().partial_loading_keys == ["Text"]
+    assert log.read_loading_policy().use_key_as_prefix
+
+
+def test_chunk_size_must_be_positive():
+    with pytest.raises(ValueError):
+        AppendLog("Text", chunk_size=0)
@@ -0,0 +1,60 @@
+import threading
+import time
+
+import pytest
+
+from common.background_tasks import BoundedTaskPool, TaskRejectedError
+
+
+@pytest.fixture
+def release():
+    release = threading.Event()
+    yield release
+    release.set()
+
+
+def wait_for_released(pool: BoundedTaskPool):
+    # released by a done callback, which may run after the result is available
+    deadline = time.monotonic() + 5
+    while pool.stats()["pending"]:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_tasks_run_in_the_pool():
+    pool = BoundedTaskPool(max_workers=2, max_pending=4, max_pending_per_key=4)
+    assert pool.submit("tenant-1", lambda a, b: a + b, 1, 2).result(5) == 3
+
+
+def test_pending_tasks_are_bounded_per_key(release):
+    pool = BoundedTaskPool(max_workers=4, max_pending=10, max_pending_per_key=2)
+    pool.submit("tenant-1", release.wait, 5)
+    pool.submit("tenant-1", release.wait, 5)
+    with pytest.raises(TaskRejectedError):
+        pool.submit("tenant-1", release.wait, 5)
+    # another tenant isn't affected
+    pool.submit("tenant-2", release.wait, 5)
+    assert pool.stats() == {"pending": 3, "pending_per_key": {"tenant-1": 2, "tenant-2": 1}}
+
+
+def test_pending_tasks_are_bounded_in_total(release):
+    # more pending than workers: the tasks waiting for a thread count too
+    pool = BoundedTaskPool(max_workers=1, max_pending=2, max_pending_per_key=2)
+    pool.submit("tenant-1", release.wait, 5)
+    pool.submit("tenant-2", release.wait, 5)
+    with pytest.raises(TaskRejectedError):
+        pool.submit("tenant-3", release.wait, 5)
+
+
+def test_finished_tasks_are_released(release):
+    pool = BoundedTaskPool(max_workers=2, max_pending=2, max_pending_per_key=1)
+    failed = pool.submit("tenant-1", lambda: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        failed.result(5)
+    wait_for_released(pool)
+    done = pool.submit("tenant-1", release.wait, 5)
+    release.set()
+    done.result(5)
+    wait_for_released(pool)
+    assert pool.stats() == {"pending": 0, "pending_per_key": {}}
+    pool.submit("tenant-1", lambda: None).result(5)
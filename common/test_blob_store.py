@@ -0,0 +1,35 @@
+import os
+
+import pytest
+
+from common.blob_store import BLOB_REF_PREFIX, BlobNotFoundError, FileBlobStore
+
+
+def test_directory_is_created_on_the_first_write(tmp_path):
+    root = tmp_path / "blobs"
+    store = FileBlobStore(str(root))
+    assert not root.exists()
+    assert store.offload("short") == "short"
+    assert not root.exists()
+    ref = store.put("a long email body")
+    assert os.path.isdir(root)
+    assert store.get(ref) == "a long email body"
+
+
+def test_large_values_are_offloaded_by_content(tmp_path):
+    store = FileBlobStore(str(tmp_path), inline_threshold=10)
+    ref = store.offload("x" * 10)
+    assert ref.startswith(BLOB_REF_PREFIX)
+    # the same value gets the same reference
+    assert store.offload("x" * 10) == ref
+    assert store.resolve(ref) == "x" * 10
+    assert store.resolve("inline") == "inline"
+    assert store.resolve(None) is None
+
+
+def test_missing_blob(tmp_path):
+    store = FileBlobStore(str(tmp_path))
+    with pytest.raises(BlobNotFoundError):
+        store.get(BLOB_REF_PREFIX + "0" * 64)
+    with pytest.raises(ValueError):
+        store.get("not a reference")
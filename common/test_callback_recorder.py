@@ -0,0 +1,68 @@
+import glob
+import os
+import time
+
+from flask import Flask
+from iwf.worker_service import WorkerService
+
+from common.callback_recorder import CallbackRecorder, install_callback_recorder, read_records
+
+
+def wait_for_recorded(recorder: CallbackRecorder, count: int):
+    deadline = time.monotonic() + 5
+    while recorder.stats()["recorded"] < count:
+        assert time.monotonic() < deadline, recorder.stats()
+        time.sleep(0.01)
+
+
+def read_all(directory) -> list:
+    return [record for path in sorted(glob.glob(os.path.join(directory, "*.ndjson.gz"))) for record in
+            read_records(path)]
+
+
+def test_sampling_is_by_workflow(tmp_path):
+    assert CallbackRecorder(str(tmp_path), sample_rate=1, segment_records=10).is_sampled("wf-1")
+    assert not CallbackRecorder(str(tmp_path), sample_rate=0, segment_records=10).is_sampled("wf-1")
+    half = CallbackRecorder(str(tmp_path), sample_rate=0.5, segment_records=10)
+    assert 400 < sum(half.is_sampled(f"wf-{i}") for i in range(1000)) < 600
+
+
+def test_records_are_written_in_segments(tmp_path):
+    recorder = CallbackRecorder(str(tmp_path), sample_rate=1, segment_records=2)
+    for i in range(5):
+        recorder.record({"path": "/execute", "i": i})
+    wait_for_recorded(recorder, 5)
+    assert [record["i"] for record in read_all(tmp_path)] == [0, 1, 2, 3, 4]
+    assert recorder.stats() == {"recorded": 5, "queued": 0, "dropped": 0, "segments": 3}
+
+
+def test_worker_callbacks_are_recorded(tmp_path, monkeypatch):
+    monkeypatch.setenv("IWF_RECORD_DIR", str(tmp_path))
+    monkeypatch.setenv("IWF_RECORD_SAMPLE_RATE", "1")
+    app = Flask(__name__)
+
+    @app.route(WorkerService.api_path_workflow_state_execute, methods=["POST"])
+    def handle_execute():
+        return {"stateDecision": {}}
+
+    @app.route("/signup/submit")
+    def submit():
+        return "done"
+
+    recorder = install_callback_recorder(app)
+    client = app.test_client()
+    body = {"context": {"workflowId": "wf-1"}, "workflowType": "BasicWorkflow"}
+    assert client.post(WorkerService.api_path_workflow_state_execute, json=body).status_code == 200
+    # only the worker callbacks are recorded
+    client.get("/signup/submit")
+    wait_for_recorded(recorder, 1)
+
+    [record] = read_all(tmp_path)
+    assert record["path"] == WorkerService.api_path_workflow_state_execute
+    assert (record["status"], record["request"], record["response"]) == (200, body, {"stateDecision": {}})
+    assert record["latency_ms"] >= 0
+
+
+def test_disabled_without_a_directory(monkeypatch):
+    monkeypatch.delenv("IWF_RECORD_DIR", raising=False)
+    assert install_callback_recorder(Flask(__name__)) is None
@@ -0,0 +1,108 @@
+import pytest
+
+from common.circuit_breaker import (
+    STATE_CLOSED,
+    STATE_HALF_OPEN,
+    STATE_OPEN,
+    CircuitBreaker,
+    CircuitOpenError,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr("common.circuit_breaker.time.monotonic", clock)
+    return clock
+
+
+def fail(breaker: CircuitBreaker):
+    with pytest.raises(ConnectionError):
+        with breaker.call():
+            raise ConnectionError("account service is down")
+
+
+def succeed(breaker: CircuitBreaker):
+    with breaker.call():
+        pass
+
+
+def open_breaker() -> CircuitBreaker:
+    breaker = CircuitBreaker("account", failure_threshold=3, open_seconds=30, probe_wait_seconds=5)
+    for _ in range(3):
+        fail(breaker)
+    return breaker
+
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker("account", failure_threshold=3, open_seconds=30, probe_wait_seconds=5)
+    fail(breaker)
+    fail(breaker)
+    # a success resets the count
+    succeed(breaker)
+    fail(breaker)
+    fail(breaker)
+    assert breaker.stats()["state"] == STATE_CLOSED
+    fail(breaker)
+    assert breaker.stats()["state"] == STATE_OPEN
+    assert breaker.stats()["opened"] == 1
+
+
+def test_open_breaker_fails_fast(clock):
+    breaker = open_breaker()
+    calls = []
+    with pytest.raises(CircuitOpenError) as error:
+        with breaker.call():
+            calls.append("called")
+    assert calls == []
+    assert error.value.retry_after_seconds == pytest.approx(30)
+    clock.now += 10
+    assert breaker.retry_after() == pytest.approx(20)
+    assert breaker.stats()["rejected"] == 1
+
+
+def test_half_open_lets_one_probe_through(clock):
+    breaker = open_breaker()
+    clock.now += 30
+    assert breaker.retry_after() == 0
+    breaker.before_call()
+    assert breaker.stats()["state"] == STATE_HALF_OPEN
+    # the other calls wait for the probe
+    assert breaker.retry_after() == 5
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_successful_probe_closes(clock):
+    breaker = open_breaker()
+    clock.now += 30
+    succeed(breaker)
+    assert breaker.stats()["state"] == STATE_CLOSED
+    assert breaker.stats()["consecutive_failures"] == 0
+    succeed(breaker)
+
+
+def test_failed_probe_opens_again(clock):
+    breaker = open_breaker()
+    clock.now += 30
+    fail(breaker)
+    assert breaker.stats()["state"] == STATE_OPEN
+    assert breaker.stats()["opened"] == 2
+    assert breaker.retry_after() == pytest.approx(30)
+
+
+def test_lost_probe_is_replaced(clock):
+    breaker = open_breaker()
+    clock.now += 30
+    # the probe never reports back, e.g. the worker was killed
+    breaker.before_call()
+    clock.now += 30
+    assert breaker.retry_after() == 0
@@ -0,0 +1,86 @@
+from iwf.command_results import CommandResults
+from iwf.communication import Communication
+from iwf.iwf_api.models import Context, WorkflowStateExecuteRequest
+from iwf.object_encoder import ObjectEncoder
+from iwf.persistence import Persistence
+from iwf.registry import Registry
+from iwf.state_decision import StateDecision
+from iwf.state_schema import StateSchema
+from iwf.worker_service import WorkerOptions
+from iwf.workflow import ObjectWorkflow
+from iwf.workflow_context import WorkflowContext
+from iwf.workflow_state import WorkflowState
+
+from common.execute_cache import CachingWorkerService, cache_execute_result, execute_result_cache_from_env
+
+executions = []
+
+
+@cache_execute_result
+class ExpensiveState(WorkflowState[None]):
+    def execute(self, ctx: WorkflowContext, input: None, command_results: CommandResults, persistence: Persistence,
+                communication: Communication) -> StateDecision:
+        executions.append(ctx.state_execution_id)
+        return StateDecision.graceful_complete_workflow(f"execution {len(executions)}")
+
+
+class CheapState(WorkflowState[None]):
+    def execute(self, ctx: WorkflowContext, input: None, command_results: CommandResults, persistence: Persistence,
+                communication: Communication) -> StateDecision:
+        executions.append(ctx.state_execution_id)
+        return StateDecision.graceful_complete_workflow(f"execution {len(executions)}")
+
+
+class CachedWorkflow(ObjectWorkflow):
+    def get_workflow_states(self) -> StateSchema:
+        return StateSchema.with_starting_state(ExpensiveState(), CheapState())
+
+
+encoder = ObjectEncoder()
+registry = Registry()
+registry.add_workflow(CachedWorkflow())
+
+
+def create_worker_service() -> CachingWorkerService:
+    executions.clear()
+    return CachingWorkerService(registry, WorkerOptions(encoder), execute_cache=execute_result_cache_from_env())
+
+
+def execute_request(state_id: str, state_execution_id: str, run_id: str = "run-1") -> WorkflowStateExecuteRequest:
+    return WorkflowStateExecuteRequest(
+        context=Context(workflow_id="wf-1", workflow_run_id=run_id, workflow_started_timestamp=0,
+                        state_execution_id=state_execution_id),
+        workflow_type="CachedWorkflow",
+        workflow_state_id=state_id,
+        state_input=encoder.encode(None),
+    )
+
+
+def completion(response) -> str:
+    return encoder.decode(response.state_decision.next_states[0].state_input, str)
+
+
+def test_retried_execution_returns_the_kept_decision():
+    worker_service = create_worker_service()
+    first = worker_service.handle_workflow_state_execute(execute_request("ExpensiveState", "ExpensiveState-1"))
+    retry = worker_service.handle_workflow_state_execute(execute_request("ExpensiveState", "ExpensiveState-1"))
+    assert executions == ["ExpensiveState-1"]
+    assert completion(first) == completion(retry) == "execution 1"
+    assert retry.to_dict() == first.to_dict()
+    assert worker_service.execute_cache.stats()["reused"] == 1
+
+
+def test_other_executions_are_not_shared():
+    worker_service = create_worker_service()
+    worker_service.handle_workflow_state_execute(execute_request("ExpensiveState", "ExpensiveState-1"))
+    worker_service.handle_workflow_state_execute(execute_request("ExpensiveState", "ExpensiveState-2"))
+    # a workflow id started again counts its state executions from 1 again
+    worker_service.handle_workflow_state_execute(execute_request("ExpensiveState", "ExpensiveState-1", "run-2"))
+    assert executions == ["ExpensiveState-1", "ExpensiveState-2", "ExpensiveState-1"]
+
+
+def test_states_not_decorated_are_executed_again():
+    worker_service = create_worker_service()
+    worker_service.handle_workflow_state_execute(execute_request("CheapState", "CheapState-1"))
+    worker_service.handle_workflow_state_execute(execute_request("CheapState", "CheapState-1"))
+    assert executions == ["CheapState-1", "CheapState-1"]
@@ -0,0 +1,91 @@
+import threading
+import time
+
+from flask import Flask, request
+
+from common.idempotency import idempotency_store_from_env, idempotent
+
+
+def create_app():
+    store = idempotency_store_from_env()
+    app = Flask(__name__)
+    app.calls = []
+    app.release = threading.Event()
+    app.release.set()
+
+    @app.route("/transfer", methods=["GET", "POST"])
+    @idempotent(store)
+    def transfer():
+        app.calls.append(request.args.get("amount"))
+        app.release.wait(5)
+        if request.args.get("fail"):
+            return "account service is down", 503
+        return f"transfer {len(app.calls)}"
+
+    return app
+
+
+def test_retry_replays_the_response():
+    app = create_app()
+    client = app.test_client()
+    first = client.get("/transfer?amount=10", headers={"Idempotency-Key": "k1"})
+    retry = client.get("/transfer?amount=10", headers={"Idempotency-Key": "k1"})
+    assert (first.status_code, first.data) == (200, b"transfer 1")
+    assert (retry.status_code, retry.data) == (200, b"transfer 1")
+    assert retry.content_type == first.content_type
+    assert app.calls == ["10"]
+
+
+def test_key_in_the_query_parameter():
+    app = create_app()
+    client = app.test_client()
+    client.get("/transfer?amount=10&idempotencyKey=k1")
+    # the key isn't one of the parameters compared
+    assert client.get("/transfer?idempotencyKey=k1&amount=10").data == b"transfer 1"
+    assert app.calls == ["10"]
+
+
+def test_requests_without_a_key_or_with_other_keys_are_not_replayed():
+    app = create_app()
+    client = app.test_client()
+    client.get("/transfer?amount=10")
+    client.get("/transfer?amount=10")
+    client.get("/transfer?amount=10", headers={"Idempotency-Key": "k1"})
+    client.get("/transfer?amount=10", headers={"Idempotency-Key": "k2"})
+    assert len(app.calls) == 4
+
+
+def test_failed_response_is_not_kept():
+    app = create_app()
+    client = app.test_client()
+    assert client.get("/transfer?amount=10&fail=1", headers={"Idempotency-Key": "k1"}).status_code == 503
+    assert client.get("/transfer?amount=10&fail=1", headers={"Idempotency-Key": "k1"}).status_code == 503
+    assert len(app.calls) == 2
+
+
+def test_key_reused_with_other_parameters_is_rejected():
+    app = create_app()
+    client = app.test_client()
+    client.get("/transfer?amount=10", headers={"Idempotency-Key": "k1"})
+    assert client.get("/transfer?amount=99", headers={"Idempotency-Key": "k1"}).status_code == 422
+    assert client.post("/transfer?amount=10", data="other body", headers={"Idempotency-Key": "k1"}).status_code == 422
+    assert app.calls == ["10"]
+
+
+def test_retry_while_the_first_request_is_running_gets_a_409(monkeypatch):
+    monkeypatch.setenv("IWF_IDEMPOTENCY_WAIT_SECONDS", "0.1")
+    app = create_app()
+    app.release.clear()
+    first = threading.Thread(
+        target=lambda: app.test_client().get("/transfer?amount=10", headers={"Idempotency-Key": "k1"})
+    )
+    first.start()
+    try:
+        while not app.calls:
+            time.sleep(0.01)
+        retry = app.test_client().get("/transfer?amount=10", headers={"Idempotency-Key": "k1"})
+        assert retry.status_code == 409
+    finally:
+        app.release.set()
+        first.join(5)
+    assert app.test_client().get("/transfer?amount=10", headers={"Idempotency-Key": "k1"}).data == b"transfer 1"
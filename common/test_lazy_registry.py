@@ -0,0 +1,119 @@
+import sys
+import textwrap
+import threading
+
+import pytest
+from iwf.command_results import CommandResults
+from iwf.communication import Communication
+from iwf.errors import InvalidArgumentError
+from iwf.iwf_api.models import RetryPolicy
+from iwf.persistence import Persistence
+from iwf.state_decision import StateDecision
+from iwf.state_schema import StateSchema
+from iwf.workflow import ObjectWorkflow
+from iwf.workflow_context import WorkflowContext
+from iwf.workflow_state import WorkflowState
+from iwf.workflow_state_options import WorkflowStateOptions
+
+from common.lazy_registry import LazyRegistry
+
+LAZY_MODULE = "lazy_registry_sample"
+
+
+@pytest.fixture
+def lazy_module(monkeypatch, tmp_path):
+    """A workflow module that counts how many times it's imported"""
+    (tmp_path / f"{LAZY_MODULE}.py").write_text(textwrap.dedent("""
+        from iwf.state_decision import StateDecision
+        from iwf.state_schema import StateSchema
+        from iwf.workflow import ObjectWorkflow
+        from iwf.workflow_state import WorkflowState
+
+        import lazy_registry_imports
+
+        lazy_registry_imports.count += 1
+
+
+        class LazyState(WorkflowState[None]):
+            def execute(self, ctx, input, command_results, persistence, communication):
+                return StateDecision.graceful_complete_workflow()
+
+
+        class LazyWorkflow(ObjectWorkflow):
+            def get_workflow_states(self) -> StateSchema:
+                return StateSchema.with_starting_state(LazyState())
+    """))
+    (tmp_path / "lazy_registry_imports.py").write_text("count = 0\n")
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.delitem(sys.modules, LAZY_MODULE, raising=False)
+    monkeypatch.delitem(sys.modules, "lazy_registry_imports", raising=False)
+    import lazy_registry_imports
+    yield lazy_registry_imports
+    sys.modules.pop(LAZY_MODULE, None)
+
+
+def test_workflow_is_imported_on_first_use(lazy_module):
+    registry = LazyRegistry()
+    registry.add_lazy_workflow("LazyWorkflow", f"{LAZY_MODULE}:LazyWorkflow")
+    assert lazy_module.count == 0
+    assert LAZY_MODULE not in sys.modules
+
+    state = registry.get_workflow_state_with_check("LazyWorkflow", "LazyState")
+    assert type(state).__name__ == "LazyState"
+    assert registry.get_workflow_starting_state("LazyWorkflow") is state
+    assert lazy_module.count == 1
+
+
+def test_workflow_is_registered_once_by_concurrent_callbacks(lazy_module):
+    registry = LazyRegistry()
+    registry.add_lazy_workflow("LazyWorkflow", f"{LAZY_MODULE}:LazyWorkflow")
+    barrier = threading.Barrier(8)
+    states = []
+
+    def first_callback():
+        barrier.wait()
+        states.append(registry.get_workflow_state_with_check("LazyWorkflow", "LazyState"))
+
+    threads = [threading.Thread(target=first_callback) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert lazy_module.count == 1
+    assert len(states) == 8 and all(state is states[0] for state in states)
+
+
+def test_unknown_workflow_fails_as_in_the_sdk_registry():
+    registry = LazyRegistry()
+    with pytest.raises(InvalidArgumentError):
+        registry.get_workflow_with_check("UnknownWorkflow")
+
+
+class CountingOptionsState(WorkflowState[None]):
+    built = 0
+
+    def execute(self, ctx: WorkflowContext, input: None, command_results: CommandResults, persistence: Persistence,
+                communication: Communication) -> StateDecision:
+        return StateDecision.graceful_complete_workflow()
+
+    def get_state_options(self) -> WorkflowStateOptions:
+        CountingOptionsState.built += 1
+        return WorkflowStateOptions(execute_api_retry_policy=RetryPolicy(maximum_attempts=3))
+
+
+class CountingOptionsWorkflow(ObjectWorkflow):
+    def get_workflow_states(self) -> StateSchema:
+        return StateSchema.with_starting_state(CountingOptionsState())
+
+
+def test_state_options_are_built_once_at_registration():
+    CountingOptionsState.built = 0
+    registry = LazyRegistry()
+    registry.add_workflow(CountingOptionsWorkflow())
+    built = CountingOptionsState.built
+
+    state = registry.get_workflow_state_with_check("CountingOptionsWorkflow", "CountingOptionsState")
+    options = [state.get_state_options() for _ in range(10)]
+    assert CountingOptionsState.built == built
+    assert all(option is options[0] for option in options)
+    assert options[0].execute_api_retry_policy.maximum_attempts == 3
@@ -0,0 +1,57 @@
+import tracemalloc
+
+import pytest
+
+from common import memory_profiler
+from common.memory_profiler import CallbackMemoryProfiler, memory_stats
+
+leaked = []
+
+
+@pytest.fixture
+def profiler_factory():
+    """Creates profilers, and stops the tracing they start after the test"""
+    yield CallbackMemoryProfiler
+    leaked.clear()
+    tracemalloc.stop()
+
+
+def leaking_callback():
+    leaked.append(bytearray(1024 * 1024))
+
+
+def test_leaking_callback_keeps_its_allocation(profiler_factory):
+    profiler = profiler_factory(sample_rate=1)
+    for _ in range(3):
+        with profiler.track("LeakyWorkflow", "LeakyState.execute"):
+            leaking_callback()
+        with profiler.track("LeakyWorkflow", "CleanState.execute"):
+            bytearray(1024 * 1024)
+
+    callbacks = profiler.snapshot()["callbacks"]
+    leaky = callbacks["LeakyWorkflow.LeakyState.execute"]
+    assert leaky["samples"] == 3
+    assert leaky["avg_net_bytes"] >= 1024 * 1024
+    assert any(__file__ in line for line in leaky["top_lines"])
+    assert callbacks["LeakyWorkflow.CleanState.execute"]["avg_net_bytes"] < 64 * 1024
+
+
+def test_unsampled_callbacks_are_not_tracked(profiler_factory):
+    profiler = profiler_factory(sample_rate=0.0)
+    with profiler.track("LeakyWorkflow", "LeakyState.execute"):
+        leaking_callback()
+    assert profiler.snapshot()["callbacks"] == {}
+
+
+def test_memory_stats_without_the_profiler(monkeypatch):
+    monkeypatch.setattr(memory_profiler, "callback_memory_profiler", None)
+    stats = memory_stats()
+    assert list(stats) == ["rss_bytes"]
+    assert stats["rss_bytes"] > 0
+
+
+def test_memory_stats_with_the_profiler(monkeypatch, profiler_factory):
+    monkeypatch.setattr(memory_profiler, "callback_memory_profiler", profiler_factory(sample_rate=1))
+    stats = memory_stats()
+    assert stats["traced_bytes"] > 0
+    assert stats["callbacks"] == {}
@@ -0,0 +1,117 @@
+import base64
+import random
+from dataclasses import dataclass
+from typing import List
+
+import pytest
+from iwf.iwf_api.models import EncodedObject, KeyValue
+from iwf.object_encoder import ObjectEncoder
+
+from common.payload_encoder import (
+    COMPRESSION_NONE,
+    COMPRESSION_ZLIB,
+    COMPRESSION_ZSTD,
+    FORMAT_JSON,
+    FORMAT_MSGPACK,
+    CompressionCodec,
+    create_object_encoder,
+    object_encoder_from_env,
+)
+from common.payload_metrics import PayloadSizeMetrics
+
+
+@dataclass
+class WaitList:
+    child_workflow_ids: List[str]
+
+
+LARGE = WaitList([f"processing-{i}" for i in range(100)])
+SMALL = WaitList(["processing-1"])
+
+
+def round_trip(encoder: ObjectEncoder, value):
+    payload = encoder.encode(value)
+    return payload, encoder.decode(payload, WaitList)
+
+
+@pytest.mark.parametrize("compression", [COMPRESSION_NONE, COMPRESSION_ZLIB])
+def test_json_round_trip(compression):
+    payload, decoded = round_trip(create_object_encoder(FORMAT_JSON, compression), LARGE)
+    assert decoded == LARGE
+    assert payload.encoding == ("json/plain" if compression == COMPRESSION_NONE else "zlib:json/plain")
+
+
+@pytest.mark.parametrize("compression", [COMPRESSION_NONE, COMPRESSION_ZLIB, COMPRESSION_ZSTD])
+def test_msgpack_round_trip(compression):
+    pytest.importorskip("msgpack")
+    if compression == COMPRESSION_ZSTD:
+        pytest.importorskip("zstandard")
+    payload, decoded = round_trip(create_object_encoder(FORMAT_MSGPACK, compression), LARGE)
+    assert decoded == LARGE
+    expected = "msgpack/plain" if compression == COMPRESSION_NONE else f"{compression}:msgpack/plain"
+    assert payload.encoding == expected
+
+
+def test_payloads_below_the_threshold_are_not_compressed():
+    encoder = create_object_encoder(FORMAT_JSON, COMPRESSION_ZLIB, compression_threshold_bytes=1024)
+    assert encoder.encode(SMALL).encoding == "json/plain"
+    assert encoder.encode(LARGE).encoding == "zlib:json/plain"
+    assert len(encoder.encode(LARGE).data) < len(ObjectEncoder.default.encode(LARGE).data)
+
+
+def test_compression_is_skipped_when_it_does_not_shrink():
+    # random bytes don't compress, and base64 makes them larger
+    data = base64.b64encode(random.Random(0).randbytes(600)).decode()
+    payload = EncodedObject(encoding="json/plain", data=f'"{data}"')
+    codec = CompressionCodec(COMPRESSION_ZLIB, threshold_bytes=10)
+    assert codec.encode(payload) is payload
+
+
+def test_payloads_of_the_sdk_encoder_are_decoded():
+    # written before the encoder was configured
+    payload = ObjectEncoder.default.encode(LARGE)
+    for encoder in (create_object_encoder(FORMAT_JSON), create_object_encoder(FORMAT_JSON, COMPRESSION_ZLIB)):
+        assert encoder.decode(payload, WaitList) == LARGE
+
+
+def test_msgpack_payloads_are_decoded_after_switching_back_to_json():
+    pytest.importorskip("msgpack")
+    payload = create_object_encoder(FORMAT_MSGPACK, COMPRESSION_NONE).encode(LARGE)
+    assert create_object_encoder(FORMAT_JSON).decode(payload, WaitList) == LARGE
+
+
+def test_compressed_payloads_are_decoded_after_turning_compression_off():
+    payload = create_object_encoder(FORMAT_JSON, COMPRESSION_ZLIB).encode(LARGE)
+    assert payload.encoding == "zlib:json/plain"
+    assert create_object_encoder(FORMAT_JSON, COMPRESSION_NONE).decode(payload, WaitList) == LARGE
+
+
+def test_msgpack_is_compressed_by_default(monkeypatch):
+    pytest.importorskip("msgpack")
+    monkeypatch.setenv("IWF_PAYLOAD_FORMAT", FORMAT_MSGPACK)
+    monkeypatch.delenv("IWF_PAYLOAD_COMPRESSION", raising=False)
+    assert object_encoder_from_env().encode(LARGE).encoding == "zlib:msgpack/plain"
+
+
+def test_unsupported_configuration():
+    with pytest.raises(ValueError):
+        create_object_encoder("xml")
+    with pytest.raises(ValueError):
+        CompressionCodec("lz4")
+
+
+def test_payload_size_metrics():
+    metrics = PayloadSizeMetrics()
+    encoder = create_object_encoder(FORMAT_JSON)
+    large = encoder.encode(LARGE)
+    small = encoder.encode(SMALL)
+    metrics.record("ControllerWorkflow", "load", [KeyValue("WaitList", large), KeyValue("WaitList", small)])
+    metrics.record("ControllerWorkflow", "upsert", [KeyValue("WaitList", small), KeyValue("Empty", None)])
+    # nothing loaded(e.g. LOAD_NONE)
+    metrics.record("ControllerWorkflow", "load", None)
+    assert metrics.snapshot() == {"ControllerWorkflow": {"WaitList": {
+        "load": {"count": 2, "total_bytes": len(large.data) + len(small.data),
+                 "avg_bytes": (len(large.data) + len(small.data)) // 2, "max_bytes": len(large.data)},
+        "upsert": {"count": 1, "total_bytes": len(small.data), "avg_bytes": len(small.data),
+                   "max_bytes": len(small.data)},
+    }}}
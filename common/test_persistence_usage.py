@@ -0,0 +1,141 @@
+from typing import List
+
+from iwf.command_request import CommandRequest
+from iwf.command_results import CommandResults
+from iwf.communication import Communication
+from iwf.iwf_api.models import CommandResults as IdlCommandResults
+from iwf.iwf_api.models import (
+    Context,
+    KeyValue,
+    WorkflowStateExecuteRequest,
+    WorkflowStateWaitUntilRequest,
+    WorkflowWorkerRpcRequest,
+)
+from iwf.object_encoder import ObjectEncoder
+from iwf.persistence import Persistence
+from iwf.persistence_schema import PersistenceField, PersistenceSchema
+from iwf.registry import Registry
+from iwf.rpc import rpc
+from iwf.state_decision import StateDecision
+from iwf.state_schema import StateSchema
+from iwf.worker_service import WorkerOptions, WorkerService
+from iwf.workflow import ObjectWorkflow
+from iwf.workflow_context import WorkflowContext
+from iwf.workflow_state import WorkflowState, should_skip_wait_until
+
+from common.persistence_usage import PersistenceUsageTracker
+
+
+class ReadingState(WorkflowState[None]):
+    def execute(self, ctx: WorkflowContext, input: None, command_results: CommandResults, persistence: Persistence,
+                communication: Communication) -> StateDecision:
+        persistence.get_data_attribute("Loaded")
+        persistence.get_data_attribute("NotLoaded")
+        # read after its own write, the loaded value isn't needed
+        persistence.set_data_attribute("Counter", 1)
+        persistence.get_data_attribute("Counter")
+        return StateDecision.dead_end
+
+
+class WaitingState(WorkflowState[None]):
+    def wait_until(self, ctx: WorkflowContext, input: None, persistence: Persistence,
+                   communication: Communication) -> CommandRequest:
+        persistence.get_data_attribute("Loaded")
+        return CommandRequest.empty()
+
+    def execute(self, ctx: WorkflowContext, input: None, command_results: CommandResults, persistence: Persistence,
+                communication: Communication) -> StateDecision:
+        return StateDecision.dead_end
+
+
+class UsageWorkflow(ObjectWorkflow):
+    def get_workflow_states(self) -> StateSchema:
+        return StateSchema.with_starting_state(ReadingState(), WaitingState())
+
+    def get_persistence_schema(self) -> PersistenceSchema:
+        return PersistenceSchema.create(
+            PersistenceField.data_attribute_def("Loaded", str),
+            PersistenceField.data_attribute_def("NotLoaded", str),
+            PersistenceField.data_attribute_def("Counter", int),
+            PersistenceField.data_attribute_def("Unused", str),
+        )
+
+    @rpc()
+    def describe(self, persistence: Persistence) -> str:
+        return persistence.get_data_attribute("Loaded")
+
+
+encoder = ObjectEncoder()
+context = Context(workflow_id="wf-1", workflow_run_id="run-1", workflow_started_timestamp=0, state_execution_id="s-1")
+
+
+def data_attributes(*keys: str) -> List[KeyValue]:
+    return [KeyValue(key=key, value=encoder.encode(1 if key == "Counter" else "value")) for key in keys]
+
+
+def create_registry() -> Registry:
+    registry = Registry()
+    registry.add_workflow(UsageWorkflow())
+    return registry
+
+
+def create_worker_service(tracker: PersistenceUsageTracker) -> WorkerService:
+    return WorkerService(tracker.wrap_registry(create_registry()), WorkerOptions(encoder))
+
+
+def execute_request(state_id: str, *loaded: str) -> WorkflowStateExecuteRequest:
+    return WorkflowStateExecuteRequest(context=context, workflow_type="UsageWorkflow", workflow_state_id=state_id,
+                                       state_input=encoder.encode(None), data_objects=data_attributes(*loaded),
+                                       command_results=IdlCommandResults())
+
+
+def execute(worker_service: WorkerService, tracker: PersistenceUsageTracker, state_id: str, *loaded: str):
+    with tracker.track("UsageWorkflow", f"{state_id}.execute", list(loaded)):
+        worker_service.handle_workflow_state_execute(execute_request(state_id, *loaded))
+
+
+def test_unused_and_missing_keys_of_a_state():
+    tracker = PersistenceUsageTracker()
+    worker_service = create_worker_service(tracker)
+    for _ in range(2):
+        execute(worker_service, tracker, "ReadingState", "Loaded", "Counter", "Unused")
+
+    usage = tracker.report()["UsageWorkflow.ReadingState.execute"]
+    assert usage["calls"] == 2
+    assert usage["read"] == {"Loaded": 2, "NotLoaded": 2}
+    assert usage["unused"] == ["Counter", "Unused"]
+    assert usage["missing"] == ["NotLoaded"]
+
+
+def test_wait_until_and_rpc_reads_are_tracked():
+    tracker = PersistenceUsageTracker()
+    worker_service = create_worker_service(tracker)
+    wait_until = WorkflowStateWaitUntilRequest(context=context, workflow_type="UsageWorkflow",
+                                               workflow_state_id="WaitingState", state_input=encoder.encode(None),
+                                               data_objects=data_attributes("Loaded", "Unused"))
+    with tracker.track("UsageWorkflow", "WaitingState.waitUntil", ["Loaded", "Unused"]):
+        worker_service.handle_workflow_state_wait_until(wait_until)
+    describe = WorkflowWorkerRpcRequest(context=context, workflow_type="UsageWorkflow", rpc_name="describe",
+                                        data_attributes=data_attributes("Loaded"))
+    with tracker.track("UsageWorkflow", "describe", ["Loaded"]):
+        response = worker_service.handle_workflow_worker_rpc(describe)
+
+    assert encoder.decode(response.output, str) == "value"
+    report = tracker.report()
+    assert report["UsageWorkflow.WaitingState.waitUntil"]["unused"] == ["Unused"]
+    assert report["UsageWorkflow.describe"] == {
+        "calls": 1, "loaded": {"Loaded": 1}, "read": {"Loaded": 1}, "unused": [], "missing": [],
+    }
+
+
+def test_callbacks_outside_of_track_are_not_recorded():
+    tracker = PersistenceUsageTracker()
+    worker_service = create_worker_service(tracker)
+    worker_service.handle_workflow_state_execute(execute_request("ReadingState", "Loaded"))
+    assert tracker.report() == {}
+
+
+def test_state_without_wait_until_still_skips_it():
+    registry = PersistenceUsageTracker().wrap_registry(create_registry())
+    assert should_skip_wait_until(registry.get_workflow_state_with_check("UsageWorkflow", "ReadingState"))
+    assert not should_skip_wait_until(registry.get_workflow_state_with_check("UsageWorkflow", "WaitingState"))
@@ -0,0 +1,70 @@
+import contextvars
+import threading
+import time
+
+import pytest
+
+from common.priority_lanes import LANE_RPC, LANE_STATE, Lane, PriorityLanes, priority_lanes_from_env
+
+request_id = contextvars.ContextVar("request_id", default=None)
+
+
+def test_lane_returns_the_result_with_the_callers_context():
+    lane = Lane("test", max_workers=1)
+    token = request_id.set("req-1")
+    try:
+        assert lane.run(lambda suffix: f"{request_id.get()}{suffix}", "!") == "req-1!"
+    finally:
+        request_id.reset(token)
+    assert lane.stats()["completed"] == 1
+
+
+def test_lane_raises_the_error_of_the_callback():
+    lane = Lane("test", max_workers=1)
+
+    def failing():
+        raise ValueError("bad input")
+
+    with pytest.raises(ValueError):
+        lane.run(failing)
+    assert lane.stats()["running"] == 0
+
+
+def test_rpc_lane_runs_while_the_state_lane_is_full():
+    lanes = PriorityLanes(rpc_threads=1, state_threads=1)
+    release = threading.Event()
+    started = threading.Event()
+
+    def slow_state_callback():
+        started.set()
+        release.wait(5)
+
+    state_callbacks = [threading.Thread(target=lanes.run, args=(LANE_STATE, slow_state_callback)) for _ in range(2)]
+    for thread in state_callbacks:
+        thread.start()
+    try:
+        assert started.wait(5)
+        deadline = time.monotonic() + 5
+        while lanes.stats()[LANE_STATE]["queued"] < 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert lanes.run(LANE_RPC, lambda: "rpc") == "rpc"
+        stats = lanes.stats()
+        assert stats[LANE_STATE]["running"] == 1
+        assert stats[LANE_STATE]["queued"] == 1
+        assert stats[LANE_RPC]["completed"] == 1
+    finally:
+        release.set()
+        for thread in state_callbacks:
+            thread.join()
+    assert lanes.stats()[LANE_STATE]["completed"] == 2
+
+
+def test_priority_lanes_from_env(monkeypatch):
+    monkeypatch.delenv("IWF_PRIORITY_LANES", raising=False)
+    assert priority_lanes_from_env() is None
+
+    monkeypatch.setenv("IWF_PRIORITY_LANES", "true")
+    monkeypatch.setenv("IWF_STATE_LANE_THREADS", "4")
+    stats = priority_lanes_from_env().stats()
+    assert stats[LANE_RPC]["threads"] == 8
+    assert stats[LANE_STATE]["threads"] == 4
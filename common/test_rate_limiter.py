@@ -0,0 +1,65 @@
+import pytest
+
+from common.rate_limiter import RateLimit, RateLimiter, parse_rate_limits
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr("common.rate_limiter.time.time", clock)
+    return clock
+
+
+def test_burst_then_throttled(tmp_path, clock):
+    limiter = RateLimiter({"account": RateLimit(rate_per_second=2, burst=3)}, str(tmp_path / "limits.db"))
+    assert [limiter.try_acquire("account") for _ in range(3)] == [0, 0, 0]
+    # the next token is half a second away at 2 tokens/s
+    assert limiter.try_acquire("account") == pytest.approx(0.5)
+    assert limiter.stats()["acquired"] == {"account": 3}
+    assert limiter.stats()["throttled"] == {"account": 1}
+
+
+def test_tokens_refill_up_to_the_burst(tmp_path, clock):
+    limiter = RateLimiter({"account": RateLimit(rate_per_second=2, burst=3)}, str(tmp_path / "limits.db"))
+    for _ in range(3):
+        limiter.try_acquire("account")
+    clock.now += 1
+    assert [limiter.try_acquire("account") for _ in range(2)] == [0, 0]
+    assert limiter.try_acquire("account") > 0
+
+    # an idle bucket doesn't keep more than the burst
+    clock.now += 60
+    assert [limiter.try_acquire("account") for _ in range(3)] == [0, 0, 0]
+    assert limiter.try_acquire("account") > 0
+
+
+def test_bucket_is_shared_through_the_database(tmp_path, clock):
+    limits = {"smtp": RateLimit(rate_per_second=1, burst=2)}
+    db_path = str(tmp_path / "limits.db")
+    first, second = RateLimiter(limits, db_path), RateLimiter(limits, db_path)
+    assert first.try_acquire("smtp") == 0
+    assert second.try_acquire("smtp") == 0
+    assert first.try_acquire("smtp") == pytest.approx(1)
+
+
+def test_downstream_without_a_limit_is_not_throttled(tmp_path, clock):
+    limiter = RateLimiter({"account": RateLimit(rate_per_second=1, burst=1)}, str(tmp_path / "limits.db"))
+    assert all(limiter.try_acquire("smtp") == 0 for _ in range(10))
+
+
+def test_parse_rate_limits():
+    assert parse_rate_limits("account=50, smtp=2:10,,openai=0.5") == {
+        "account": RateLimit(rate_per_second=50, burst=50),
+        "smtp": RateLimit(rate_per_second=2, burst=10),
+        "openai": RateLimit(rate_per_second=0.5, burst=1),
+    }
+    with pytest.raises(ValueError):
+        parse_rate_limits("account=0")
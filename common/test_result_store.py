@@ -0,0 +1,101 @@
+import threading
+import time
+
+import pytest
+
+from common.result_store import InFlightTimeoutError, ResultStore
+
+
+def store(**kwargs) -> ResultStore[str]:
+    return ResultStore("results", str.encode, bytes.decode, max_size=100, ttl_seconds=60, **kwargs)
+
+
+def test_result_is_computed_once():
+    results = store()
+    calls = []
+    assert results.run("k", lambda: calls.append(1) or "a") == "a"
+    assert results.run("k", lambda: calls.append(1) or "b") == "a"
+    assert results.run("other", lambda: calls.append(1) or "c") == "c"
+    assert len(calls) == 2
+    assert results.stats()["computed"] == 2
+    assert results.stats()["reused"] == 1
+
+
+def test_result_not_kept_is_computed_again():
+    results = store()
+    assert results.run("k", lambda: "failed", keep=lambda value: value != "failed") == "failed"
+    assert results.run("k", lambda: "ok", keep=lambda value: value != "failed") == "ok"
+    assert results.get("k") == "ok"
+
+
+def test_failed_computation_is_not_kept():
+    def fail() -> str:
+        raise RuntimeError("boom")
+
+    results = store()
+    with pytest.raises(RuntimeError):
+        results.run("k", fail)
+    assert results.run("k", lambda: "ok") == "ok"
+    assert results.stats()["in_flight"] == 0
+
+
+def test_concurrent_callers_wait_for_the_one_in_flight():
+    results = store()
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "a"
+
+    first = threading.Thread(target=results.run, args=("k", compute))
+    first.start()
+    started.wait(5)
+    waiter_results = []
+    waiter = threading.Thread(target=lambda: waiter_results.append(results.run("k", compute)))
+    waiter.start()
+    release.set()
+    first.join(5)
+    waiter.join(5)
+    assert waiter_results == ["a"]
+    assert len(calls) == 1
+
+
+def test_wait_for_the_one_in_flight_is_bounded():
+    results = store(wait_timeout_seconds=0.1)
+    started, release = threading.Event(), threading.Event()
+
+    def compute():
+        started.set()
+        release.wait(5)
+        return "a"
+
+    first = threading.Thread(target=results.run, args=("k", compute))
+    first.start()
+    started.wait(5)
+    try:
+        with pytest.raises(InFlightTimeoutError):
+            results.run("k", lambda: "b")
+        assert results.stats()["wait_timeouts"] == 1
+    finally:
+        release.set()
+        first.join(5)
+    assert results.run("k", lambda: "b") == "a"
+
+
+def test_results_survive_a_restart_in_sqlite(tmp_path):
+    db_path = str(tmp_path / "results.db")
+    store(db_path=db_path).run("k", lambda: "a")
+    restarted = store(db_path=db_path)
+    assert restarted.get("k") == "a"
+    assert restarted.run("k", lambda: "b") == "a"
+
+
+def test_expired_results_are_not_loaded_from_sqlite(tmp_path, monkeypatch):
+    db_path = str(tmp_path / "results.db")
+    store(db_path=db_path).run("k", lambda: "a")
+    now = time.time()
+    monkeypatch.setattr("common.result_store.time.time", lambda: now + 61)
+    assert store(db_path=db_path).get("k") is None
@@ -0,0 +1,77 @@
+import json
+import logging
+import queue
+
+from common.structured_logging import (
+    DebugSamplingFilter,
+    JSONFormatter,
+    NonBlockingQueueHandler,
+    log_context,
+)
+
+
+def make_record(level: int, msg: str, *args, exc_info=None) -> logging.LogRecord:
+    return logging.LogRecord("test", level, __file__, 1, msg, args, exc_info)
+
+
+def test_message_is_formatted_when_logged():
+    handler = NonBlockingQueueHandler(queue.Queue())
+    transfer = {"amount": 10}
+    handler.handle(make_record(logging.INFO, "transfer %s", transfer))
+    # changed by the caller before the listener thread writes the record
+    transfer["amount"] = 99
+    record = handler.queue.get_nowait()
+    assert (record.msg, record.args) == ("transfer {'amount': 10}", None)
+
+
+def test_traceback_is_formatted_when_logged():
+    handler = NonBlockingQueueHandler(queue.Queue())
+    try:
+        raise ValueError("account service is down")
+    except ValueError as e:
+        handler.handle(make_record(logging.ERROR, "transfer failed", exc_info=(type(e), e, e.__traceback__)))
+    record = handler.queue.get_nowait()
+    assert record.exc_info is None
+    assert json.loads(JSONFormatter().format(record))["exc"].endswith("ValueError: account service is down")
+
+
+def test_records_are_dropped_when_the_queue_is_full():
+    handler = NonBlockingQueueHandler(queue.Queue(1))
+    for i in range(3):
+        handler.handle(make_record(logging.INFO, "log %s", i))
+    assert handler.queue.qsize() == 1
+    assert handler.dropped == 2
+
+
+def test_json_line_has_the_log_context_and_extra_fields():
+    sampling = DebugSamplingFilter(logging.INFO, 0)
+    record = make_record(logging.INFO, "transfer %s", 10)
+    record.amount = 10
+    with log_context(workflow_id="wf-1", state_execution_id=""):
+        assert sampling.filter(record)
+    entry = json.loads(JSONFormatter().format(record))
+    assert entry["msg"] == "transfer 10"
+    assert entry["workflow_id"] == "wf-1"
+    assert entry["amount"] == 10
+    # empty ids aren't added
+    assert "state_execution_id" not in entry
+
+
+def test_debug_is_sampled_by_workflow():
+    keep_all = DebugSamplingFilter(logging.INFO, 1)
+    keep_none = DebugSamplingFilter(logging.INFO, 0)
+    assert keep_none.filter(make_record(logging.INFO, "info"))
+    # without a workflow or request id, there is nothing to sample by
+    assert not keep_all.filter(make_record(logging.DEBUG, "debug"))
+    with log_context(workflow_id="wf-1"):
+        assert keep_all.filter(make_record(logging.DEBUG, "debug"))
+        assert not keep_none.filter(make_record(logging.DEBUG, "debug"))
+
+    half = DebugSamplingFilter(logging.INFO, 0.5)
+    kept = []
+    for i in range(1000):
+        with log_context(workflow_id=f"wf-{i}"):
+            kept.append(half.filter(make_record(logging.DEBUG, "debug")))
+            # the same workflow is always kept or always dropped
+            assert half.filter(make_record(logging.DEBUG, "debug")) == kept[-1]
+    assert 400 < sum(kept) < 600
@@ -1,13 +1,18 @@
 from iwf.client import Client
-from iwf.registry import Registry
-from iwf.worker_service import (
-    WorkerService,
-)
+from iwf.client_options import ClientOptions
+from iwf.worker_service import WorkerOptions
 
-from moneytransfer.money_transfer_workflow import MoneyTransferWorkflow
+from common.lazy_registry import LazyRegistry
+from common.payload_encoder import object_encoder_from_env
+from common.priority_lanes import LanedWorkerService, priority_lanes_from_env
 
-registry = Registry()
-worker_service = WorkerService(registry)
-client = Client(registry, )
+object_encoder = object_encoder_from_env()
+client_options = ClientOptions.local_default()
+client_options.object_encoder = object_encoder
 
-registry.add_workflow(MoneyTransferWorkflow())
+registry = LazyRegistry()
+worker_service = LanedWorkerService(registry, WorkerOptions(object_encoder), priority_lanes_from_env())
+client = Client(registry, client_options)
+
+# the workflows are imported and registered on first use
+registry.add_lazy_workflow("MoneyTransferWorkflow", "moneytransfer.money_transfer_workflow:MoneyTransferWorkflow")
@@ -2,6 +2,7 @@ import time
 import traceback
 
 from flask import Flask, request
+from iwf.errors import WorkflowAlreadyStartedError
 from iwf.iwf_api.models import (
     WorkflowStateExecuteRequest,
     WorkflowStateWaitUntilRequest,
@@ -11,14 +12,31 @@ from iwf.worker_service import (
     WorkerService,
 )
 
-from moneytransfer.iwf_config import client, worker_service
+from common.admission_control import install_admission_control
+from common.callback_recorder import install_callback_recorder
+from common.circuit_breaker import circuit_breakers
+from common.idempotency import get_idempotency_key, idempotency_store_from_env, idempotent
+from common.metrics_routes import install_metrics_routes
+from common.structured_logging import configure_logging
+
+from moneytransfer.iwf_config import client, registry, worker_service
 from moneytransfer.money_transfer_workflow import TransferRequest, MoneyTransferWorkflow
 
 flask_app = Flask(__name__)
+configure_logging(flask_app)
+admission_controller = install_admission_control(flask_app, registry)
+callback_recorder = install_callback_recorder(flask_app)
+idempotency_store = idempotency_store_from_env()
+# http://localhost:8802/metrics/<name>, see common/metrics_routes.py
+install_metrics_routes(flask_app, worker_service, admission_controller, callback_recorder, {
+    "idempotency": idempotency_store.stats,
+    "circuit_breakers": circuit_breakers.stats,
+})
 
 
 # http://localhost:8802/moneytransfer/start?fromAccount=long&toAccount=github&amount=10&notes=testnotest
 @flask_app.route("/moneytransfer/start")
+@idempotent(idempotency_store)
 def money_transfer_start():
     from_account = request.args["fromAccount"]
     to_account = request.args["toAccount"]
@@ -26,7 +44,17 @@ def money_transfer_start():
     notes = request.args["notes"]
     transfer_request = TransferRequest(from_account, to_account, int(amount), notes)
 
-    client.start_workflow(MoneyTransferWorkflow, "money_transfer" + str(time.time()), 3600, transfer_request)
+    # with an idempotency key, a retry that isn't replayed(e.g. by another instance) still starts only one workflow
+    idempotency_key = get_idempotency_key()
+    if idempotency_key is None:
+        workflow_id = "money_transfer" + str(time.time())
+    else:
+        workflow_id = "money_transfer_" + idempotency_key
+    try:
+        client.start_workflow(MoneyTransferWorkflow, workflow_id, 3600, transfer_request)
+    except WorkflowAlreadyStartedError:
+        if idempotency_key is None:
+            raise
     return "workflow started"
 
 
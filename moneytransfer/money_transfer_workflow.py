@@ -1,5 +1,12 @@
+import logging
+import math
+import os
+import random
+from contextlib import contextmanager
 from dataclasses import dataclass
+from typing import Iterator, Optional
 
+from iwf.command_request import CommandRequest, TimerCommand
 from iwf.command_results import CommandResults
 from iwf.communication import Communication
 from iwf.iwf_api.models import RetryPolicy
@@ -8,9 +15,24 @@ from iwf.state_decision import StateDecision
 from iwf.state_schema import StateSchema
 from iwf.workflow import ObjectWorkflow
 from iwf.workflow_context import WorkflowContext
-from iwf.workflow_state import WorkflowState
+from iwf.workflow_state import WorkflowState, get_state_id_by_class
 from iwf.workflow_state_options import WorkflowStateOptions
 
+from common.circuit_breaker import CircuitOpenError, circuit_breakers
+from common.rate_limiter import DOWNSTREAM_ACCOUNT, acquire_or_wait
+
+logger = logging.getLogger(__name__)
+
+# what a transfer does when the circuit breaker of the account service is open, see common/circuit_breaker.py:
+# park(default): waits for a durable timer in AccountServiceWaitState until the breaker lets a call through, then
+# continues the transfer
+# compensate: fails fast into CompensateState
+CIRCUIT_OPEN_PARK = "park"
+CIRCUIT_OPEN_COMPENSATE = "compensate"
+CIRCUIT_OPEN_ACTION = os.environ.get("MONEYTRANSFER_CIRCUIT_OPEN_ACTION", CIRCUIT_OPEN_PARK)
+# the fraction of the calls to the account service that fail, to try the circuit breaker and the retries, default 0
+ACCOUNT_FAILURE_RATE = float(os.environ.get("MONEYTRANSFER_ACCOUNT_FAILURE_RATE", 0))
+
 
 @dataclass
 class TransferRequest:
@@ -20,6 +42,76 @@ class TransferRequest:
     notes: str
 
 
+@dataclass
+class AccountServiceWait:
+    # the state to go back to after the timer
+    state_id: str
+    wait_seconds: int
+    request: TransferRequest
+
+
+def wait_for(state: type, request: TransferRequest, wait_seconds: float) -> StateDecision:
+    return StateDecision.single_next_state(
+        AccountServiceWaitState,
+        AccountServiceWait(get_state_id_by_class(state), max(1, math.ceil(wait_seconds)), request),
+    )
+
+
+def wait_for_account_service(state: type, request: TransferRequest,
+                             circuit_open_action: Optional[str] = None) -> Optional[StateDecision]:
+    """
+    None when the state can call the account service now, otherwise the decision to wait for a durable timer:
+    while the circuit breaker is open(to park) or until a token of the rate limiter.
+    Only the waiting transfers pay for the extra state, the others call the account service in the same execute.
+    """
+    if (circuit_open_action or CIRCUIT_OPEN_ACTION) == CIRCUIT_OPEN_PARK:
+        retry_after = circuit_breakers.get(DOWNSTREAM_ACCOUNT).retry_after()
+        if retry_after > 0:
+            return wait_for(state, request, retry_after)
+    # to compensate, execute fails fast, but still with a token: a burst of transfers failing into compensation
+    # must not go past the rate limit of the account service either
+    wait_seconds = acquire_or_wait(DOWNSTREAM_ACCOUNT)
+    if wait_seconds:
+        return wait_for(state, request, wait_seconds)
+    return None
+
+
+@contextmanager
+def account_service_call() -> Iterator[None]:
+    """Wraps a call to the account service, recording its failures in the circuit breaker"""
+    with circuit_breakers.call(DOWNSTREAM_ACCOUNT):
+        yield
+        if random.random() < ACCOUNT_FAILURE_RATE:
+            raise RuntimeError("the account service failed(MONEYTRANSFER_ACCOUNT_FAILURE_RATE)")
+
+
+def on_circuit_open(state: type, request: TransferRequest, error: CircuitOpenError) -> StateDecision:
+    if CIRCUIT_OPEN_ACTION == CIRCUIT_OPEN_COMPENSATE:
+        return StateDecision.single_next_state(CompensateState, request)
+    return wait_for(state, request, error.retry_after_seconds)
+
+
+class AccountServiceWaitState(WorkflowState[AccountServiceWait]):
+    def wait_until(
+            self,
+            ctx: WorkflowContext,
+            wait: AccountServiceWait,
+            persistence: Persistence,
+            communication: Communication,
+    ) -> CommandRequest:
+        return CommandRequest.for_all_command_completed(TimerCommand.by_seconds(wait.wait_seconds))
+
+    def execute(
+            self,
+            ctx: WorkflowContext,
+            wait: AccountServiceWait,
+            command_results: CommandResults,
+            persistence: Persistence,
+            communication: Communication,
+    ) -> StateDecision:
+        return StateDecision.single_next_state(wait.state_id, wait.request)
+
+
 class VerifyState(WorkflowState[TransferRequest]):
     def execute(
             self,
@@ -29,7 +121,11 @@ class VerifyState(WorkflowState[TransferRequest]):
             persistence: Persistence,
             communication: Communication,
     ) -> StateDecision:
-        print(f"API to check balance for account {request.from_account} for amount{request.amount}")
+        # calls the account service only with a token and a closed breaker, otherwise waits for a durable timer
+        wait = wait_for_account_service(VerifyState, request)
+        if wait is not None:
+            return wait
+        logger.info("API to check balance for account %s for amount %s", request.from_account, request.amount)
 
         has_sufficient_funds = True
         if not has_sufficient_funds:
@@ -47,9 +143,15 @@ class CreateDebitMemoState(WorkflowState[TransferRequest]):
             persistence: Persistence,
             communication: Communication,
     ) -> StateDecision:
-        print(f"API to create debit memo for account {request.from_account} for amount{request.amount} with notes{request.notes}")
-        # uncomment this to test error
-        # raise Exception("test error")
+        wait = wait_for_account_service(CreateDebitMemoState, request)
+        if wait is not None:
+            return wait
+        try:
+            with account_service_call():
+                logger.info("API to create debit memo for account %s for amount %s with notes %s",
+                            request.from_account, request.amount, request.notes)
+        except CircuitOpenError as e:
+            return on_circuit_open(CreateDebitMemoState, request, e)
         return StateDecision.single_next_state(DebitState, request)
 
     def get_state_options(self) -> WorkflowStateOptions:
@@ -72,7 +174,14 @@ class DebitState(WorkflowState[TransferRequest]):
             persistence: Persistence,
             communication: Communication,
     ) -> StateDecision:
-        print(f"API to debit account {request.from_account} for amount{request.amount}")
+        wait = wait_for_account_service(DebitState, request)
+        if wait is not None:
+            return wait
+        try:
+            with account_service_call():
+                logger.info("API to debit account %s for amount %s", request.from_account, request.amount)
+        except CircuitOpenError as e:
+            return on_circuit_open(DebitState, request, e)
 
         return StateDecision.single_next_state(CreateCreditMemoState, request)
 
@@ -94,7 +203,15 @@ class CreateCreditMemoState(WorkflowState[TransferRequest]):
             persistence: Persistence,
             communication: Communication,
     ) -> StateDecision:
-        print(f"API to create credit memo for account {request.to_account} for amount{request.amount} with notes{request.notes}")
+        wait = wait_for_account_service(CreateCreditMemoState, request)
+        if wait is not None:
+            return wait
+        try:
+            with account_service_call():
+                logger.info("API to create credit memo for account %s for amount %s with notes %s",
+                            request.to_account, request.amount, request.notes)
+        except CircuitOpenError as e:
+            return on_circuit_open(CreateCreditMemoState, request, e)
 
         return StateDecision.single_next_state(CreditState, request)
 
@@ -116,7 +233,14 @@ class CreditState(WorkflowState[TransferRequest]):
             persistence: Persistence,
             communication: Communication,
     ) -> StateDecision:
-        print(f"API to credit account {request.to_account} for amount{request.amount}")
+        wait = wait_for_account_service(CreditState, request)
+        if wait is not None:
+            return wait
+        try:
+            with account_service_call():
+                logger.info("API to credit account %s for amount %s", request.to_account, request.amount)
+        except CircuitOpenError as e:
+            return on_circuit_open(CreditState, request, e)
 
         return StateDecision.graceful_complete_workflow(f"transfer is done from account{request.from_account} "
                                                         f"to account{request.to_account} for amount{request.amount}")
@@ -139,13 +263,21 @@ class CompensateState(WorkflowState[TransferRequest]):
             persistence: Persistence,
             communication: Communication,
     ) -> StateDecision:
+        # the compensation can't fail fast, it always waits for the account service
+        wait = wait_for_account_service(CompensateState, request, CIRCUIT_OPEN_PARK)
+        if wait is not None:
+            return wait
         # NOTE: to improve, we can use iWF data attributes to track whether each step has been attempted to execute
         # and check a flag to see if we should undo it or not
 
-        print(f"API to undo credit account {request.to_account} for amount{request.amount}")
-        print(f"API to undo create credit memo account {request.to_account} for amount{request.amount}")
-        print(f"API to undo debit account {request.from_account} for amount{request.amount}")
-        print(f"API to undo create debit memo {request.from_account} for amount{request.amount}")
+        try:
+            with account_service_call():
+                logger.info("API to undo credit account %s for amount %s", request.to_account, request.amount)
+                logger.info("API to undo create credit memo account %s for amount %s", request.to_account, request.amount)
+                logger.info("API to undo debit account %s for amount %s", request.from_account, request.amount)
+                logger.info("API to undo create debit memo %s for amount %s", request.from_account, request.amount)
+        except CircuitOpenError as e:
+            return wait_for(CompensateState, request, e.retry_after_seconds)
 
         return StateDecision.force_fail_workflow("fail to transfer")
 
@@ -158,4 +290,5 @@ class MoneyTransferWorkflow(ObjectWorkflow):
             DebitState(),
             CreateCreditMemoState(),
             CreditState(),
-            CompensateState())
+            CompensateState(),
+            AccountServiceWaitState())
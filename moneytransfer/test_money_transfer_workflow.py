@@ -0,0 +1,69 @@
+import pytest
+
+from common.circuit_breaker import CircuitBreakers
+from moneytransfer import money_transfer_workflow
+from moneytransfer.money_transfer_workflow import (
+    AccountServiceWait,
+    AccountServiceWaitState,
+    CompensateState,
+    CreditState,
+    DebitState,
+    TransferRequest,
+)
+
+REQUEST = TransferRequest("a1", "a2", 100, "rent")
+
+
+@pytest.fixture
+def breakers(monkeypatch):
+    breakers = CircuitBreakers(failure_threshold=2, open_seconds=30, probe_wait_seconds=5)
+    monkeypatch.setattr(money_transfer_workflow, "circuit_breakers", breakers)
+    return breakers
+
+
+def execute(state_class: type):
+    return state_class().execute(None, REQUEST, None, None, None)
+
+
+def next_state(decision) -> tuple:
+    movement = decision.next_states[0]
+    return movement.state_id, movement.state_input
+
+
+def test_transfer_step_calls_the_account_service(breakers):
+    assert next_state(execute(DebitState)) == ("CreateCreditMemoState", REQUEST)
+    assert breakers.stats()["account"]["state"] == "closed"
+
+
+def test_failures_open_the_breaker_and_park_the_transfer(breakers, monkeypatch):
+    monkeypatch.setattr(money_transfer_workflow, "ACCOUNT_FAILURE_RATE", 1)
+    for _ in range(2):
+        # retried by the iWF server with backoff
+        with pytest.raises(RuntimeError):
+            execute(DebitState)
+    assert breakers.stats()["account"]["state"] == "open"
+
+    # doesn't call the account service, waits for a durable timer until the probe
+    state_id, wait = next_state(execute(CreditState))
+    assert state_id == "AccountServiceWaitState"
+    assert (wait.state_id, wait.wait_seconds, wait.request) == ("CreditState", 30, REQUEST)
+    assert breakers.stats()["account"]["rejected"] == 0
+
+    # then goes back to the state that waited
+    wait_state = AccountServiceWaitState()
+    assert wait_state.wait_until(None, wait, None, None).commands[0].duration_seconds == 30
+    assert next_state(wait_state.execute(None, wait, None, None, None)) == ("CreditState", REQUEST)
+
+
+def test_open_breaker_compensates_in_compensate_mode(breakers, monkeypatch):
+    monkeypatch.setattr(money_transfer_workflow, "CIRCUIT_OPEN_ACTION", money_transfer_workflow.CIRCUIT_OPEN_COMPENSATE)
+    monkeypatch.setattr(money_transfer_workflow, "ACCOUNT_FAILURE_RATE", 1)
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            execute(DebitState)
+    monkeypatch.setattr(money_transfer_workflow, "ACCOUNT_FAILURE_RATE", 0)
+    # fails fast
+    assert next_state(execute(CreditState)) == ("CompensateState", REQUEST)
+    assert breakers.stats()["account"]["rejected"] == 1
+    # the compensation itself waits for the breaker
+    assert next_state(execute(CompensateState))[1] == AccountServiceWait("CompensateState", 30, REQUEST)
@@ -1,5 +1,6 @@
+import logging
 from dataclasses import dataclass
-from typing import List
+from typing import List, Optional
 from iwf.workflow import ObjectWorkflow
 from iwf.workflow_state import WorkflowState
 from iwf.state_schema import StateSchema
@@ -14,11 +15,19 @@ from iwf.workflow_context import WorkflowContext
 from iwf.rpc import rpc
 from iwf.errors import WorkflowAlreadyStartedError
 from iwf.workflow_options import WorkflowOptions
+from iwf.workflow_state_options import WorkflowStateOptions
 from iwf.iwf_api.models import (
     IDReusePolicy,
+    PersistenceLoadingPolicy,
+    PersistenceLoadingType,
     WorkflowAlreadyStartedOptions,
 )
 
+from common.execute_cache import cache_execute_result
+
+logger = logging.getLogger(__name__)
+
+
 @dataclass
 class Request:
     id: str
@@ -37,11 +46,46 @@ MAX_BUFFERED_REQUESTS = 20 # max number of requests that are in the buffer
 
 REQUEST_QUEUE = "RequestQueue"
 CHILD_COMPLETE_CHANNEL_PREFIX = "ChildComplete_"
+CHILD_ADOPTED_CHANNEL = "ChildAdopted"
 
 DA_CURRENT_WAIT_CHILD_WFS = "CurrentWaitChildWfs"
+# the length of the wait list, for the RPCs that only need the count
+DA_CURRENT_WAIT_CHILD_COUNT = "CurrentWaitChildCount"
 DA_INSTANCE_ID = "InstanceId"
 DA_SHUTDOWN = "Shutdown"
+DA_MIGRATION_RESULT = "MigrationResult"
+
+# adopt_children and the execution of LoopForNextRequestState both update the wait list,
+# the lock serializes them so that they don't lose each other's updates
+WAIT_LIST_LOCKING_POLICY = PersistenceLoadingPolicy(
+    persistence_loading_type=PersistenceLoadingType.LOAD_PARTIAL_WITH_EXCLUSIVE_LOCK,
+    partial_loading_keys=[DA_CURRENT_WAIT_CHILD_WFS, DA_INSTANCE_ID, DA_SHUTDOWN],
+    locking_keys=[DA_CURRENT_WAIT_CHILD_WFS],
+)
+# the RPCs only load the data attributes they read, instead of the wait list
+SHUTDOWN_LOADING_POLICY = PersistenceLoadingPolicy(
+    persistence_loading_type=PersistenceLoadingType.LOAD_PARTIAL_WITHOUT_LOCKING,
+    partial_loading_keys=[DA_SHUTDOWN],
+)
+SPARE_CAPACITY_LOADING_POLICY = PersistenceLoadingPolicy(
+    persistence_loading_type=PersistenceLoadingType.LOAD_PARTIAL_WITHOUT_LOCKING,
+    partial_loading_keys=[DA_SHUTDOWN, DA_CURRENT_WAIT_CHILD_COUNT],
+)
+WAIT_LIST_LOADING_POLICY = PersistenceLoadingPolicy(
+    persistence_loading_type=PersistenceLoadingType.LOAD_PARTIAL_WITHOUT_LOCKING,
+    partial_loading_keys=[DA_CURRENT_WAIT_CHILD_WFS],
+)
+# a spot instance is reclaimed two minutes after the interruption notice
+MIGRATION_TIMEOUT_SECONDS = 110
+
 
+@dataclass
+class MigrationResult:
+    total: int
+    moved: int
+    completed: int
+    failed: List[str]
+    seconds: float
 
 
 class ControllerWorkflow(ObjectWorkflow):
@@ -55,17 +99,20 @@ class ControllerWorkflow(ObjectWorkflow):
     def get_persistence_schema(self) -> PersistenceSchema:
         return PersistenceSchema.create(
             PersistenceField.data_attribute_def(DA_CURRENT_WAIT_CHILD_WFS, List),
+            PersistenceField.data_attribute_def(DA_CURRENT_WAIT_CHILD_COUNT, int),
             PersistenceField.data_attribute_def(DA_INSTANCE_ID, str),
             PersistenceField.data_attribute_def(DA_SHUTDOWN, bool),
+            PersistenceField.data_attribute_def(DA_MIGRATION_RESULT, MigrationResult),
         )
 
     def get_communication_schema(self) -> CommunicationSchema:
         return CommunicationSchema.create(
             CommunicationMethod.internal_channel_def(REQUEST_QUEUE, Request),
             CommunicationMethod.internal_channel_def_by_prefix(CHILD_COMPLETE_CHANNEL_PREFIX, type(None)),
+            CommunicationMethod.internal_channel_def(CHILD_ADOPTED_CHANNEL, type(None)),
         )
 
-    @rpc()
+    @rpc(data_attribute_loading_policy=SHUTDOWN_LOADING_POLICY)
     def shutdown(self, ctx: WorkflowContext, persistence: Persistence, communication: Communication):
         shutdown = persistence.get_data_attribute(DA_SHUTDOWN) or False
         if shutdown:
@@ -74,7 +121,7 @@ class ControllerWorkflow(ObjectWorkflow):
         return True
 
 
-    @rpc()
+    @rpc(data_attribute_loading_policy=SHUTDOWN_LOADING_POLICY)
     def enqueue(self, ctx: WorkflowContext, input: Request, persistence: Persistence, communication: Communication) -> bool:
         shutdown = persistence.get_data_attribute(DA_SHUTDOWN) or False
         if shutdown:
@@ -86,7 +133,31 @@ class ControllerWorkflow(ObjectWorkflow):
         communication.publish_to_internal_channel(REQUEST_QUEUE, input)
         return True
 
-    @rpc()
+    @rpc(data_attribute_loading_policy=SPARE_CAPACITY_LOADING_POLICY)
+    def get_spare_capacity(self, persistence: Persistence, communication: Communication) -> int:
+        """The child workflows it can start before reaching the concurrency, or -1 when it's shut down"""
+        if persistence.get_data_attribute(DA_SHUTDOWN):
+            return -1
+        waiting = persistence.get_data_attribute(DA_CURRENT_WAIT_CHILD_COUNT) or 0
+        buffered = communication.get_internal_channel_size(REQUEST_QUEUE)
+        return CONCURRENCY_PER_CONTROLLER_WORKFLOW - waiting - buffered
+
+    @rpc(data_attribute_loading_policy=WAIT_LIST_LOCKING_POLICY)
+    def adopt_children(self, child_workflow_ids: List[str], persistence: Persistence,
+                       communication: Communication) -> bool:
+        """Waits for child workflows moved from another instance, returns False when it's shut down"""
+        if persistence.get_data_attribute(DA_SHUTDOWN):
+            return False
+        current_wait_child_wfs = persistence.get_data_attribute(DA_CURRENT_WAIT_CHILD_WFS) or []
+        # adopting again(e.g. a retried migration) is a no-op
+        new_children = [child for child in child_workflow_ids if child not in current_wait_child_wfs]
+        if new_children:
+            set_wait_list(persistence, current_wait_child_wfs + new_children)
+            # wake up LoopForNextRequestState to wait for the new children too
+            communication.publish_to_internal_channel(CHILD_ADOPTED_CHANNEL, None)
+        return True
+
+    @rpc(data_attribute_loading_policy=WAIT_LIST_LOADING_POLICY)
     def complete_child_workflow(self, child_workflow_id: str, persistence: Persistence, communication: Communication):
         current_wait_child_wfs = persistence.get_data_attribute(DA_CURRENT_WAIT_CHILD_WFS) or []
         if child_workflow_id  not in current_wait_child_wfs:
@@ -96,15 +167,24 @@ class ControllerWorkflow(ObjectWorkflow):
         communication.publish_to_internal_channel(CHILD_COMPLETE_CHANNEL_PREFIX + child_workflow_id, None)
 
 
-class InitState(WorkflowState[Request]):
-    def execute(self, ctx: WorkflowContext, input: Request, command_results: CommandResults, persistence: Persistence, communication: Communication) -> StateDecision:
-        communication.publish_to_internal_channel(REQUEST_QUEUE, input)
-        
-        persistence.set_data_attribute(DA_CURRENT_WAIT_CHILD_WFS, [])
+def set_wait_list(persistence: Persistence, wait_list: List[str]):
+    persistence.set_data_attribute(DA_CURRENT_WAIT_CHILD_WFS, wait_list)
+    persistence.set_data_attribute(DA_CURRENT_WAIT_CHILD_COUNT, len(wait_list))
+
+
+class InitState(WorkflowState[Optional[Request]]):
+    def execute(self, ctx: WorkflowContext, input: Optional[Request], command_results: CommandResults, persistence: Persistence, communication: Communication) -> StateDecision:
+        # there is no request when the workflow is started to adopt the children moved from another instance
+        if input is not None:
+            communication.publish_to_internal_channel(REQUEST_QUEUE, input)
+
+        set_wait_list(persistence, persistence.get_data_attribute(DA_CURRENT_WAIT_CHILD_WFS) or [])
         
         return StateDecision.single_next_state(LoopForNextRequestState)
 
 
+# a retried execute doesn't start the child workflows again
+@cache_execute_result
 class LoopForNextRequestState(WorkflowState[None]):
     def wait_until(self, ctx: WorkflowContext, input: None, persistence: Persistence, communication: Communication) -> CommandRequest:
         current_wait_child_wfs = persistence.get_data_attribute(DA_CURRENT_WAIT_CHILD_WFS)
@@ -115,8 +195,12 @@ class LoopForNextRequestState(WorkflowState[None]):
         for child_wf_id in current_wait_child_wfs:
             # wait for every child workflow to complete
             commands.append(InternalChannelCommand.by_name(CHILD_COMPLETE_CHANNEL_PREFIX + child_wf_id))
+        commands.append(InternalChannelCommand.by_name(CHILD_ADOPTED_CHANNEL))
         return CommandRequest.for_any_command_completed(*commands)
 
+    def get_state_options(self) -> WorkflowStateOptions:
+        return WorkflowStateOptions(execute_api_data_attributes_loading_policy=WAIT_LIST_LOCKING_POLICY)
+
     def execute(self, ctx: WorkflowContext, input: None, command_results: CommandResults, persistence: Persistence, communication: Communication) -> StateDecision:
         new_wait_list = persistence.get_data_attribute(DA_CURRENT_WAIT_CHILD_WFS)
         instance_id = persistence.get_data_attribute(DA_INSTANCE_ID)
@@ -149,14 +233,15 @@ class LoopForNextRequestState(WorkflowState[None]):
                         new_wait_list.append(child_workflow_id)
                     except WorkflowAlreadyStartedError:
                         # there could be edge cases caused by network timeout/retry
-                        print("already started by other threads/runs, ignore it -- not waiting for it")
+                        logger.info("already started by other threads/runs, ignore it -- not waiting for it")
                         
             elif channel_name.startswith(CHILD_COMPLETE_CHANNEL_PREFIX):
                 if command_result.status == "RECEIVED":
                     child_wf_id = channel_name[len(CHILD_COMPLETE_CHANNEL_PREFIX):]
                     new_wait_list.remove(child_wf_id)
+            # CHILD_ADOPTED_CHANNEL: the wait list already has the children, the next wait_until waits for them
         
-        persistence.set_data_attribute(DA_CURRENT_WAIT_CHILD_WFS, new_wait_list)
+        set_wait_list(persistence, new_wait_list)
 
         shutdown = persistence.get_data_attribute(DA_SHUTDOWN)
 
@@ -169,9 +254,16 @@ class LoopForNextRequestState(WorkflowState[None]):
 
 
 class MoveToAnotherInstanceState(WorkflowState[None]):
-    def execute(self, ctx: WorkflowContext, input: Request, command_results: CommandResults, persistence: Persistence,
+    def execute(self, ctx: WorkflowContext, input: None, command_results: CommandResults, persistence: Persistence,
                 communication: Communication) -> StateDecision:
-        # TODO: need to get all the current started child workflow from persistence
-        print("call the API in main.py to move all the started child workflows to another instance")
+        from migration import migrate_children
+
+        instance_id = persistence.get_data_attribute(DA_INSTANCE_ID)
+        child_workflow_ids = persistence.get_data_attribute(DA_CURRENT_WAIT_CHILD_WFS) or []
+        result = migrate_children(instance_id, child_workflow_ids, MIGRATION_TIMEOUT_SECONDS)
+        # not retried when some children failed to move: the instance is gone by the time a retry is done
+        persistence.set_data_attribute(DA_MIGRATION_RESULT, result)
+        return StateDecision.graceful_complete_workflow("moved to another instance")
 
-        return StateDecision.graceful_complete_workflow("moved to another instance")
\ No newline at end of file
+    def get_state_options(self) -> WorkflowStateOptions:
+        return WorkflowStateOptions(execute_api_timeout_seconds=MIGRATION_TIMEOUT_SECONDS + 10)
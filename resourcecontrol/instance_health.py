@@ -0,0 +1,146 @@
+"""
+Checks the health of the spot instances in the background, so that routing a request reads a cached table
+instead of calling the instance.
+
+Every interval, all the instances are checked concurrently with an HTTP GET on their health endpoint. An instance
+is marked down after failure_threshold consecutive failures, and up again after one success. The table is replaced
+as a whole after each round, so readers never take a lock.
+
+Configured by environment variables:
+    RESOURCECONTROL_HEALTH_URL: the health endpoint of the instances, with {instance_id} in it.
+        For local development only, "stub", the default, checks the stub endpoint of main.py instead, where the
+        health of each instance is set by hand
+    RESOURCECONTROL_HEALTH_INTERVAL_SECONDS: default 5
+    RESOURCECONTROL_HEALTH_TIMEOUT_SECONDS: default 1
+    RESOURCECONTROL_HEALTH_FAILURE_THRESHOLD: default 3
+"""
+import logging
+import os
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Dict, List, Optional
+
+from controller_workflow import SPOT_INSTANCE_IDS
+
+logger = logging.getLogger(__name__)
+
+# RESOURCECONTROL_HEALTH_URL to check the dev-only stub endpoint of main.py, on the worker itself
+STUB_HEALTH = "stub"
+STUB_HEALTH_URL = "http://localhost:8802/controller/stub_health/{instance_id}"
+
+
+@dataclass(frozen=True)
+class InstanceHealth:
+    available: bool
+    # of the last successful check
+    latency_ms: Optional[float]
+    consecutive_failures: int
+    checked_at: Optional[float]
+
+
+# before the first check, the instances are assumed to be available
+UNCHECKED = InstanceHealth(available=True, latency_ms=None, consecutive_failures=0, checked_at=None)
+
+
+def http_check(url_template: str, timeout_seconds: float) -> Callable[[str], None]:
+    def check(instance_id: str):
+        with urllib.request.urlopen(url_template.format(instance_id=instance_id), timeout=timeout_seconds) as response:
+            if response.status != 200:
+                raise RuntimeError(f"status {response.status}")
+
+    return check
+
+
+class InstanceHealthProber:
+    def __init__(self, instance_ids: List[str], check: Callable[[str], None], interval_seconds: float,
+                 failure_threshold: int):
+        self._instance_ids = instance_ids
+        self._check = check
+        self._interval_seconds = interval_seconds
+        self._failure_threshold = failure_threshold
+        self._table: Dict[str, InstanceHealth] = {instance_id: UNCHECKED for instance_id in instance_ids}
+        # at least one thread, there may be no instance configured
+        self._executor = ThreadPoolExecutor(max_workers=max(1, len(instance_ids)), thread_name_prefix="health-check")
+        self._started = False
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        with self._start_lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._run, name="instance-health-prober", daemon=True).start()
+
+    @property
+    def interval_seconds(self) -> float:
+        return self._interval_seconds
+
+    def is_known(self, instance_id: str) -> bool:
+        return instance_id in self._table
+
+    def is_available(self, instance_id: str) -> bool:
+        return self._table.get(instance_id, UNCHECKED).available
+
+    def available_instances(self) -> List[str]:
+        table = self._table
+        return [instance_id for instance_id in self._instance_ids if table[instance_id].available]
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        return {instance_id: asdict(health) for instance_id, health in self._table.items()}
+
+    def probe_once(self):
+        previous = self._table
+        results = self._executor.map(self._probe, self._instance_ids, [previous[i] for i in self._instance_ids])
+        # replaced as a whole: the readers see either the previous table or this one
+        self._table = dict(zip(self._instance_ids, results))
+
+    def _run(self):
+        while True:
+            started = time.monotonic()
+            try:
+                self.probe_once()
+            except Exception:
+                logger.exception("failed to check the instances")
+            time.sleep(max(0.0, self._interval_seconds - (time.monotonic() - started)))
+
+    def _probe(self, instance_id: str, previous: InstanceHealth) -> InstanceHealth:
+        start = time.perf_counter()
+        try:
+            self._check(instance_id)
+        except Exception as e:
+            failures = previous.consecutive_failures + 1
+            available = failures < self._failure_threshold
+            if previous.available and not available:
+                logger.warning("instance %s is down after %s failed checks: %s", instance_id, failures, e)
+            return InstanceHealth(available, previous.latency_ms, failures, time.time())
+        if not previous.available:
+            logger.info("instance %s is up again", instance_id)
+        return InstanceHealth(True, (time.perf_counter() - start) * 1000, 0, time.time())
+
+
+def uses_stub_health() -> bool:
+    return (os.environ.get("RESOURCECONTROL_HEALTH_URL") or STUB_HEALTH) == STUB_HEALTH
+
+
+def instance_health_prober_from_env() -> InstanceHealthProber:
+    url = os.environ.get("RESOURCECONTROL_HEALTH_URL") or STUB_HEALTH
+    if url == STUB_HEALTH:
+        logger.warning(
+            "checking the health of the instances on the dev-only stub endpoint, not the instances: "
+            "set RESOURCECONTROL_HEALTH_URL to their health endpoint, with {instance_id} in it"
+        )
+        url = STUB_HEALTH_URL
+    check = http_check(url, float(os.environ.get("RESOURCECONTROL_HEALTH_TIMEOUT_SECONDS", 1)))
+    return InstanceHealthProber(
+        SPOT_INSTANCE_IDS,
+        check,
+        interval_seconds=float(os.environ.get("RESOURCECONTROL_HEALTH_INTERVAL_SECONDS", 5)),
+        failure_threshold=int(os.environ.get("RESOURCECONTROL_HEALTH_FAILURE_THRESHOLD", 3)),
+    )
+
+
+# started by main.py, read by the request routing and the migration
+instance_health_prober = instance_health_prober_from_env()
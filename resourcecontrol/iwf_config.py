@@ -1,17 +1,22 @@
 from iwf.client import Client
-from iwf.registry import Registry
-from iwf.worker_service import (
-    WorkerService,
-)
+from iwf.client_options import ClientOptions
+from iwf.worker_service import WorkerOptions
 
-from controller_workflow import ControllerWorkflow
-from processing_workflow import ProcessingWorkflow
+from common.execute_cache import CachingWorkerService, execute_result_cache_from_env
+from common.lazy_registry import LazyRegistry
+from common.payload_encoder import object_encoder_from_env
+from common.priority_lanes import priority_lanes_from_env
 
-registry = Registry()
-worker_service = WorkerService(registry)
-client = Client(registry)
+object_encoder = object_encoder_from_env()
+client_options = ClientOptions.local_default()
+client_options.object_encoder = object_encoder
 
-registry.add_workflows(
-    ControllerWorkflow(), 
-    ProcessingWorkflow()
-    )
+registry = LazyRegistry()
+# the execute callbacks of the @cache_execute_result states aren't executed again when retried
+worker_service = CachingWorkerService(registry, WorkerOptions(object_encoder), priority_lanes_from_env(),
+                                      execute_result_cache_from_env())
+client = Client(registry, client_options)
+
+# the workflows are imported and registered on first use
+registry.add_lazy_workflow("ControllerWorkflow", "controller_workflow:ControllerWorkflow")
+registry.add_lazy_workflow("ProcessingWorkflow", "processing_workflow:ProcessingWorkflow")
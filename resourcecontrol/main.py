@@ -1,6 +1,8 @@
+import logging
 import traceback
+from dataclasses import asdict
 
-from random import randint
+import random
 from flask import Flask, request
 from iwf.iwf_api.models import (
     WorkflowStateExecuteRequest,
@@ -12,29 +14,63 @@ from iwf.worker_service import (
 )
 from iwf.workflow_options import WorkflowOptions
 
-from iwf_config import client, worker_service
+from common.admission_control import install_admission_control
+from common.callback_recorder import install_callback_recorder
+from common.idempotency import idempotency_store_from_env, idempotent
+from common.metrics_routes import install_metrics_routes
+from common.structured_logging import configure_logging
+
+from iwf_config import client, registry, worker_service
 from controller_workflow import (
     ControllerWorkflow,
-    SPOT_INSTANCE_IDS,
-    Request, DA_INSTANCE_ID
+    Request, DA_INSTANCE_ID, DA_MIGRATION_RESULT
 )
 from iwf.errors import WorkflowNotExistsError
+from instance_health import instance_health_prober, uses_stub_health
 from processing_workflow import ProcessingWorkflow
 
 flask_app = Flask(__name__)
+configure_logging(flask_app)
+admission_controller = install_admission_control(flask_app, registry)
+callback_recorder = install_callback_recorder(flask_app)
+idempotency_store = idempotency_store_from_env()
+# http://localhost:8802/metrics/<name>, see common/metrics_routes.py
+install_metrics_routes(flask_app, worker_service, admission_controller, callback_recorder, {
+    "idempotency": idempotency_store.stats,
+    "instance_health": instance_health_prober.snapshot,
+})
+logger = logging.getLogger(__name__)
+instance_health_prober.start()
+
+
+def deny(reason: str):
+    # not a 2xx, so that @idempotent doesn't keep it and the retry with the same key is routed again
+    return f"request is denied because {reason}. Please retry later", 503, {
+        "Retry-After": str(max(1, round(instance_health_prober.interval_seconds)))
+    }
 
 
 # http://localhost:8802/controller/request?id=123
+# http://localhost:8802/controller/request?id=123&instance_id=instance-1 to send it to a given instance
 @flask_app.route("/controller/request")
+@idempotent(idempotency_store)
 def start_request():
     id = request.args["id"]
     req = Request(id=id, data="abcd")
 
-    # for extension, instead of randomly picking, we could sort the list based on usage, as you described in the advanced use case
-    rand_idx = randint(0, len(SPOT_INSTANCE_IDS)-1)
-    instance_id = SPOT_INSTANCE_IDS[rand_idx]
-
-    print(f"call some API here to check if the instance is available, if not then pick another one from the list")
+    # the availability is checked in the background, see instance_health.py
+    instance_id = request.args.get("instance_id")
+    if instance_id is not None:
+        if not instance_health_prober.is_known(instance_id):
+            return f"unknown instance {instance_id}", 404
+        if not instance_health_prober.is_available(instance_id):
+            return deny("the instance is not available")
+    else:
+        available_instance_ids = instance_health_prober.available_instances()
+        if not available_instance_ids:
+            return deny("no instance is available")
+        # for extension, instead of randomly picking, we could sort the list based on usage, as you described in the advanced use case
+        instance_id = random.choice(available_instance_ids)
 
     controller_workflow_id = f"controller_workflow_{instance_id}"
     try:
@@ -51,7 +87,7 @@ def start_request():
     else:
         # for extension, move this route logic into a RequestWorkflow, with single state to have backoff retry
         # so that the request is always accepted instead of denying
-        return "request is denied because instance is busy. Please retry later"
+        return deny("instance is busy")
 
 
 # http://localhost:8802/controller/shutdown?instance_id=permanentID1
@@ -62,6 +98,42 @@ def shutdown_instance():
     client.invoke_rpc(controller_workflow_id, ControllerWorkflow.shutdown, None)
     return "done"
 
+# http://localhost:8802/controller/migration?instance_id=permanentID1
+@flask_app.route("/controller/migration")
+def describe_migration():
+    instance_id = request.args["instance_id"]
+    controller_workflow_id = f"controller_workflow_{instance_id}"
+    # read from the data attributes, which are still available after the controller completes
+    try:
+        attributes = client.get_workflow_data_attributes(ControllerWorkflow, controller_workflow_id,
+                                                         keys=[DA_MIGRATION_RESULT])
+    except RuntimeError:
+        # raised by the SDK when the data attribute is not set
+        attributes = {}
+    result = attributes.get(DA_MIGRATION_RESULT)
+    if result is None:
+        return "the child workflows are not moved yet"
+    return asdict(result)
+
+# DEV ONLY: the health endpoint checked with RESOURCECONTROL_HEALTH_URL=stub, instead of the instances.
+# http://localhost:8802/controller/stub_health/permanentID1?healthy=false to mark an instance down, true to recover
+stub_unhealthy_instance_ids = set()
+
+
+@flask_app.route("/controller/stub_health/<instance_id>")
+def stub_health(instance_id):
+    if not uses_stub_health():
+        return "the stub health endpoint is only enabled with RESOURCECONTROL_HEALTH_URL=stub", 404
+    healthy = request.args.get("healthy")
+    if healthy is not None:
+        if healthy == "true":
+            stub_unhealthy_instance_ids.discard(instance_id)
+        else:
+            stub_unhealthy_instance_ids.add(instance_id)
+    if instance_id in stub_unhealthy_instance_ids:
+        return "unhealthy", 503
+    return "ok"
+
 # http://localhost:8802/controller/processing/describe?id=123
 @flask_app.route("/controller/processing/describe")
 def describe_request():
@@ -103,7 +175,7 @@ def handle_rpc():
 # the WebUI will be able to show you the error with stacktrace
 @flask_app.errorhandler(Exception)
 def internal_error(exception):
-    print(traceback.format_exc())
+    logger.exception("error handling %s", request.path)
     return traceback.format_exc(), 500
 
 
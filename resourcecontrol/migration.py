@@ -0,0 +1,159 @@
+"""
+Moves the in-flight ProcessingWorkflows of a controller to the controllers of the other instances, when its spot
+instance is being reclaimed.
+
+1. the spare capacity of the other available instances is read from their controllers, in parallel
+2. each child is assigned to the instance with the most spare capacity left; when there isn't enough, the children
+   are spread over the instances anyway, as they would be lost otherwise
+3. the controller of each target instance adopts its children(or is started with them), so that it waits for them
+4. each child is moved to its target, in parallel: its instance id and parent controller are updated
+
+The children are adopted before they are moved, so that a child completing right after the move notifies a parent
+already waiting for it. A child that completes before the move notifies the old parent instead, so it's removed
+from the target's wait list.
+"""
+import heapq
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, as_completed
+from typing import Dict, List
+
+from iwf.errors import WorkflowAlreadyStartedError, WorkflowNotExistsError
+from iwf.workflow_options import WorkflowOptions
+
+from controller_workflow import (
+    CONCURRENCY_PER_CONTROLLER_WORKFLOW,
+    ControllerWorkflow,
+    DA_CURRENT_WAIT_CHILD_COUNT,
+    DA_CURRENT_WAIT_CHILD_WFS,
+    DA_INSTANCE_ID,
+    MigrationResult,
+)
+from processing_workflow import MoveRequest, ProcessingWorkflow
+
+logger = logging.getLogger(__name__)
+
+# concurrent RPCs to the iWF server while migrating
+MIGRATION_CONCURRENCY = 32
+PROGRESS_LOG_INTERVAL = 50
+
+
+def controller_workflow_id(instance_id: str) -> str:
+    return f"controller_workflow_{instance_id}"
+
+
+def migrate_children(instance_id: str, child_workflow_ids: List[str], timeout_seconds: float) -> MigrationResult:
+    start = time.monotonic()
+    from instance_health import instance_health_prober
+
+    targets = [target for target in instance_health_prober.available_instances() if target != instance_id]
+    if not child_workflow_ids:
+        return MigrationResult(total=0, moved=0, completed=0, failed=[], seconds=0)
+
+    executor = ThreadPoolExecutor(max_workers=MIGRATION_CONCURRENCY, thread_name_prefix="migration")
+    try:
+        capacities = dict(zip(targets, executor.map(get_spare_capacity, targets)))
+        assignments = assign_children(child_workflow_ids, capacities)
+        logger.info("moving %s child workflows from %s to %s", len(child_workflow_ids), instance_id,
+                    {target: len(children) for target, children in assignments.items()})
+
+        adopted = dict(zip(assignments, executor.map(lambda target: adopt_children(target, assignments[target]),
+                                                     assignments)))
+        failed = [child for target, ok in adopted.items() if not ok for child in assignments[target]]
+
+        moves = {
+            executor.submit(move_child, child, target): child
+            for target, ok in adopted.items() if ok
+            for child in assignments[target]
+        }
+        moved = completed = 0
+        try:
+            for future in as_completed(moves, timeout=max(0.0, start + timeout_seconds - time.monotonic())):
+                child = moves[future]
+                try:
+                    if future.result():
+                        moved += 1
+                    else:
+                        completed += 1
+                except Exception:
+                    logger.exception("failed to move child workflow %s", child)
+                    failed.append(child)
+                done = moved + completed + len(failed)
+                if done % PROGRESS_LOG_INTERVAL == 0:
+                    logger.info("moved %s/%s child workflows from %s", done, len(child_workflow_ids), instance_id)
+        except TimeoutError:
+            failed += [child for future, child in moves.items() if not future.done()]
+    finally:
+        # don't wait for the moves left after the timeout
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    result = MigrationResult(
+        total=len(child_workflow_ids), moved=moved, completed=completed, failed=failed,
+        seconds=time.monotonic() - start,
+    )
+    logger.info("moved the child workflows of %s: %s", instance_id, result)
+    return result
+
+
+def get_spare_capacity(instance_id: str) -> int:
+    from iwf_config import client
+
+    try:
+        return client.invoke_rpc(controller_workflow_id(instance_id), ControllerWorkflow.get_spare_capacity)
+    except WorkflowNotExistsError:
+        # no controller running: the instance is idle
+        return CONCURRENCY_PER_CONTROLLER_WORKFLOW
+
+
+def assign_children(child_workflow_ids: List[str], capacities: Dict[str, int]) -> Dict[str, List[str]]:
+    """Assigns every child to the instance with the most spare capacity left, skipping the ones shut down"""
+    # a max heap of (spare capacity, instance id)
+    heap = [(-capacity, target) for target, capacity in capacities.items() if capacity >= 0]
+    if not heap:
+        raise RuntimeError("no instance to move the child workflows to")
+    heapq.heapify(heap)
+    assignments: Dict[str, List[str]] = {}
+    for child in child_workflow_ids:
+        negative_capacity, target = heapq.heappop(heap)
+        assignments.setdefault(target, []).append(child)
+        heapq.heappush(heap, (negative_capacity + 1, target))
+    return assignments
+
+
+def adopt_children(instance_id: str, child_workflow_ids: List[str]) -> bool:
+    from iwf_config import client
+
+    workflow_id = controller_workflow_id(instance_id)
+    try:
+        return client.invoke_rpc(workflow_id, ControllerWorkflow.adopt_children, child_workflow_ids)
+    except WorkflowNotExistsError:
+        pass
+    try:
+        client.start_workflow(
+            ControllerWorkflow, workflow_id, 0, None,
+            WorkflowOptions(initial_data_attributes={
+                DA_INSTANCE_ID: instance_id,
+                DA_CURRENT_WAIT_CHILD_WFS: child_workflow_ids,
+                DA_CURRENT_WAIT_CHILD_COUNT: len(child_workflow_ids),
+            }),
+        )
+        return True
+    except WorkflowAlreadyStartedError:
+        # just started by a new request
+        return client.invoke_rpc(workflow_id, ControllerWorkflow.adopt_children, child_workflow_ids)
+
+
+def move_child(child_workflow_id: str, instance_id: str) -> bool:
+    """Returns True if the child is moved, False if it already completed"""
+    from iwf_config import client
+
+    workflow_id = controller_workflow_id(instance_id)
+    try:
+        if client.invoke_rpc(child_workflow_id, ProcessingWorkflow.move_to_instance,
+                             MoveRequest(instance_id, workflow_id)):
+            return True
+    except WorkflowNotExistsError:
+        pass
+    # the old parent was notified of the completion, so the new parent must stop waiting for it
+    client.invoke_rpc(workflow_id, ControllerWorkflow.complete_child_workflow, child_workflow_id)
+    return False
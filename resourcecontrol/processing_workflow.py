@@ -1,3 +1,7 @@
+import logging
+from dataclasses import dataclass
+
+from iwf.iwf_api.models import PersistenceLoadingPolicy, PersistenceLoadingType
 from iwf.workflow import ObjectWorkflow
 from iwf.workflow_state import WorkflowState
 from iwf.state_schema import StateSchema
@@ -14,17 +18,47 @@ from controller_workflow import ControllerWorkflow
 from iwf.errors import WorkflowNotExistsError
 
 from resourcecontrol.controller_workflow import DA_INSTANCE_ID
+from common.rate_limiter import DOWNSTREAM_INSTANCE, is_throttled, throttle, try_acquire
+
+logger = logging.getLogger(__name__)
 
 DA_PARENT_WORKFLOW_ID = "ParentWorkflowId"
 DA_PROCESSING_STATUS = "Status"
 DA_REQUEST = "Request"
 
+STATUS_PROCESSING_COMPLETED = "gpu processing completed"
+
+# move_to_instance is applied atomically with the lock, so it's either before or after a state execution
+MOVE_LOCKING_POLICY = PersistenceLoadingPolicy(
+    persistence_loading_type=PersistenceLoadingType.LOAD_PARTIAL_WITH_EXCLUSIVE_LOCK,
+    partial_loading_keys=[DA_PARENT_WORKFLOW_ID, DA_INSTANCE_ID, DA_PROCESSING_STATUS],
+    locking_keys=[DA_PARENT_WORKFLOW_ID, DA_INSTANCE_ID],
+)
+
+
+@dataclass
+class MoveRequest:
+    instance_id: str
+    parent_workflow_id: str
+
+# built once instead of on every wait_until, as it doesn't change
+CHECK_COMPLETION_LATER = CommandRequest.for_any_command_completed(
+    # here use a timer to check the completion after 5 seconds,
+    # It can be extended as needed:
+    #    1. the timer can change on different iteration by using a data attribute as counter
+    #    2. it can wait for a signal from the validation job (may not be possible/easy) or both
+    TimerCommand.by_seconds(5)
+)
+
+
 class ProcessingWorkflow(ObjectWorkflow):
     def get_workflow_states(self) -> StateSchema:
         return StateSchema.with_starting_state(
             ValidationStartState(),
+            ValidationThrottledState(),
             ValidationCompleteState(),
             GpuProcessingStartState(),
+            GpuProcessingThrottledState(),
             GpuProcessingCompleteState(),
             CompleteState())
 
@@ -40,31 +74,51 @@ class ProcessingWorkflow(ObjectWorkflow):
     def describe(self, persistence: Persistence)->str:
         return persistence.get_data_attribute(DA_PROCESSING_STATUS)
 
+    @rpc(data_attribute_loading_policy=MOVE_LOCKING_POLICY)
+    def move_to_instance(self, move: MoveRequest, persistence: Persistence) -> bool:
+        """Returns False if the processing is already completed, and the old parent is(or will be) notified"""
+        if persistence.get_data_attribute(DA_PROCESSING_STATUS) == STATUS_PROCESSING_COMPLETED:
+            return False
+        persistence.set_data_attribute(DA_INSTANCE_ID, move.instance_id)
+        persistence.set_data_attribute(DA_PARENT_WORKFLOW_ID, move.parent_workflow_id)
+        return True
+
 
 class ValidationStartState(WorkflowState[Request]):
     def execute(self, ctx: WorkflowContext, req: Request, command_results: CommandResults, persistence: Persistence, communication: Communication) -> StateDecision:
-        persistence.set_data_attribute(DA_REQUEST, req) # save it to persistence so that we don't pass it as state input over and over again to other state
+        # calls the instance API only with a token from the rate limiter, otherwise waits for a durable timer
+        if not try_acquire(DOWNSTREAM_INSTANCE):
+            return StateDecision.single_next_state(ValidationThrottledState, req)
+        return start_validation(req, persistence)
+
+
+class ValidationThrottledState(WorkflowState[Request]):
+    def wait_until(self, ctx: WorkflowContext, req: Request, persistence: Persistence, communication: Communication) -> CommandRequest:
+        return throttle(DOWNSTREAM_INSTANCE)
+
+    def execute(self, ctx: WorkflowContext, req: Request, command_results: CommandResults, persistence: Persistence, communication: Communication) -> StateDecision:
+        if is_throttled(command_results):
+            return StateDecision.single_next_state(ValidationThrottledState, req)
+        return start_validation(req, persistence)
 
-        instance_id = persistence.get_data_attribute(DA_INSTANCE_ID)
-        print(f"start validation of request {req} in {instance_id} by calling API to the instance/VM endpoint")
-        persistence.set_data_attribute(DA_PROCESSING_STATUS, "validation started")
 
-        return StateDecision.single_next_state(ValidationCompleteState)
+def start_validation(req: Request, persistence: Persistence) -> StateDecision:
+    persistence.set_data_attribute(DA_REQUEST, req) # save it to persistence so that we don't pass it as state input over and over again to other state
+
+    instance_id = persistence.get_data_attribute(DA_INSTANCE_ID)
+    logger.info("start validation of request %s in %s by calling API to the instance/VM endpoint", req, instance_id)
+    persistence.set_data_attribute(DA_PROCESSING_STATUS, "validation started")
+
+    return StateDecision.single_next_state(ValidationCompleteState)
 
 
 class ValidationCompleteState(WorkflowState[None]):
     def wait_until(self, ctx: WorkflowContext, ignored: None, persistence: Persistence, communication: Communication) -> CommandRequest:
-        return CommandRequest.for_any_command_completed(
-            # here use a timer to check the completion after 5 seconds,
-            # It can be extended as needed:
-            #    1. the timer can change on different iteration by using a data attribute as counter
-            #    2. it can wait for a signal from the validation job (may not be possible/easy) or both
-            TimerCommand.by_seconds(5)
-        )
+        return CHECK_COMPLETION_LATER
 
     def execute(self, ctx: WorkflowContext, ignored: None, command_results: CommandResults, persistence: Persistence, communication: Communication) -> StateDecision:
         instance_id = persistence.get_data_attribute(DA_INSTANCE_ID)
-        print(f"completed validation in {instance_id} by calling API to the instance/VM endpoint")
+        logger.info("completed validation in %s by calling API to the instance/VM endpoint", instance_id)
         validation_succ = True
 
         if validation_succ:
@@ -78,30 +132,41 @@ class ValidationCompleteState(WorkflowState[None]):
 class GpuProcessingStartState(WorkflowState[None]):
     def execute(self, ctx: WorkflowContext, ignored: None, command_results: CommandResults, persistence: Persistence,
                 communication: Communication) -> StateDecision:
-        req = persistence.get_data_attribute(DA_REQUEST)
-        instance_id = persistence.get_data_attribute(DA_INSTANCE_ID)
-        print(f"start processing of request {req} in {instance_id} by calling API to the instance/VM endpoint")
-        persistence.set_data_attribute(DA_PROCESSING_STATUS, "processing started")
+        if not try_acquire(DOWNSTREAM_INSTANCE):
+            return StateDecision.single_next_state(GpuProcessingThrottledState)
+        return start_gpu_processing(persistence)
 
-        return StateDecision.single_next_state(GpuProcessingCompleteState)
+
+class GpuProcessingThrottledState(WorkflowState[None]):
+    def wait_until(self, ctx: WorkflowContext, ignored: None, persistence: Persistence, communication: Communication) -> CommandRequest:
+        return throttle(DOWNSTREAM_INSTANCE)
+
+    def execute(self, ctx: WorkflowContext, ignored: None, command_results: CommandResults, persistence: Persistence,
+                communication: Communication) -> StateDecision:
+        if is_throttled(command_results):
+            return StateDecision.single_next_state(GpuProcessingThrottledState)
+        return start_gpu_processing(persistence)
+
+
+def start_gpu_processing(persistence: Persistence) -> StateDecision:
+    req = persistence.get_data_attribute(DA_REQUEST)
+    instance_id = persistence.get_data_attribute(DA_INSTANCE_ID)
+    logger.info("start processing of request %s in %s by calling API to the instance/VM endpoint", req, instance_id)
+    persistence.set_data_attribute(DA_PROCESSING_STATUS, "processing started")
+
+    return StateDecision.single_next_state(GpuProcessingCompleteState)
 
 class GpuProcessingCompleteState(WorkflowState[None]):
     def wait_until(self, ctx: WorkflowContext, ignored: None, persistence: Persistence, communication: Communication) -> CommandRequest:
-        return CommandRequest.for_any_command_completed(
-            # here use a timer to check the completion after 5 seconds,
-            # It can be extended as needed:
-            #    1. the timer can change on different iteration by using a data attribute as counter
-            #    2. it can wait for a signal from the validation job (may not be possible/easy) or both
-            TimerCommand.by_seconds(5)
-        )
+        return CHECK_COMPLETION_LATER
 
     def execute(self, ctx: WorkflowContext, ignored: None, command_results: CommandResults, persistence: Persistence, communication: Communication) -> StateDecision:
         instance_id = persistence.get_data_attribute(DA_INSTANCE_ID)
-        print(f"check gpu processing in {instance_id} by calling API to the instance/VM endpoint")
+        logger.info("check gpu processing in %s by calling API to the instance/VM endpoint", instance_id)
 
         processing_succ = True
         if processing_succ:
-            persistence.set_data_attribute(DA_PROCESSING_STATUS, "gpu processing completed")
+            persistence.set_data_attribute(DA_PROCESSING_STATUS, STATUS_PROCESSING_COMPLETED)
             return StateDecision.single_next_state(CompleteState)
         else:
             # future extensions: if it can know the instance is not responding anymore, it should call controller workflow to shutdown and move the processing to other instances
@@ -115,6 +180,6 @@ class CompleteState(WorkflowState[None]):
         try:
             client.invoke_rpc(parent_workflow_id, ControllerWorkflow.complete_child_workflow, ctx.workflow_id)
         except WorkflowNotExistsError:
-            print("Parent workflow may have completed, possibly a duplicate completion request, ignoring it.")
+            logger.info("Parent workflow may have completed, possibly a duplicate completion request, ignoring it.")
         
         return StateDecision.graceful_complete_workflow()
@@ -0,0 +1,95 @@
+import threading
+
+import pytest
+from werkzeug.serving import make_server
+
+import main
+from controller_workflow import SPOT_INSTANCE_IDS
+from instance_health import InstanceHealthProber, http_check, instance_health_prober_from_env
+
+
+@pytest.fixture
+def stub_url():
+    """The stub health endpoint of main.py, served on a free port"""
+    server = make_server("127.0.0.1", 0, main.flask_app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    main.stub_unhealthy_instance_ids.clear()
+    yield f"http://127.0.0.1:{server.server_port}/controller/stub_health/{{instance_id}}"
+    server.shutdown()
+    main.stub_unhealthy_instance_ids.clear()
+
+
+def set_stub_health(instance_id: str, healthy: bool):
+    response = main.flask_app.test_client().get(
+        f"/controller/stub_health/{instance_id}?healthy={'true' if healthy else 'false'}"
+    )
+    assert response.status_code == (200 if healthy else 503)
+
+
+def test_healthy_unhealthy_recovered(stub_url):
+    prober = InstanceHealthProber(["i1", "i2"], http_check(stub_url, 1), interval_seconds=1, failure_threshold=2)
+    prober.probe_once()
+    assert prober.available_instances() == ["i1", "i2"]
+    assert prober.snapshot()["i1"]["latency_ms"] is not None
+
+    set_stub_health("i1", healthy=False)
+    prober.probe_once()
+    # still available below the failure threshold
+    assert prober.is_available("i1")
+    assert prober.snapshot()["i1"]["consecutive_failures"] == 1
+    prober.probe_once()
+    assert not prober.is_available("i1")
+    assert prober.available_instances() == ["i2"]
+
+    set_stub_health("i1", healthy=True)
+    prober.probe_once()
+    assert prober.is_available("i1")
+    assert prober.snapshot()["i1"]["consecutive_failures"] == 0
+    assert prober.available_instances() == ["i1", "i2"]
+
+
+def test_unreachable_instance_is_down(stub_url):
+    prober = InstanceHealthProber(["i1"], http_check("http://127.0.0.1:1/{instance_id}", 1), interval_seconds=1,
+                                  failure_threshold=1)
+    prober.probe_once()
+    assert prober.available_instances() == []
+
+
+def test_no_instances():
+    prober = InstanceHealthProber([], lambda instance_id: None, interval_seconds=1, failure_threshold=1)
+    prober.probe_once()
+    assert prober.available_instances() == []
+    assert not prober.is_known("i1")
+
+
+def test_request_to_unknown_instance_is_rejected():
+    response = main.flask_app.test_client().get("/controller/request?id=1&instance_id=unknown")
+    assert response.status_code == 404
+
+
+def test_health_url_defaults_to_the_stub(monkeypatch, caplog):
+    monkeypatch.delenv("RESOURCECONTROL_HEALTH_URL", raising=False)
+    instance_health_prober_from_env()
+    assert "dev-only stub endpoint" in caplog.text
+    assert main.flask_app.test_client().get("/controller/stub_health/i1").status_code == 200
+
+
+def test_stub_is_disabled_with_a_real_health_url(monkeypatch):
+    monkeypatch.setenv("RESOURCECONTROL_HEALTH_URL", "http://instances/{instance_id}/health")
+    assert main.flask_app.test_client().get("/controller/stub_health/i1").status_code == 404
+
+
+def test_denied_request_is_retried_with_the_same_key(monkeypatch):
+    instance_id = SPOT_INSTANCE_IDS[0]
+    monkeypatch.setattr(main.instance_health_prober, "is_available", lambda i: False)
+    client = main.flask_app.test_client()
+    url = f"/controller/request?id=denied-then-accepted&instance_id={instance_id}"
+    denied = client.get(url, headers={"Idempotency-Key": "k1"})
+    assert denied.status_code == 503
+    assert denied.headers["Retry-After"] == "5"
+
+    # the denial isn't kept: the retry is routed again once the instance is back
+    monkeypatch.setattr(main.instance_health_prober, "is_available", lambda i: True)
+    monkeypatch.setattr(main.client, "invoke_rpc", lambda *args: True)
+    accepted = client.get(url, headers={"Idempotency-Key": "k1"})
+    assert (accepted.status_code, accepted.data) == (200, b"request is accepted")
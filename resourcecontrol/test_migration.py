@@ -0,0 +1,41 @@
+import pytest
+
+from migration import assign_children
+
+
+def children(count: int):
+    return [f"processing-{i}" for i in range(count)]
+
+
+def test_children_go_to_the_most_spare_capacity_first():
+    assignments = assign_children(children(4), {"i1": 1, "i2": 4})
+    # i2 takes 3 to get down to the spare capacity of i1, then i1 takes the last one
+    assert assignments == {"i2": children(3), "i1": ["processing-3"]}
+
+
+def test_every_child_is_assigned_once():
+    assignments = assign_children(children(10), {"i1": 3, "i2": 2, "i3": 5})
+    assigned = [child for target_children in assignments.values() for child in target_children]
+    assert sorted(assigned) == sorted(children(10))
+    # filled up to the same spare capacity left: 3-3=0, 2-2=0, 5-5=0
+    assert {target: len(target_children) for target, target_children in assignments.items()} == {
+        "i1": 3, "i2": 2, "i3": 5,
+    }
+
+
+def test_over_capacity_is_spread_evenly():
+    assignments = assign_children(children(7), {"i1": 0, "i2": 1})
+    # i2 takes one to get even, then they take turns
+    assert {target: len(target_children) for target, target_children in assignments.items()} == {"i1": 3, "i2": 4}
+
+
+def test_instances_shut_down_are_skipped():
+    assignments = assign_children(children(3), {"i1": -1, "i2": 0})
+    assert list(assignments) == ["i2"]
+
+
+def test_no_instance_to_move_to():
+    with pytest.raises(RuntimeError):
+        assign_children(children(1), {"i1": -1})
+    with pytest.raises(RuntimeError):
+        assign_children(children(1), {})
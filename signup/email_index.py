@@ -0,0 +1,62 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+
+class EmailIndex:
+    """
+    Maps a sign-up email to its workflow id, so that a verification link carrying only the email can be routed
+    with a single primary key lookup.
+    This is a local SQLite stand-in for a key-value store in production.
+
+    Writes are idempotent: SubmitState may be retried by iWF, and writing the same (email, workflow_id) again
+    is a no-op. A newer sign-up with the same email replaces the older mapping.
+
+    The database is opened on first use, not when the index is created, so importing the sample doesn't create it.
+    """
+
+    def __init__(self, db_path: str):
+        self._db_path = db_path
+        self._local = threading.local()
+
+    def put(self, email: str, workflow_id: str):
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT INTO signup_email_index (email, workflow_id, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(email) DO UPDATE SET workflow_id = excluded.workflow_id, updated_at = excluded.updated_at "
+                "WHERE workflow_id != excluded.workflow_id",
+                (_normalize(email), workflow_id, int(time.time())),
+            )
+
+    def get_workflow_id(self, email: str) -> Optional[str]:
+        row = self._conn().execute(
+            "SELECT workflow_id FROM signup_email_index WHERE email = ?", (_normalize(email),)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite connections can't be shared across threads, so keep one per Flask worker thread
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._db_path)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS signup_email_index ("
+                "email TEXT PRIMARY KEY, workflow_id TEXT NOT NULL, updated_at INTEGER NOT NULL)"
+            )
+            self._local.conn = conn
+        return conn
+
+
+def email_index_from_env() -> EmailIndex:
+    return EmailIndex(os.environ.get("SIGNUP_EMAIL_INDEX_DB", "signup_email_index.db"))
+
+
+email_index = email_index_from_env()
+
+
+def _normalize(email: str) -> str:
+    return email.strip().lower()
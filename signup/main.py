@@ -10,14 +10,31 @@ from iwf.worker_service import (
     WorkerService,
 )
 
-from signup.iwf_config import client, worker_service
+from common.admission_control import install_admission_control
+from common.callback_recorder import install_callback_recorder
+from common.idempotency import idempotency_store_from_env, idempotent
+from common.metrics_routes import install_metrics_routes
+from common.structured_logging import configure_logging
+
+from signup.email_index import email_index
+from signup.iwf_config import client, registry, worker_service
 from signup.signup_workflow import UserSignupWorkflow, Form
+from signup.verification_token import InvalidTokenError, parse_token
 
 flask_app = Flask(__name__)
+configure_logging(flask_app)
+admission_controller = install_admission_control(flask_app, registry)
+callback_recorder = install_callback_recorder(flask_app)
+idempotency_store = idempotency_store_from_env()
+# http://localhost:8802/metrics/<name>, see common/metrics_routes.py
+install_metrics_routes(flask_app, worker_service, admission_controller, callback_recorder, {
+    "idempotency": idempotency_store.stats,
+})
 
 
 # http://localhost:8802/signup/submit?username=test1&email=abc@c.com
 @flask_app.route("/signup/submit")
+@idempotent(idempotency_store)
 def signup_submit():
     username = request.args["username"]
     email = request.args["email"]
@@ -31,12 +48,24 @@ def signup_submit():
     return "workflow started"
 
 
+# http://localhost:8802/signup/verify?token=<token from the email>&source=email
+# http://localhost:8802/signup/verify?email=abc@c.com&source=email
 # http://localhost:8802/signup/verify?username=test1&source=email
 @flask_app.route("/signup/verify")
 def signup_verify():
-    username = request.args["username"]
     source = request.args["source"]
-    return client.invoke_rpc(username, UserSignupWorkflow.verify, source)
+    if "token" in request.args:
+        try:
+            workflow_id = parse_token(request.args["token"]).workflow_id
+        except InvalidTokenError as e:
+            return f"invalid verification link: {e}", 400
+    elif "email" in request.args:
+        workflow_id = email_index.get_workflow_id(request.args["email"])
+        if workflow_id is None:
+            return "no sign-up found for the email", 404
+    else:
+        workflow_id = request.args["username"]
+    return client.invoke_rpc(workflow_id, UserSignupWorkflow.verify, source)
 
 
 # http://localhost:8802/signup/describe?username=test1
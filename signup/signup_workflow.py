@@ -1,3 +1,4 @@
+import logging
 from dataclasses import dataclass
 
 from iwf.command_request import CommandRequest, InternalChannelCommand, TimerCommand
@@ -14,6 +15,11 @@ from iwf.workflow import ObjectWorkflow
 from iwf.workflow_context import WorkflowContext
 from iwf.workflow_state import T, WorkflowState
 
+from signup.email_index import email_index
+from signup.verification_token import issue_token
+
+logger = logging.getLogger(__name__)
+
 
 @dataclass
 class Form:
@@ -23,10 +29,46 @@ class Form:
     lastname: str
 
 
+@dataclass
+class ReminderPolicy:
+    # interval before the first reminder, then multiplied by backoff_coefficient for each next one
+    initial_interval_seconds: int
+    backoff_coefficient: float
+    max_interval_seconds: int
+    # stop sending reminders after this many
+    max_reminders: int
+    # what to do after the last reminder: "dormant" keeps waiting for verification without any timer,
+    # "complete" closes the workflow
+    after_max_reminders: str
+
+    def get_interval_seconds(self, reminder_count: int) -> int:
+        interval = self.initial_interval_seconds * (self.backoff_coefficient ** reminder_count)
+        return int(min(interval, self.max_interval_seconds))
+
+
+AFTER_MAX_REMINDERS_DORMANT = "dormant"
+AFTER_MAX_REMINDERS_COMPLETE = "complete"
+
+# use 10 seconds as the first interval for demo, a real system would start with hours
+DEFAULT_REMINDER_POLICY = ReminderPolicy(
+    initial_interval_seconds=10,
+    backoff_coefficient=2,
+    max_interval_seconds=86400,
+    max_reminders=5,
+    after_max_reminders=AFTER_MAX_REMINDERS_DORMANT,
+)
+
 data_attribute_form = "form"
 verify_channel = "verify"
 data_attribute_status = "status"
 data_attribute_verified_source = "source"
+data_attribute_reminder_policy = "reminderPolicy"
+data_attribute_reminder_count = "reminderCount"
+
+
+def get_reminder_policy(persistence: Persistence) -> ReminderPolicy:
+    # the workflows started before the policy existed don't have it
+    return persistence.get_data_attribute(data_attribute_reminder_policy) or DEFAULT_REMINDER_POLICY
 
 
 class SubmitState(WorkflowState[Form]):
@@ -40,7 +82,14 @@ class SubmitState(WorkflowState[Form]):
     ) -> StateDecision:
         persistence.set_data_attribute(data_attribute_form, input)
         persistence.set_data_attribute(data_attribute_status, "waiting")
-        print(f"API to send verification email to {input.email}")
+        persistence.set_data_attribute(data_attribute_reminder_policy, DEFAULT_REMINDER_POLICY)
+        persistence.set_data_attribute(data_attribute_reminder_count, 0)
+        # so that a link with only the email can still find the workflow
+        email_index.put(input.email, ctx.workflow_id)
+        # the token carries the workflow id, so the link can be routed without any lookup
+        token = issue_token(ctx.workflow_id, input.email)
+        logger.info("API to send verification email to %s with link /signup/verify?token=%s&source=email",
+                    input.email, token)
         return StateDecision.single_next_state(VerifyState)
 
 
@@ -52,8 +101,10 @@ class VerifyState(WorkflowState[None]):
         persistence: Persistence,
         communication: Communication,
     ) -> CommandRequest:
+        policy = get_reminder_policy(persistence)
+        reminder_count = persistence.get_data_attribute(data_attribute_reminder_count) or 0
         return CommandRequest.for_any_command_completed(
-            TimerCommand.by_seconds(10),  # use 10 seconds for demo
+            TimerCommand.by_seconds(policy.get_interval_seconds(reminder_count)),
             InternalChannelCommand.by_name(verify_channel),
         )
 
@@ -70,22 +121,60 @@ class VerifyState(WorkflowState[None]):
             command_results.internal_channel_commands[0].status
             == ChannelRequestStatus.RECEIVED
         ):
-            print(f"API to send welcome email to {form.email}")
+            logger.info("API to send welcome email to %s", form.email)
             return StateDecision.graceful_complete_workflow("done")
         else:
-            print(f"API to send the a reminder email to {form.email}")
-            return StateDecision.single_next_state(VerifyState)
+            logger.info("API to send the a reminder email to %s", form.email)
+            policy = get_reminder_policy(persistence)
+            reminder_count = (persistence.get_data_attribute(data_attribute_reminder_count) or 0) + 1
+            persistence.set_data_attribute(data_attribute_reminder_count, reminder_count)
+            if reminder_count < policy.max_reminders:
+                return StateDecision.single_next_state(VerifyState)
+            # no more reminders, so that an abandoned sign-up stops producing timers
+            if policy.after_max_reminders == AFTER_MAX_REMINDERS_COMPLETE:
+                persistence.set_data_attribute(data_attribute_status, "abandoned")
+                return StateDecision.graceful_complete_workflow("abandoned")
+            persistence.set_data_attribute(data_attribute_status, "dormant")
+            return StateDecision.single_next_state(DormantState)
+
+
+class DormantState(WorkflowState[None]):
+    def wait_until(
+        self,
+        ctx: WorkflowContext,
+        input: T,
+        persistence: Persistence,
+        communication: Communication,
+    ) -> CommandRequest:
+        # no timer here, the workflow stays idle until the user verifies or the workflow times out
+        return CommandRequest.for_any_command_completed(
+            InternalChannelCommand.by_name(verify_channel),
+        )
+
+    def execute(
+        self,
+        ctx: WorkflowContext,
+        input: T,
+        command_results: CommandResults,
+        persistence: Persistence,
+        communication: Communication,
+    ) -> StateDecision:
+        form = persistence.get_data_attribute(data_attribute_form)
+        logger.info("API to send welcome email to %s", form.email)
+        return StateDecision.graceful_complete_workflow("done")
 
 
 class UserSignupWorkflow(ObjectWorkflow):
     def get_workflow_states(self) -> StateSchema:
-        return StateSchema.with_starting_state(SubmitState(), VerifyState())
+        return StateSchema.with_starting_state(SubmitState(), VerifyState(), DormantState())
 
     def get_persistence_schema(self) -> PersistenceSchema:
         return PersistenceSchema.create(
             PersistenceField.data_attribute_def(data_attribute_form, Form),
             PersistenceField.data_attribute_def(data_attribute_status, str),
             PersistenceField.data_attribute_def(data_attribute_verified_source, str),
+            PersistenceField.data_attribute_def(data_attribute_reminder_policy, ReminderPolicy),
+            PersistenceField.data_attribute_def(data_attribute_reminder_count, int),
         )
 
     def get_communication_schema(self) -> CommunicationSchema:
@@ -110,10 +199,12 @@ class UserSignupWorkflow(ObjectWorkflow):
         communication.publish_to_internal_channel(verify_channel)
         return "done"
 
+    # describe is read-only, so it doesn't take the lock. Otherwise every status read would be serialized with
+    # verify and all the other reads on the same workflow.
     @rpc(
         data_attribute_loading_policy=PersistenceLoadingPolicy(
-            persistence_loading_type=PersistenceLoadingType.LOAD_PARTIAL_WITH_EXCLUSIVE_LOCK,
-            locking_keys=[data_attribute_form, data_attribute_status, data_attribute_verified_source],
+            persistence_loading_type=PersistenceLoadingType.LOAD_PARTIAL_WITHOUT_LOCKING,
+            partial_loading_keys=[data_attribute_form, data_attribute_status, data_attribute_verified_source],
         )
     )
     def describe(self, persistence: Persistence) -> tuple:
@@ -0,0 +1,52 @@
+from signup.signup_workflow import (
+    AFTER_MAX_REMINDERS_DORMANT,
+    DEFAULT_REMINDER_POLICY,
+    ReminderPolicy,
+    data_attribute_reminder_policy,
+    get_reminder_policy,
+)
+
+
+class FakePersistence:
+    def __init__(self, data_attributes):
+        self._data_attributes = data_attributes
+
+    def get_data_attribute(self, key):
+        return self._data_attributes.get(key)
+
+
+def test_reminder_intervals_back_off_up_to_the_max():
+    policy = ReminderPolicy(
+        initial_interval_seconds=10,
+        backoff_coefficient=3,
+        max_interval_seconds=200,
+        max_reminders=5,
+        after_max_reminders=AFTER_MAX_REMINDERS_DORMANT,
+    )
+    assert [policy.get_interval_seconds(count) for count in range(5)] == [10, 30, 90, 200, 200]
+
+
+def test_constant_reminder_interval():
+    policy = ReminderPolicy(
+        initial_interval_seconds=60,
+        backoff_coefficient=1,
+        max_interval_seconds=3600,
+        max_reminders=3,
+        after_max_reminders=AFTER_MAX_REMINDERS_DORMANT,
+    )
+    assert [policy.get_interval_seconds(count) for count in range(3)] == [60, 60, 60]
+
+
+def test_reminder_policy_of_the_workflow():
+    policy = ReminderPolicy(
+        initial_interval_seconds=1,
+        backoff_coefficient=2,
+        max_interval_seconds=8,
+        max_reminders=1,
+        after_max_reminders=AFTER_MAX_REMINDERS_DORMANT,
+    )
+    assert get_reminder_policy(FakePersistence({data_attribute_reminder_policy: policy})) is policy
+
+
+def test_workflows_started_before_the_policy_use_the_default():
+    assert get_reminder_policy(FakePersistence({})) is DEFAULT_REMINDER_POLICY
@@ -0,0 +1,76 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+# the secret to sign the tokens, all the worker and API instances must share the same one
+SECRET_ENV = "SIGNUP_TOKEN_SECRET"
+DEFAULT_SECRET = "iwf-signup-demo-secret"  # only for running the sample locally
+DEFAULT_TTL_SECONDS = 7 * 86400
+
+
+class InvalidTokenError(Exception):
+    pass
+
+
+@dataclass
+class VerificationToken:
+    workflow_id: str
+    email: str
+    expire_at_seconds: int
+
+
+def issue_token(workflow_id: str, email: str, ttl_seconds: int = DEFAULT_TTL_SECONDS,
+                secret: Optional[str] = None) -> str:
+    """
+    Issue a signed token that carries the workflow id, so the verification link can be routed to the workflow
+    without any lookup. The token is `<payload>.<signature>`, both url-safe base64.
+    """
+    payload = json.dumps(
+        {"wid": workflow_id, "email": email, "exp": int(time.time()) + ttl_seconds},
+        separators=(",", ":"),
+    ).encode()
+    encoded_payload = _b64encode(payload)
+    return encoded_payload + "." + _b64encode(_sign(encoded_payload, secret))
+
+
+def parse_token(token: str, secret: Optional[str] = None) -> VerificationToken:
+    """
+    Check the signature and expiration of a token issued by issue_token, and return what it carries.
+    Raises InvalidTokenError if the token is malformed, tampered or expired.
+    """
+    encoded_payload, _, encoded_signature = token.partition(".")
+    if not encoded_payload or not encoded_signature:
+        raise InvalidTokenError("malformed token")
+    try:
+        signature = _b64decode(encoded_signature)
+        payload = json.loads(_b64decode(encoded_payload))
+    except ValueError:
+        raise InvalidTokenError("malformed token")
+    if not hmac.compare_digest(signature, _sign(encoded_payload, secret)):
+        raise InvalidTokenError("invalid signature")
+    if payload["exp"] < time.time():
+        raise InvalidTokenError("token expired")
+    return VerificationToken(
+        workflow_id=payload["wid"],
+        email=payload["email"],
+        expire_at_seconds=payload["exp"],
+    )
+
+
+def _sign(encoded_payload: str, secret: Optional[str]) -> bytes:
+    if secret is None:
+        secret = os.environ.get(SECRET_ENV, DEFAULT_SECRET)
+    return hmac.new(secret.encode(), encoded_payload.encode(), hashlib.sha256).digest()
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))